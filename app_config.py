@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Cấu hình chung cho dashboard và các công cụ chạy ngoài Streamlit (báo cáo, benchmark)
+"""
+
+import os
+
+CONFIG = {
+    'google_credentials': 'api-agent-471608-912673253587.json',
+    'google_sheet_url': 'https://docs.google.com/spreadsheets/d/1F2NzTR50kXzGx9Pc5KdBwwqnIRXGvViPv6mgw8YMNW0/edit',
+    # PHTCV lưu trữ của các năm đã đóng (spreadsheet / sheet riêng mỗi năm), ghép với sheet đang ghi ở trên:
+    # vd. [{'url': 'https://docs.google.com/spreadsheets/d/.../edit', 'sheet': 'PHTCV'}, ...]
+    # Tải song song (archive_workers luồng) một lần rồi giữ vĩnh viễn trong archive_cache_dir
+    # (xóa file trong thư mục này để tải lại); không ghép khi dùng kho PHTCV_STORE
+    'phtcv_archives': [],
+    'archive_workers': 4,
+    'archive_cache_dir': os.path.join('.cache', 'archives'),
+    'lathe_machines': ['48', '50', '51', '52', '54', '55', '56', '57', '58', '59', '60', '61'],
+    'departments': ['Sản xuất 1', 'Sản xuất 2'],
+    # Nguồn dữ liệu: 'sheets' = Google Sheets, hoặc đường dẫn file xuất cục bộ (.csv / .xlsx / .xlsx có mật khẩu)
+    'data_source': os.environ.get('PHTCV_SOURCE', 'sheets'),
+    'data_source_password': os.environ.get('PHTCV_PASSWORD', ''),
+    # Nguồn .csv: file CSV của các sheet phụ, vd. {'machine_list': 'machine_list.csv'}
+    'local_extra_paths': {},
+    # Nguồn file cục bộ: chu kỳ kiểm tra file thay đổi (giây, chỉ stat file)
+    'local_check_seconds': 30,
+    # Đồng bộ tăng dần PHTCV: số dòng cuối dùng để phát hiện sửa tại chỗ, chu kỳ tải lại toàn bộ (giây)
+    'phtcv_probe_rows': 50,
+    'phtcv_full_reload_seconds': 3600,
+    # Tải toàn bộ PHTCV theo khối N dòng (mỗi khối một lần gọi API / một lượt đọc file), làm sạch từng khối
+    # rồi ghi vào kho hoặc nối một lần -> bộ nhớ đỉnh không tăng theo kích thước sheet; 0 = đọc một lần
+    'phtcv_chunk_rows': int(os.environ.get('PHTCV_CHUNK_ROWS', '0')),
+    # Thời gian dữ liệu Google Sheets được coi là mới (giây), quá hạn thì làm mới nền
+    'data_ttl_seconds': 300,
+    # Giới hạn gọi Google Sheets API mỗi tiến trình (quota đọc: 60 lần/phút/người dùng) và số lần thử lại
+    # khi bị giới hạn quota / lỗi tạm thời (backoff lũy thừa 1, 2, 4... giây)
+    'sheets_max_calls_per_minute': 50,
+    'sheets_max_retries': 5,
+    # Làm mới nền lỗi liên tiếp: chờ 30, 60, 120... giây trước lần thử sau, tối đa giá trị này
+    'max_retry_after_seconds': 900,
+    # Các sheet đọc kèm PHTCV trong cùng một lần gọi API (đọc toàn bộ sheet)
+    'batch_sheets': ['machine_list'],
+    # Số kết quả công suất/bảng thống kê máy được nhớ (theo phiên bản dữ liệu + bộ lọc)
+    'capacity_memo_entries': 512,
+    # Xuất file: gợi ý CSV khi số dòng vượt ngưỡng này
+    'export_csv_suggest_rows': 200000,
+    # Snapshot cục bộ của dữ liệu đã làm sạch, giúp khởi động nhanh sau khi deploy/restart
+    'phtcv_snapshot_path': os.path.join('.cache', 'phtcv_snapshot.parquet'),
+    # Thư mục cache dùng chung giữa nhiều replica (cùng volume): khóa làm mới + snapshot; rỗng = tắt
+    # Khi bật, mỗi chu kỳ data_ttl_seconds chỉ một tiến trình gọi Google Sheets, các tiến trình khác đọc
+    # snapshot nó ghi (kho PHTCV_STORE, nếu dùng, cũng nên đặt trong thư mục này)
+    'shared_cache_dir': os.environ.get('SHARED_CACHE_DIR', ''),
+    # Kho SQLite cho dữ liệu nhiều năm (vd. '.cache/phtcv.sqlite'): dữ liệu Google Sheets ghi vào kho,
+    # lọc/cộng dồn chạy bằng SQL theo khoảng ngày đã chọn thay vì giữ toàn bộ trong bộ nhớ; rỗng = tắt
+    'phtcv_store_path': os.environ.get('PHTCV_STORE', ''),
+    # Biểu đồ xếp chồng tự chuyển sang chế độ gọn (không nhãn chữ/customdata) khi số cột vượt ngưỡng này
+    'chart_compact_categories': 12,
+    # Xu hướng theo tháng: số tháng hiển thị, thư mục lưu tổng các tháng đã đóng (rỗng = chỉ nhớ trong bộ nhớ)
+    'trend_months': [12, 24],
+    'trend_cache_dir': os.path.join('.cache', 'trend'),
+    # Log JSON đo hiệu năng từng bước: '-' = stderr, đường dẫn = ghi file, rỗng = tắt
+    'perf_log': os.environ.get('PERF_LOG', '')
+}
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Cache kiểu stale-while-revalidate: luôn trả ngay giá trị tốt gần nhất,
+khi hết hạn thì làm mới ở luồng nền và thay giá trị một cách nguyên tử
+(không phụ thuộc Streamlit)
+"""
+
+import threading
+import time
+
+
+class StaleWhileRevalidate:
+    """
+    loader() trả về giá trị mới hoặc raise nếu lỗi
+    - Chưa có giá trị: get() tải đồng bộ (chỉ một luồng tải, các luồng khác chờ)
+    - Hết hạn ttl: get() trả giá trị cũ, khởi động một luồng nền tải giá trị mới
+    - Lỗi khi làm mới: giữ giá trị cũ, lưu lỗi vào last_error; lỗi liên tiếp thì giãn
+      khoảng chờ trước lần thử sau theo lũy thừa 2 (retry_after, 2x, 4x... tối đa max_retry_after)
+    """
+
+    def __init__(self, loader, ttl, retry_after=30, max_retry_after=900):
+        self.loader = loader
+        self.ttl = ttl
+        self.retry_after = retry_after  # Khoảng chờ tối thiểu giữa hai lần thử sau khi lỗi
+        self.max_retry_after = max_retry_after
+        self.failures = 0               # Số lần làm mới lỗi liên tiếp
+        self._state = (None, None)      # (value, loaded_at) - thay cả cặp một lần để đọc luôn nhất quán
+        self._load_lock = threading.Lock()
+        self._thread = None
+        self._expired = False
+        self._last_attempt = 0.0
+        self.last_error = None
+
+    @property
+    def value(self):
+        return self._state[0]
+
+    @property
+    def loaded_at(self):
+        """Thời điểm (epoch) của giá trị đang phục vụ"""
+        return self._state[1]
+
+    @property
+    def age(self):
+        """Tuổi (giây) của giá trị đang phục vụ, None nếu chưa có"""
+        loaded_at = self.loaded_at
+        return None if loaded_at is None else time.time() - loaded_at
+
+    @property
+    def refreshing(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def next_retry_after(self):
+        """Khoảng chờ (giây) sau lần lỗi gần nhất trước khi thử làm mới lại"""
+        if not self.failures:
+            return 0
+        return min(self.retry_after * 2 ** (self.failures - 1), self.max_retry_after)
+
+    def seed(self, value, loaded_at):
+        """Đặt giá trị ban đầu (vd. từ snapshot trên đĩa) nếu chưa có"""
+        if self.value is None:
+            self._state = (value, loaded_at)
+
+    def invalidate(self):
+        """Đánh dấu hết hạn, lần get() sau sẽ làm mới nền"""
+        self._expired = True
+
+    def get(self):
+        """Giá trị hiện tại (có thể cũ), None nếu chưa tải được lần nào"""
+        value, loaded_at = self._state
+        if value is None:
+            with self._load_lock:
+                if self.value is None:  # Luồng khác có thể vừa tải xong trong lúc chờ
+                    self._load()
+            return self.value
+
+        if self._expired or time.time() - loaded_at > self.ttl:
+            self._start_background_refresh()
+        return value
+
+    def refresh(self):
+        """Tải đồng bộ giá trị mới (dùng cho lần đầu hoặc nút làm mới thủ công)"""
+        with self._load_lock:
+            self._load()
+        return self.value
+
+    def _load(self):
+        self._last_attempt = time.time()
+        try:
+            value = self.loader()
+        except Exception as e:
+            self.last_error = e
+            self.failures += 1
+            return
+        self._state = (value, time.time())
+        self._expired = False
+        self.last_error = None
+        self.failures = 0
+
+    def _start_background_refresh(self):
+        if self.last_error is not None and time.time() - self._last_attempt < self.next_retry_after:
+            return
+        if self.refreshing or not self._load_lock.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self._load()
+            finally:
+                self._load_lock.release()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark các bước tính công suất trên dữ liệu PHTCV giả lập (không cần Streamlit/Google Sheets)
+Đo thời gian và bộ nhớ đỉnh của từng bước theo kích thước dữ liệu để phát hiện chậm đi
+
+Cách dùng:
+    python bench_capacity.py                                   # 10k, 100k, 1M dòng
+    python bench_capacity.py --sizes 10000 5000000 --repeat 3
+    python bench_capacity.py --json bench.json                 # lưu kết quả
+    python bench_capacity.py --baseline bench.json             # so với kết quả đã lưu
+"""
+
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from app_config import CONFIG
+from capacity_charts import create_stacked_bar_chart
+from capacity_core import (
+    DailyCubeBuilder, aggregate_components, aggregate_explanations, build_daily_cube,
+    calculate_capacity_by_type, calculate_machine_counts, find_full_stop_machines, full_stop_days,
+    machine_stats_table, rollup_cube, utilization_days
+)
+from phtcv_data import DateIndex, append_rows, clean_phtcv_rows
+
+HEADER = ['ngày tháng', 'bộ phận', 'số máy', 'sl thực tế', 'tgcb', 'chạy thử', 'gá lắp',
+          'gia công', 'dừng', 'dừng khác', 'sửa', 'giải trình']
+
+REASONS = ['Chờ vật tư', 'Hỏng dao', 'Bảo dưỡng', 'Chờ bản vẽ', 'Mất điện']
+
+
+def make_machines(n_machines=70):
+    """Danh sách máy giả lập (gồm các máy tiện trong CONFIG) và phân xưởng của từng máy"""
+    machines = [str(i) for i in range(1, n_machines + 1)]
+    for m in CONFIG['lathe_machines']:
+        if m not in machines:
+            machines.append(m)
+    departments = CONFIG['departments']
+    dept_of = {m: departments[i % len(departments)] for i, m in enumerate(machines)}
+    return machines, dept_of
+
+
+def _numbers(rng, n, values, p_empty):
+    """Cột số dạng chuỗi như Google Sheets trả về: ô trống hoặc số có dấu phẩy thập phân"""
+    text = np.array([f'{v:g}'.replace('.', ',') for v in values])[rng.integers(0, len(values), n)]
+    return np.where(rng.random(n) < p_empty, '', text)
+
+
+def make_phtcv_rows(n_rows, seed=0, months=12, year=2025, n_machines=70):
+    """
+    Dữ liệu thô giả lập của sheet PHTCV (header, dòng) với các cột như sheet thật:
+    ngày tháng dd/mm/yyyy, sl thực tế có dấu phẩy thập phân, các cột thời gian (dừng có
+    các giá trị bằng thời gian ca), giải trình phần lớn để trống
+    """
+    rng = np.random.default_rng(seed)
+    machines, dept_of = make_machines(n_machines)
+
+    days = rng.integers(1, 29, n_rows)
+    month_nums = rng.integers(1, months + 1, n_rows)
+    dates = [f'{d:02d}/{m:02d}/{year}' for d, m in zip(days.tolist(), month_nums.tolist())]
+
+    machine_idx = rng.integers(0, len(machines), n_rows)
+    machine = np.array(machines, dtype=object)[machine_idx]
+    dept = np.array([dept_of[m] for m in machines], dtype=object)[machine_idx]
+
+    columns = {
+        'ngày tháng': dates,
+        'bộ phận': dept.tolist(),
+        'số máy': machine.tolist(),
+        'sl thực tế': _numbers(rng, n_rows, [1, 2, 3, 4, 1.5, 2.5, 10], 0.2).tolist(),
+        'tgcb': _numbers(rng, n_rows, [5, 10, 15, 30], 0.6).tolist(),
+        'chạy thử': _numbers(rng, n_rows, [5, 10, 20], 0.8).tolist(),
+        'gá lắp': _numbers(rng, n_rows, [2, 5, 7.5, 10], 0.5).tolist(),
+        'gia công': _numbers(rng, n_rows, [3, 8.5, 12, 25, 40], 0.3).tolist(),
+        'dừng': _numbers(rng, n_rows, [15, 30, 60, 420, 630, 660], 0.85).tolist(),
+        'dừng khác': _numbers(rng, n_rows, [10, 45, 420, 660], 0.9).tolist(),
+        'sửa': _numbers(rng, n_rows, [10, 30, 60], 0.95).tolist(),
+        'giải trình': np.where(rng.random(n_rows) < 0.9, '', rng.choice(REASONS, n_rows)).tolist(),
+    }
+    rows = [list(r) for r in zip(*(columns[c] for c in HEADER))]
+    return list(HEADER), rows, machines
+
+
+# Chênh lệch tuyệt đối nhỏ hơn mức này (giây) không coi là chậm đi (nhiễu đo)
+MIN_REGRESSION_SECONDS = 0.005
+
+
+def measure(fn, repeat=1, memory=True):
+    """
+    (thời gian tốt nhất giây, bộ nhớ đỉnh MB, kết quả)
+    Bộ nhớ đo ở một lần chạy riêng có tracemalloc (tracemalloc làm chậm nên không tính giờ lần này)
+    """
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        del result
+        gc.collect()
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    if not memory:
+        return best, None, result
+
+    del result
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak / 1024 / 1024, result
+
+
+def run_size(n_rows, repeat=1, seed=0, memory=True):
+    """Chạy tất cả các bước cho một kích thước dữ liệu, trả về {bước: (giây, MB)}"""
+    header, rows, machines = make_phtcv_rows(n_rows, seed)
+    lathe = CONFIG['lathe_machines']
+    departments = CONFIG['departments']
+    results = {}
+
+    def stage(name, fn):
+        seconds, peak_mb, result = measure(fn, repeat, memory)
+        results[name] = (seconds, peak_mb)
+        return result
+
+    # Ingest như read_phtcv_data: làm sạch dòng thô + dựng chỉ mục ngày
+    date_index = stage('ingest', lambda: DateIndex(clean_phtcv_rows(header, rows, lathe)))
+
+    # Làm mới khi sheet nối thêm 1% dòng: cộng cube của phần dòng mới vào cube đã có
+    n_new = max(1, n_rows // 100)
+    base_index = DateIndex(clean_phtcv_rows(header, rows[:-n_new], lathe), version=1)
+    new_df = clean_phtcv_rows(header, rows[-n_new:], lathe)
+    grown_index = DateIndex(append_rows(base_index.df, new_df), version=2)
+    grown_index.deltas = [(base_index.version, new_df)]
+    builder = DailyCubeBuilder(lathe)
+    base_cube = builder.update(base_index)
+    del rows
+
+    def append_cube():
+        builder.index = base_cube
+        return builder.update(grown_index)
+
+    stage('daily_cube_append_1pct', append_cube)
+    del base_index, grown_index, base_cube, builder
+
+    month = date_index.month_options()[0]
+    day = date_index.day_options(month)[0]
+    stage('filter_month', lambda: date_index.select(month))
+    stage('filter_day', lambda: date_index.select(month, day))
+
+    df = date_index.df
+    stage('calculate_capacity_by_type', lambda: [
+        calculate_capacity_by_type(df[df['bộ phận'] == dept], t, lathe)
+        for dept in departments for t in ('lathe', 'milling', 'all')
+    ])
+    stage('calculate_machine_counts', lambda: [
+        calculate_machine_counts(df[df['bộ phận'] == dept], t, dept, lathe)
+        for dept in departments for t in ('lathe', 'milling')
+    ])
+
+    def machine_stats():
+        agg = aggregate_components(df, lathe)
+        explanations = aggregate_explanations(df)
+        return [machine_stats_table(agg, dept, explanations) for dept in departments]
+
+    stage('machine_stats', machine_stats)
+
+    cube = stage('daily_cube', lambda: DateIndex(build_daily_cube(df, lathe), date_col='day'))
+    stage('cube_rollup_month', lambda: rollup_cube(cube.select(month)))
+    stage('full_stop_100', lambda: [
+        find_full_stop_machines(cube.df, dept, machines, lathe) for dept in departments
+    ])
+    stage('full_stop_days_month', lambda: [
+        full_stop_days(cube.select(month), dept, machines, lathe) for dept in departments
+    ])
+    stage('utilization_days_month', lambda: [
+        utilization_days(cube.select(month), dept) for dept in departments
+    ])
+
+    capacities = calculate_capacity_by_type(df[df['bộ phận'] == departments[0]], 'all', lathe)
+    data_dict = {'TỔNG CS MÁY TIỆN': capacities, 'TỔNG CS MÁY PHAY': capacities, 'TỔNG CỘNG': capacities}
+    stage('create_stacked_bar_chart', lambda: create_stacked_bar_chart(data_dict, 'Benchmark'))
+    return results
+
+
+def print_results(n_rows, results, baseline=None, tolerance=0.2):
+    """In bảng kết quả; đánh dấu '!' các bước chậm hơn baseline quá tolerance. Trả về số bước chậm đi"""
+    print(f"\n== {n_rows:,} dòng ==")
+    print(f"{'Bước':<28}{'Thời gian (s)':>15}{'Bộ nhớ đỉnh (MB)':>19}{'So với baseline':>18}")
+    regressions = 0
+    for name, (seconds, peak_mb) in results.items():
+        compare = ''
+        if baseline and name in baseline:
+            base_seconds = baseline[name][0]
+            ratio = seconds / base_seconds if base_seconds else float('inf')
+            slower = ratio > 1 + tolerance and seconds - base_seconds > MIN_REGRESSION_SECONDS
+            flag = '!' if slower else ' '
+            regressions += flag == '!'
+            compare = f"{flag} x{ratio:.2f}"
+        memory = '-' if peak_mb is None else f"{peak_mb:.1f}"
+        print(f"{name:<28}{seconds:>15.4f}{memory:>19}{compare:>18}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark các bước tính công suất')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+                        help='Số dòng PHTCV giả lập')
+    parser.add_argument('--repeat', type=int, default=1, help='Số lần đo thời gian (lấy nhanh nhất)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help='Bỏ qua đo bộ nhớ (chạy nhanh hơn)')
+    parser.add_argument('--json', help='Lưu kết quả ra file JSON')
+    parser.add_argument('--baseline', help='File JSON kết quả cũ để so sánh')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Chậm hơn baseline quá tỷ lệ này thì coi là chậm đi (mặc định 0.2 = 20%%)')
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    all_results = {}
+    regressions = 0
+    for n_rows in args.sizes:
+        results = run_size(n_rows, args.repeat, args.seed, not args.no_memory)
+        all_results[str(n_rows)] = results
+        regressions += print_results(n_rows, results, baseline.get(str(n_rows)), args.tolerance)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(all_results, f, ensure_ascii=False, indent=2)
+
+    if regressions:
+        print(f"\n! {regressions} bước chậm hơn baseline", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
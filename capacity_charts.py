@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+Biểu đồ công suất (Plotly), dùng chung cho dashboard và báo cáo tĩnh
+"""
+
+import plotly.graph_objects as go
+
+
+# Các lớp của biểu đồ xếp chồng theo thứ tự Excel (từ dưới lên):
+# (thuộc tính Capacity, tên trên chú thích, tên khi hover, màu, cỡ chữ, màu chữ, ẩn nhãn khi % <= ngưỡng)
+STACK_SEGMENTS = [
+    ('gia_cong', 'Tỷ lệ thời gian gia công', 'Gia công', '#92D050', 16, 'black', None),
+    ('ga_lap', 'Tỷ lệ thời gian gá lắp', 'Gá lắp', '#A6A6A6', 16, 'black', 3),
+    ('chay_thu', 'Tỷ lệ thời gian chạy thử', 'Chạy thử', '#9DC3E6', 14, 'black', 3),
+    ('tgcb', 'Tỷ lệ thời gian chuẩn bị', 'Chuẩn bị', '#FFD966', 14, 'black', 3),
+    ('dung', 'Tỷ lệ thời gian dừng', 'Dừng', '#FF0000', 16, 'white', 3),
+    ('sua', 'Tỷ lệ thời gian sửa hàng', 'Sửa hàng', '#FFC000', 14, 'black', 2),
+    ('dung_khac', 'Tỷ lệ thời gian dừng khác', 'Dừng khác', '#C00000', 14, 'white', 2),
+]
+
+
+def create_stacked_bar_chart(data_dict, title, compact=False):
+    """
+    Tạo biểu đồ xếp chồng theo thứ tự Excel
+    data_dict: {tên cột: Capacity}
+    Thứ tự từ dưới lên: Gia công → Gá lắp → Chạy thử → Chuẩn bị → Dừng → Sửa hàng → Dừng khác
+    compact=True: bỏ nhãn chữ trên cột và customdata (hover chỉ hiện %), giữ payload nhỏ khi có nhiều cột
+    (vd. từng máy)
+    """
+    categories = list(data_dict.keys())
+    capacities = list(data_dict.values())
+    
+    fig = go.Figure()
+    
+    for component, name, label, color, font_size, font_color, min_pct in STACK_SEGMENTS:
+        pcts = [getattr(cap, 'pct_' + component) for cap in capacities]
+        if compact:
+            fig.add_trace(go.Bar(
+                name=name,
+                x=categories,
+                y=[round(v, 2) for v in pcts],
+                marker_color=color,
+                hovertemplate=f'<b>{label}</b><br>%{{y:.1f}}%<extra></extra>'
+            ))
+            continue
+        
+        times = [getattr(cap, 'time_' + component) for cap in capacities]
+        fig.add_trace(go.Bar(
+            name=name,
+            x=categories,
+            y=pcts,
+            marker_color=color,
+            text=[f'{t:.0f}<br>{v:.0f}%' if min_pct is None or v > min_pct else '' for t, v in zip(times, pcts)],
+            textposition='inside',
+            textfont=dict(size=font_size, color=font_color),
+            hovertemplate=f'<b>{label}</b><br>%{{y:.1f}}%<br>%{{customdata[0]:.0f}} phút<extra></extra>',
+            customdata=[[t] for t in times]
+        ))
+    
+    fig.update_layout(
+        title=dict(text=title, font=dict(size=20)),
+        barmode='stack',
+        barnorm='percent',
+        yaxis=dict(
+            title=dict(text='Tỷ lệ %', font=dict(size=16)),  # Correct syntax
+            range=[0, 100],
+            tickfont=dict(size=14)
+        ),
+        xaxis=dict(title='', tickfont=dict(size=14)),
+        height=600,
+        showlegend=True,
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=-0.2,
+            xanchor="center",
+            x=0.5,
+            font=dict(size=14)
+        ),
+        hovermode='closest'
+    )
+    
+    return fig
+
+
+def create_machine_time_count_chart(data_dict, count_dict):
+    """
+    Tạo biểu đồ bar với annotations (bong bóng ghi chú) cho số máy
+    data_dict: {'Tiện SX1': time, 'Tiện SX2': time, 'Phay SX1': time, 'Phay SX2': time}
+    count_dict: {'Tiện SX1': count, 'Tiện SX2': count, 'Phay SX1': count, 'Phay SX2': count}
+    """
+    categories = list(data_dict.keys())
+    times = list(data_dict.values())
+    counts = list(count_dict.values())
+    
+    # Calculate percentages
+    total_time = sum(times)
+    percentages = [(t / total_time * 100) if total_time > 0 else 0 for t in times]
+    
+    # Colors matching Excel
+    colors = {
+        'Tiện SX1': '#C5E0B4',
+        'Tiện SX2': '#A9D08E',
+        'Phay SX1': '#00B0F0',
+        'Phay SX2': '#0070C0'
+    }
+    
+    fig = go.Figure()
+    
+    # Add bars for processing time
+    for i, cat in enumerate(categories):
+        fig.add_trace(go.Bar(
+            name=f'Thời gian gia công máy {cat.lower()}',
+            x=[cat],
+            y=[percentages[i]],
+            marker_color=colors.get(cat, '#999999'),
+            text=f'{times[i]:.0f}<br>{percentages[i]:.0f}%',
+            textposition='inside',
+            textfont=dict(size=14, color='black'),
+            showlegend=True
+        ))
+    
+    # Add annotations (callouts) for machine counts above bars
+    annotations = []
+    for i, cat in enumerate(categories):
+        annotations.append(dict(
+            x=cat,
+            y=percentages[i] + 5,  # Position above bar
+            text=f'Số máy {cat.lower()} chạy {cat.split()[1]}<br>{counts[i]}',
+            showarrow=True,
+            arrowhead=2,
+            arrowsize=1,
+            arrowwidth=1,
+            arrowcolor='#666666',
+            ax=0,
+            ay=-40,
+            font=dict(size=10, color='black'),
+            bgcolor='white',
+            bordercolor='#666666',
+            borderwidth=1,
+            borderpad=4
+        ))
+    
+    # Update layout
+    fig.update_layout(
+        title=dict(text='Thời gian + Số máy chạy phay + tiện 2 ca SX', font=dict(size=20)),
+        xaxis=dict(title='', tickfont=dict(size=14)),
+        yaxis=dict(
+            title=dict(text='Tỷ lệ %', font=dict(size=14)),
+            range=[0, 80],  # Adjusted for annotations
+            tickfont=dict(size=12)
+        ),
+        height=500,
+        showlegend=True,
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=-0.2,
+            xanchor="center",
+            x=0.5,
+            font=dict(size=11)
+        ),
+        annotations=annotations,
+        hovermode='x unified'
+    )
+    
+    return fig
+
+
+def create_trend_chart(trend, title):
+    """
+    Biểu đồ đường xu hướng theo tháng
+    trend: bảng trend_table (index tháng 'YYYY-MM', cột pct_gia_cong / pct_dung / pct_dung_khac / pct_total_stop)
+    Màu giống biểu đồ xếp chồng: gia công xanh lá, dừng đỏ, dừng khác đỏ đậm
+    """
+    series = [
+        ('pct_gia_cong', 'Tỷ lệ thời gian gia công', '#92D050', 'solid'),
+        ('pct_dung', 'Tỷ lệ thời gian dừng', '#FF0000', 'solid'),
+        ('pct_dung_khac', 'Tỷ lệ thời gian dừng khác', '#C00000', 'solid'),
+        ('pct_total_stop', 'Tổng tỷ lệ dừng', '#7F7F7F', 'dash'),
+    ]
+    months = list(trend.index)
+    
+    fig = go.Figure()
+    for col, name, color, dash in series:
+        fig.add_trace(go.Scatter(
+            name=name,
+            x=months,
+            y=trend[col],
+            mode='lines+markers',
+            line=dict(color=color, width=3, dash=dash),
+            hovertemplate=f'<b>{name}</b><br>%{{x}}<br>%{{y:.1f}}%<extra></extra>'
+        ))
+    
+    fig.update_layout(
+        title=dict(text=title, font=dict(size=20)),
+        yaxis=dict(
+            title=dict(text='Tỷ lệ %', font=dict(size=14)),
+            rangemode='tozero',
+            tickfont=dict(size=12)
+        ),
+        xaxis=dict(title='', type='category', tickfont=dict(size=12)),
+        height=450,
+        showlegend=True,
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=-0.3,
+            xanchor="center",
+            x=0.5,
+            font=dict(size=12)
+        ),
+        hovermode='x unified'
+    )
+    
+    return fig
+
+
+def create_machine_day_heatmap(matrix, machines, days, title, metric_label, colorscale='Greens'):
+    """
+    Bản đồ nhiệt máy × ngày (một trace Heatmap duy nhất cho mọi máy)
+    matrix: mảng 2 chiều tỷ lệ % [máy, ngày], NaN = không có dữ liệu (ô trống)
+    machines: số máy (trục dọc), days: DatetimeIndex (trục ngang)
+    """
+    day_labels = [d.strftime('%d/%m') for d in days]
+    machine_labels = [str(m) for m in machines]
+    
+    fig = go.Figure(go.Heatmap(
+        z=matrix,
+        x=day_labels,
+        y=machine_labels,
+        zmin=0,
+        zmax=100,
+        colorscale=colorscale,
+        colorbar=dict(title=dict(text='%'), ticksuffix='%'),
+        hoverongaps=False,
+        xgap=1,
+        ygap=1,
+        hovertemplate=f'Máy %{{y}}<br>%{{x}}<br>{metric_label}: %{{z:.1f}}%<extra></extra>'
+    ))
+    
+    fig.update_layout(
+        title=dict(text=title, font=dict(size=18)),
+        xaxis=dict(title='', type='category', tickfont=dict(size=11), side='top'),
+        yaxis=dict(title=dict(text='Số máy'), type='category', autorange='reversed', tickfont=dict(size=11)),
+        height=max(400, 18 * len(machine_labels) + 160),
+        margin=dict(t=110)
+    )
+    
+    return fig
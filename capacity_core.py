@@ -0,0 +1,582 @@
+# -*- coding: utf-8 -*-
+"""
+Bộ tính công suất: gộp toàn bộ thành phần thời gian trong MỘT lần groupby
+theo (bộ phận, tiện/phay, số máy), sau đó cộng dồn ra tổng phân xưởng,
+tổng tiện/phay, số máy chạy và bảng thống kê từng máy (không phụ thuộc Streamlit)
+"""
+
+import threading
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+
+import numpy as np
+import pandas as pd
+
+from app_config import CONFIG
+from instrumentation import cache_miss
+from phtcv_data import DateIndex, append_rows, parse_quantity
+
+# Thời gian dừng bằng đúng thời gian ca -> không tính vào dừng/dừng khác
+SHIFT_TIMES = [420, 630, 660]
+
+COMPONENTS = ['time_tgcb', 'time_chay_thu', 'time_ga_lap', 'time_gia_cong',
+              'time_dung', 'time_dung_khac', 'time_sua']
+
+GROUP_KEYS = ['bộ phận', 'is_lathe', 'số máy']
+
+# Khóa của cube theo ngày
+CUBE_KEYS = GROUP_KEYS + ['day']
+
+# Cột phụ của cube cho "Máy dừng 100%": tổng gá lắp/gia công chưa nhân sl, max(dừng, dừng khác)
+RAW_COLS = ['raw_ga_lap', 'raw_gia_cong']
+STOP_COL = 'max_stop'
+
+# Dừng >= ca ngắn nhất = dừng toàn bộ ca
+FULL_STOP_MINUTES = min(SHIFT_TIMES)
+
+# Giá trị ô của ma trận máy × ngày
+DAY_RUNNING, DAY_FULL_STOP, DAY_NO_DATA = 0, 1, 2
+
+# Các tỷ lệ % của bản đồ nhiệt máy × ngày: tên -> các cột thời gian cộng lại
+HEATMAP_METRICS = {
+    'gia_cong': ['time_gia_cong'],
+    'dung': ['time_dung', 'time_dung_khac'],
+    'ga_lap': ['time_ga_lap'],
+}
+
+
+def aggregate_components(df, lathe_machines, by_day=False):
+    """
+    Tính tổng 7 thành phần thời gian cho từng (bộ phận, is_lathe, số máy) trong một lần groupby
+    by_day=True: tách thêm theo ngày (date_parsed), ngày trống giữ thành một nhóm NaT,
+    kèm các cột phụ RAW_COLS / STOP_COL cho "Máy dừng 100%"
+    Dùng trực tiếp các cột sl_thuc_te / is_lathe đã chuẩn hóa lúc ingest nếu có
+    - Nhân với sl thực tế: gia công, gá lắp
+    - SUM trực tiếp: chuẩn bị, chạy thử, dừng, dừng khác, sửa
+    - Loại bỏ dừng/dừng khác bằng thời gian ca (SHIFT_TIMES)
+    """
+    sl_thuc_te = df['sl_thuc_te'] if 'sl_thuc_te' in df.columns else parse_quantity(df['sl thực tế'])
+    is_lathe = df['is_lathe'] if 'is_lathe' in df.columns else df['số máy'].isin(lathe_machines)
+    # Cộng dồn bằng float64 (cột thời gian lưu float32)
+    dung = df['dừng'].astype('float64')
+    if 'dừng khác' in df.columns:
+        dung_khac = df['dừng khác'].astype('float64')
+    else:
+        dung_khac = pd.Series(0.0, index=df.index)
+
+    parts = pd.DataFrame({
+        'bộ phận': df['bộ phận'],
+        'is_lathe': is_lathe,
+        'số máy': df['số máy'],
+        'time_tgcb': df['tgcb'].astype('float64'),
+        'time_chay_thu': df['chạy thử'].astype('float64'),
+        'time_ga_lap': df['gá lắp'] * sl_thuc_te,
+        'time_gia_cong': df['gia công'] * sl_thuc_te,
+        'time_dung': dung.where(~dung.isin(SHIFT_TIMES), 0),
+        'time_dung_khac': dung_khac.where(~dung_khac.isin(SHIFT_TIMES), 0),
+        'time_sua': df['sửa'].astype('float64'),
+    })
+
+    if not by_day:
+        agg = parts.groupby(GROUP_KEYS, sort=False, observed=True)[COMPONENTS].sum()
+        agg['total_time'] = agg[COMPONENTS].sum(axis=1)
+        return agg
+
+    # Cube theo ngày: thêm các cột phụ cho "Máy dừng 100%", gộp trong cùng một lần groupby
+    parts['day'] = df['date_parsed']
+    parts['raw_ga_lap'] = df['gá lắp'].astype('float64')
+    parts['raw_gia_cong'] = df['gia công'].astype('float64')
+    parts[STOP_COL] = np.maximum(dung.values, dung_khac.values)
+    how = {c: 'sum' for c in COMPONENTS + RAW_COLS}
+    how[STOP_COL] = 'max'
+    agg = parts.groupby(CUBE_KEYS, sort=False, observed=True, dropna=False).agg(how)
+    agg['total_time'] = agg[COMPONENTS].sum(axis=1)
+    return agg
+
+
+def build_daily_cube(df, lathe_machines):
+    """
+    Cube tổng theo ngày: một dòng cho mỗi (bộ phận, is_lathe, số máy, day) với 7 thành phần
+    (đã loại SHIFT_TIMES) + giải trình ghép sẵn. Dựng một lần cho mỗi lần nạp dữ liệu,
+    mọi bảng/biểu đồ chỉ cần cộng dồn các ô của cube trong khoảng ngày đã chọn
+    """
+    cube = aggregate_components(df, lathe_machines, by_day=True).reset_index()
+    explanations = aggregate_explanations(df, by_day=True)
+    if len(explanations):
+        cube = cube.merge(
+            explanations.rename('explanation').reset_index(),
+            on=['bộ phận', 'số máy', 'day'], how='left'
+        )
+        cube['explanation'] = cube['explanation'].fillna('')
+    else:
+        cube['explanation'] = ''
+    return cube
+
+
+def merge_daily_cube(cube, delta):
+    """
+    Cộng cube của các dòng mới (delta) vào cube hiện có, không sửa cube cũ
+    Các thành phần cộng nhau được nên chỉ các ô (máy, ngày) bị chạm tới thay đổi:
+    ô đã có -> cộng thời gian, max dừng, nối giải trình sau giải trình cũ; ô mới -> nối vào cuối
+    Kết quả giống build_daily_cube trên toàn bộ dòng (dòng mới nằm sau dòng cũ trong cùng ngày)
+    """
+    if delta.empty:
+        return cube
+    if cube.empty:
+        return delta
+    old_keys = pd.MultiIndex.from_frame(cube[CUBE_KEYS].astype({'bộ phận': str, 'số máy': str}))
+    new_keys = pd.MultiIndex.from_frame(delta[CUBE_KEYS].astype({'bộ phận': str, 'số máy': str}))
+    pos = old_keys.get_indexer(new_keys)
+    hit = pos >= 0
+    target, source = pos[hit], np.flatnonzero(hit)
+
+    cube = cube.copy()
+    for col in COMPONENTS + RAW_COLS:
+        values = cube[col].to_numpy(copy=True)
+        values[target] += delta[col].to_numpy()[source]
+        cube[col] = values
+    stop = cube[STOP_COL].to_numpy(copy=True)
+    stop[target] = np.maximum(stop[target], delta[STOP_COL].to_numpy()[source])
+    cube[STOP_COL] = stop
+    total = cube['total_time'].to_numpy(copy=True)
+    total[target] = cube[COMPONENTS].to_numpy()[target].sum(axis=1)
+    cube['total_time'] = total
+
+    old_text = cube['explanation'].to_numpy(copy=True)
+    new_text = delta['explanation'].to_numpy()[source]
+    old_text[target] = [
+        f'{old}, {new}' if old and new else old or new
+        for old, new in zip(old_text[target], new_text)
+    ]
+    cube['explanation'] = old_text
+
+    if hit.all():
+        return cube
+    return append_rows(cube, delta[~hit].reset_index(drop=True))
+
+
+class DailyCubeBuilder:
+    """
+    Giữ cube theo ngày của phiên bản dữ liệu gần nhất (DateIndex date_col='day')
+    Dữ liệu mới chỉ nối thêm dòng (DateIndex.deltas nối tiếp từ phiên bản đang giữ):
+    dựng cube cho phần dòng mới rồi cộng vào (chi phí theo số dòng mới, không theo toàn bộ lịch sử)
+    Ngược lại (tải lại toàn bộ do dữ liệu cũ bị sửa, snapshot của tiến trình khác...): dựng lại từ đầu
+    """
+
+    def __init__(self, lathe_machines=()):
+        self.lathe_machines = list(lathe_machines)
+        self.index = None
+        self.last_mode = None   # 'full' / 'incremental'
+        self._lock = threading.Lock()
+
+    def _pending(self, date_index):
+        """Các frame dòng mới từ phiên bản đang giữ tới date_index, None nếu không nối tiếp được"""
+        if self.index is None:
+            return None
+        bases = [base for base, _ in date_index.deltas]
+        if self.index.version not in bases:
+            return None
+        return [new_df for _, new_df in date_index.deltas[bases.index(self.index.version):]]
+
+    def update(self, date_index):
+        """Cube (DateIndex theo 'day', version = date_index.version) của date_index"""
+        with self._lock:
+            if self.index is not None and self.index.version == date_index.version:
+                return self.index
+            pending = self._pending(date_index)
+            if pending is None:
+                cube = build_daily_cube(date_index.df, self.lathe_machines)
+                self.last_mode = 'full'
+            else:
+                new_rows = pending[0]
+                for new_df in pending[1:]:
+                    new_rows = append_rows(new_rows, new_df)
+                new_rows = DateIndex(new_rows).df  # Sắp theo ngày như frame chính
+                delta = build_daily_cube(new_rows, self.lathe_machines)
+                cube = merge_daily_cube(self.index.df, delta)
+                self.last_mode = 'incremental'
+            self.index = DateIndex(cube, date_col='day', version=date_index.version)
+            return self.index
+
+
+def rollup_cube(cube):
+    """Cộng dồn các ô cube (đã lọc theo ngày) về dạng kết quả của aggregate_components"""
+    agg = cube.groupby(GROUP_KEYS, sort=False, observed=True)[COMPONENTS].sum()
+    agg['total_time'] = agg[COMPONENTS].sum(axis=1)
+    return agg
+
+
+def rollup_explanations(cube):
+    """Ghép giải trình của các ô cube theo (bộ phận, số máy), theo thứ tự ngày"""
+    text = cube.loc[cube['explanation'] != '', ['bộ phận', 'số máy', 'explanation']]
+    return text.groupby(['bộ phận', 'số máy'], sort=False, observed=True)['explanation'].agg(', '.join)
+
+
+def dept_short_name(dept):
+    """'Sản xuất 1' -> 'SX1' (tên ngắn dùng trên biểu đồ)"""
+    if dept.startswith('Sản xuất '):
+        return 'SX' + dept[len('Sản xuất '):]
+    return dept
+
+
+def calculate_capacity_by_type(df, machine_type='all', lathe_machines=None):
+    """
+    Tính công suất theo loại máy (tiện/phay/tất cả)
+    Logic: Nhân với sl thực tế: gia công, gá lắp
+    Các thành phần khác (chuẩn bị, chạy thử, dừng, sửa) SUM trực tiếp
+    Loại bỏ thời gian dừng/dừng khác = 420, 630, 660 (thời gian ca)
+    """
+    if lathe_machines is None:
+        lathe_machines = CONFIG['lathe_machines']
+    agg = aggregate_components(df, lathe_machines)
+    return rollup_capacity(agg, machine_type=machine_type)
+
+
+def calculate_machine_counts(df, machine_type, dept_name, lathe_machines=None):
+    """
+    Tính số máy chạy (có thời gian gia công > 0)
+    """
+    if lathe_machines is None:
+        lathe_machines = CONFIG['lathe_machines']
+    agg = aggregate_components(df, lathe_machines)
+    return rollup_machine_counts(agg, dept_name, machine_type)
+
+
+def select_rows(agg, dept=None, machine_type='all'):
+    """Lọc kết quả gộp theo bộ phận và loại máy (lathe/milling/all)"""
+    mask = pd.Series(True, index=agg.index)
+    if dept is not None:
+        mask &= agg.index.get_level_values('bộ phận') == dept
+    if machine_type == 'lathe':
+        mask &= agg.index.get_level_values('is_lathe')
+    elif machine_type == 'milling':
+        mask &= ~agg.index.get_level_values('is_lathe')
+    return agg[mask.values]
+
+
+@dataclass(frozen=True, slots=True)
+class Capacity:
+    """Kết quả công suất: thời gian (phút) từng thành phần; tỷ lệ % (pct_*) tính từ tổng"""
+    time_tgcb: float
+    time_chay_thu: float
+    time_ga_lap: float
+    time_gia_cong: float
+    time_dung: float
+    time_dung_khac: float
+    time_sua: float
+    total_time: float
+    running_machines: int = 0  # Số máy chạy (có thời gian gia công > 0)
+
+    def _pct(self, value):
+        return value / self.total_time * 100
+
+    pct_tgcb = property(lambda self: self._pct(self.time_tgcb))
+    pct_chay_thu = property(lambda self: self._pct(self.time_chay_thu))
+    pct_ga_lap = property(lambda self: self._pct(self.time_ga_lap))
+    pct_gia_cong = property(lambda self: self._pct(self.time_gia_cong))
+    pct_dung = property(lambda self: self._pct(self.time_dung))
+    pct_dung_khac = property(lambda self: self._pct(self.time_dung_khac))
+    pct_sua = property(lambda self: self._pct(self.time_sua))
+
+    def as_dict(self):
+        """Dict phẳng time_* + pct_* (xuất Excel/JSON)"""
+        result = asdict(self)
+        for c in COMPONENTS:
+            name = 'pct_' + c[len('time_'):]
+            result[name] = getattr(self, name)
+        return result
+
+
+def capacity_from_totals(totals, running_machines=0):
+    """Capacity từ tổng các thành phần, None nếu tổng = 0"""
+    total_time = sum(totals[c] for c in COMPONENTS)
+    if total_time == 0:
+        return None
+    return Capacity(*(float(totals[c]) for c in COMPONENTS), float(total_time), running_machines)
+
+
+def _running_machines(rows):
+    return int(rows.index.get_level_values('số máy')[rows['time_gia_cong'] > 0].nunique())
+
+
+def rollup_capacity(agg, dept=None, machine_type='all'):
+    """Công suất của một phân xưởng / loại máy (kèm số máy chạy), cộng dồn từ kết quả gộp"""
+    rows = select_rows(agg, dept, machine_type)
+    return capacity_from_totals(rows[COMPONENTS].sum(), _running_machines(rows))
+
+
+def capacity_breakdown(agg, machine_classes):
+    """
+    Công suất của mọi (bộ phận, nhóm máy) trong một lần groupby trên kết quả gộp theo máy
+    machine_classes: nhóm máy của từng dòng agg (vd. MachineRegistry.classify), số nhóm / bộ phận tùy ý
+    Trả về {(bộ phận, nhóm máy): Capacity} kèm tổng phân xưởng {(bộ phận, 'all'): Capacity}
+    """
+    depts = agg.index.get_level_values('bộ phận').astype(str)
+    parts = agg[COMPONENTS].assign(running=(agg['time_gia_cong'] > 0).astype('int64'))
+    # Mỗi máy chỉ có một dòng trong mỗi bộ phận -> cộng cờ chạy = số máy chạy
+    by_class = parts.groupby([depts, np.asarray(machine_classes, dtype=object)], sort=False).sum()
+    by_dept = parts.groupby(depts, sort=False).sum()
+
+    result = {}
+    for (dept, machine_class), totals in by_class.iterrows():
+        cap = capacity_from_totals(totals, int(totals['running']))
+        if cap:
+            result[(dept, machine_class)] = cap
+    for dept, totals in by_dept.iterrows():
+        cap = capacity_from_totals(totals, int(totals['running']))
+        if cap:
+            result[(dept, 'all')] = cap
+    return result
+
+
+def rollup_machine_counts(agg, dept=None, machine_type='all'):
+    """Số máy chạy (có thời gian gia công > 0)"""
+    return _running_machines(select_rows(agg, dept, machine_type))
+
+
+def aggregate_explanations(df, by_day=False):
+    """Ghép các giải trình không rỗng theo (bộ phận, số máy[, day]), giữ thứ tự dòng"""
+    if 'giải trình' not in df.columns:
+        return pd.Series(dtype=object)
+    text = df['giải trình'].dropna().astype(str)
+    text = text[text.str.strip() != '']
+    keys = [df.loc[text.index, 'bộ phận'], df.loc[text.index, 'số máy']]
+    if by_day:
+        keys.append(df.loc[text.index, 'date_parsed'].rename('day'))
+    return text.groupby(keys, sort=False, observed=True, dropna=not by_day).agg(', '.join)
+
+
+def machine_sort_key(machine):
+    """Sắp xếp số máy theo số, máy không phải số xếp cuối"""
+    return int(machine) if str(machine).isdigit() else float('inf')
+
+
+def full_stop_cells(cube):
+    """
+    Ô cube (máy, ngày) dừng toàn bộ ca: dừng/dừng khác >= thời gian ca
+    và không có thời gian sản xuất (chuẩn bị, chạy thử, gá lắp, gia công đều = 0)
+    """
+    no_production = (
+        (cube['time_tgcb'] == 0) & (cube['time_chay_thu'] == 0)
+        & (cube['raw_ga_lap'] == 0) & (cube['raw_gia_cong'] == 0)
+    )
+    return (cube[STOP_COL] >= FULL_STOP_MINUTES) & no_production
+
+
+def _machines_of_type(machines_in_dept, all_machines_full, lathe_machines):
+    """Lọc danh sách máy theo loại máy có trong phân xưởng (tiện/phay/cả hai)"""
+    lathe = set(lathe_machines)
+    has_lathe = any(m in lathe for m in machines_in_dept)
+    has_milling = any(m not in lathe for m in machines_in_dept)
+
+    if has_lathe and not has_milling:
+        return [m for m in all_machines_full if m in lathe], "máy tiện"
+    if has_milling and not has_lathe:
+        return [m for m in all_machines_full if m not in lathe], "máy phay"
+    # Mixed - use all machines
+    return list(all_machines_full), "máy"
+
+
+def find_full_stop_machines(cube, dept, all_machines_full, lathe_machines, dept_machines=None):
+    """
+    Máy dừng 100% của một phân xưởng trong khoảng ngày của cube
+    dept_machines: máy của phân xưởng theo danh mục máy (None = đoán theo loại máy có trong dữ liệu)
+    Điều kiện 1: máy (đúng loại) không có dữ liệu
+    Điều kiện 2 và 3: dừng/dừng khác >= thời gian ca và không có thời gian sản xuất (cả khoảng)
+    Trả về (danh sách máy sắp theo số, tập máy không có dữ liệu, nhãn loại máy)
+    """
+    rows = cube[cube['bộ phận'] == dept]
+    machines_in_dept = set(rows['số máy'].unique())
+    if dept_machines is not None:
+        all_machines, machine_type_label = list(dept_machines), "máy"
+    else:
+        all_machines, machine_type_label = _machines_of_type(machines_in_dept, all_machines_full, lathe_machines)
+
+    # CONDITION 1: Machines NOT in data (filtered by type)
+    machines_not_in_data = {m for m in all_machines if m not in machines_in_dept}
+
+    # CONDITION 2 AND 3: gộp cả khoảng theo máy rồi xét như một ô
+    how = {c: 'sum' for c in ['time_tgcb', 'time_chay_thu'] + RAW_COLS}
+    how[STOP_COL] = 'max'
+    per_machine = rows.groupby('số máy', sort=False, observed=True).agg(how)
+    stopped = per_machine.index[full_stop_cells(per_machine).values]
+    stopped_machines_with_data = set(stopped).intersection(all_machines)
+
+    all_stopped_machines = sorted(machines_not_in_data | stopped_machines_with_data, key=machine_sort_key)
+    return all_stopped_machines, machines_not_in_data, machine_type_label
+
+
+def full_stop_days(cube, dept, all_machines_full, lathe_machines, dept_machines=None):
+    """
+    Ma trận máy × ngày của một phân xưởng (máy đúng loại trong danh sách máy, ngày phân xưởng có dữ liệu):
+    dept_machines: như find_full_stop_machines
+    DAY_FULL_STOP = dừng toàn bộ ca trong ngày, DAY_NO_DATA = không có dữ liệu ngày đó, DAY_RUNNING = còn lại
+    Trả về DataFrame int8 (index: số máy, cột: datetime.date)
+    """
+    rows = cube[(cube['bộ phận'] == dept) & cube['day'].notna()]
+    if dept_machines is not None:
+        all_machines = dept_machines
+    else:
+        all_machines, _ = _machines_of_type(set(rows['số máy'].unique()), all_machines_full, lathe_machines)
+    machines = pd.Index(sorted(set(all_machines), key=machine_sort_key))
+    days = pd.DatetimeIndex(np.unique(rows['day'].values))
+
+    matrix = np.full((len(machines), len(days)), DAY_NO_DATA, dtype=np.int8)
+    machine_pos = machines.get_indexer(rows['số máy'].astype(object))
+    day_pos = days.get_indexer(rows['day'])
+    known = machine_pos >= 0
+    matrix[machine_pos[known], day_pos[known]] = np.where(
+        full_stop_cells(rows).values[known], DAY_FULL_STOP, DAY_RUNNING
+    )
+    return pd.DataFrame(matrix, index=machines, columns=days.date)
+
+
+def utilization_days(cube, dept, machine_type='all'):
+    """
+    Ma trận máy × ngày của một phân xưởng cho từng tỷ lệ trong HEATMAP_METRICS (% trên tổng thời gian
+    của ô), lấp bằng một lần gán vector hóa từ các ô cube; NaN = máy không có thời gian ngày đó
+    Trả về (mảng float32 [metric, máy, ngày], Index số máy, DatetimeIndex ngày)
+    """
+    mask = (cube['bộ phận'] == dept) & cube['day'].notna() & (cube['total_time'] > 0)
+    if machine_type == 'lathe':
+        mask &= cube['is_lathe']
+    elif machine_type == 'milling':
+        mask &= ~cube['is_lathe']
+    rows = cube[mask]
+    machine_names = rows['số máy'].astype(str)
+    machines = pd.Index(sorted(machine_names.unique(), key=machine_sort_key))
+    days = pd.DatetimeIndex(np.unique(rows['day'].values))
+
+    values = np.stack([rows[cols].sum(axis=1).values for cols in HEATMAP_METRICS.values()])
+    matrix = np.full((len(HEATMAP_METRICS), len(machines), len(days)), np.nan, dtype=np.float32)
+    matrix[:, machines.get_indexer(machine_names), days.get_indexer(rows['day'])] = (
+        values / rows['total_time'].values * 100
+    )
+    return matrix, machines, days
+
+
+def machine_stats_table(agg, dept, explanations=None):
+    """Bảng thống kê từng máy của một phân xưởng (chỉ máy có tổng thời gian > 0)"""
+    rows = select_rows(agg, dept).droplevel(['bộ phận', 'is_lathe'])
+    rows = rows[rows['total_time'] > 0]
+    if rows.empty:
+        return pd.DataFrame()
+
+    total = rows['total_time']
+    stats = pd.DataFrame({
+        'số máy': rows.index.astype(str),
+        'machine_num': [int(m) if str(m).isdigit() else 9999 for m in rows.index],  # For sorting
+        'total_time': total.values,
+        'time_dung': rows['time_dung'].values,
+        'time_dung_khac': rows['time_dung_khac'].values,
+        'time_ga_lap': rows['time_ga_lap'].values,
+        'time_tgcb': rows['time_tgcb'].values,
+        'pct_dung': (rows['time_dung'] / total * 100).values,
+        'pct_dung_khac': (rows['time_dung_khac'] / total * 100).values,
+        'pct_ga_lap': (rows['time_ga_lap'] / total * 100).values,
+        'pct_tgcb': (rows['time_tgcb'] / total * 100).values,
+        'pct_total_stop': ((rows['time_dung'] + rows['time_dung_khac']) / total * 100).values,
+    })
+
+    if explanations is not None and len(explanations):
+        dept_explanations = explanations[explanations.index.get_level_values(0) == dept].droplevel(0)
+        stats['explanation'] = stats['số máy'].map(dept_explanations).fillna('').values
+    else:
+        stats['explanation'] = ''
+    return stats
+
+
+class CapacityCore:
+    """
+    Tính công suất từ cube theo ngày (DateIndex có version), nhớ kết quả theo
+    (phiên bản dữ liệu, tháng, ngày[, bộ phận, loại máy]) trong một LRU giới hạn max_entries.
+    Rerun với cùng dữ liệu + bộ lọc chỉ tra dict, không tính lại
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key, compute):
+        with self._lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                self.hits += 1
+                return self._memo[key]
+        cache_miss()
+        value = compute()
+        with self._lock:
+            self.misses += 1
+            self._memo[key] = value
+            while len(self._memo) > self.max_entries:
+                self._memo.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._memo.clear()
+
+    def rollup(self, cube_index, month=None, day=None):
+        """(agg, explanations) của khoảng ngày đã chọn"""
+        def compute():
+            cube = cube_index.select(month, day)
+            return rollup_cube(cube), rollup_explanations(cube)
+        return self._get(('rollup', cube_index.version, month, day), compute)
+
+    def capacity(self, cube_index, month=None, day=None, dept=None, machine_type='all'):
+        """Capacity (hoặc None nếu không có thời gian) của một phân xưởng / loại máy"""
+        return self._get(
+            ('capacity', cube_index.version, month, day, dept, machine_type),
+            lambda: rollup_capacity(self.rollup(cube_index, month, day)[0], dept, machine_type)
+        )
+
+    def breakdown(self, cube_index, month, day, registry):
+        """capacity_breakdown theo nhóm máy của danh mục máy trên khoảng ngày đã chọn"""
+        def compute():
+            agg = self.rollup(cube_index, month, day)[0]
+            return capacity_breakdown(agg, registry.classify(agg.index.get_level_values('số máy')))
+        return self._get(('breakdown', cube_index.version, month, day, registry.version), compute)
+
+    def full_stop(self, cube_index, month, day, dept, all_machines_full, lathe_machines, dept_machines=None):
+        """find_full_stop_machines trên khoảng ngày đã chọn"""
+        dept_key = None if dept_machines is None else tuple(dept_machines)
+        return self._get(
+            ('full_stop', cube_index.version, month, day, dept, tuple(all_machines_full), tuple(lathe_machines),
+             dept_key),
+            lambda: find_full_stop_machines(cube_index.select(month, day), dept, all_machines_full,
+                                            lathe_machines, dept_machines)
+        )
+
+    def full_stop_days(self, cube_index, month, day, dept, all_machines_full, lathe_machines, dept_machines=None):
+        """full_stop_days trên khoảng ngày đã chọn"""
+        dept_key = None if dept_machines is None else tuple(dept_machines)
+        return self._get(
+            ('full_stop_days', cube_index.version, month, day, dept, tuple(all_machines_full), tuple(lathe_machines),
+             dept_key),
+            lambda: full_stop_days(cube_index.select(month, day), dept, all_machines_full,
+                                   lathe_machines, dept_machines)
+        )
+
+    def utilization_days(self, cube_index, month, day, dept, machine_type='all'):
+        """utilization_days trên khoảng ngày đã chọn"""
+        return self._get(
+            ('utilization_days', cube_index.version, month, day, dept, machine_type),
+            lambda: utilization_days(cube_index.select(month, day), dept, machine_type)
+        )
+
+    def departments(self, cube_index, month=None, day=None):
+        """Các phân xưởng có dữ liệu trong khoảng ngày đã chọn"""
+        return self._get(
+            ('departments', cube_index.version, month, day),
+            lambda: set(cube_index.select(month, day)['bộ phận'].unique())
+        )
+
+    def machine_stats(self, cube_index, month=None, day=None, dept=None):
+        """Bảng thống kê từng máy của một phân xưởng (không sửa tại chỗ DataFrame trả về)"""
+        def compute():
+            agg, explanations = self.rollup(cube_index, month, day)
+            return machine_stats_table(agg, dept, explanations)
+        return self._get(('machine_stats', cube_index.version, month, day, dept), compute)
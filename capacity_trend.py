@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Xu hướng công suất theo tháng (12-24 tháng gần nhất): tổng theo máy của từng tháng được nhớ lại,
+tháng đã đóng tính một lần và giữ vĩnh viễn, chỉ tháng hiện tại tính lại khi dữ liệu đổi
+(không phụ thuộc Streamlit)
+"""
+
+import datetime
+import json
+import os
+import threading
+
+import pandas as pd
+
+from capacity_core import COMPONENTS, GROUP_KEYS, machine_sort_key, rollup_capacity, rollup_cube, select_rows
+from instrumentation import cache_miss
+
+# Các tỷ lệ % của bảng xu hướng
+TREND_COLS = ['pct_gia_cong', 'pct_dung', 'pct_dung_khac', 'pct_total_stop']
+
+# Tăng khi đổi cách tính tổng tháng -> file cache cũ bị bỏ qua
+TREND_CACHE_VERSION = 3
+
+
+def current_month(today=None):
+    """Tháng hiện tại 'YYYY-MM' (tháng chưa đóng, dữ liệu còn được nhập thêm)"""
+    return (today or datetime.date.today()).strftime('%Y-%m')
+
+
+def month_totals(cube_index, months):
+    """
+    {tháng: Series tổng 7 thành phần} của các tháng yêu cầu
+    Kho SQLite (StoreCube.month_totals): một truy vấn GROUP BY tháng thay vì dựng cube từng tháng;
+    cube trong bộ nhớ: cộng lát cube của từng tháng
+    """
+    if hasattr(cube_index, 'month_totals'):
+        return cube_index.month_totals(months)
+    return {month: cube_index.select(month)[COMPONENTS].sum() for month in months}
+
+
+def month_fingerprint(rows, sums):
+    """
+    Dấu vân tay nội dung một tháng: số dòng PHTCV và tổng từng thành phần thời gian (làm tròn)
+    Sửa dữ liệu tháng cũ mà không thêm/bớt dòng vẫn làm dấu vân tay đổi
+    """
+    return [int(rows)] + [round(float(sums[c]), 3) for c in COMPONENTS]
+
+
+class MonthlyTrend:
+    """
+    Tổng theo (bộ phận, is_lathe, số máy) của từng tháng (kết quả rollup_cube của tháng đó)
+    - Tháng đã đóng (trước tháng hiện tại): tính một lần, giữ trong bộ nhớ + file Parquet trong cache_dir,
+      chỉ tính lại khi dấu vân tay nội dung của tháng thay đổi (nhập bù / sửa dữ liệu tháng cũ)
+    - Tháng hiện tại: tính lại mỗi khi phiên bản dữ liệu đổi
+    - source_id: định danh nguồn dữ liệu, file cache của nguồn khác bị bỏ qua
+    """
+
+    def __init__(self, cache_dir=None, lathe_machines=(), source_id=''):
+        self.cache_dir = cache_dir
+        self.lathe_machines = list(lathe_machines)
+        self.source_id = source_id
+        self._closed = {}       # 'YYYY-MM' -> (dấu vân tay, agg)
+        self._current = {}      # 'YYYY-MM' -> (phiên bản dữ liệu, agg)
+        self._fingerprints = (None, {})  # (phiên bản dữ liệu, {'YYYY-MM': dấu vân tay}) - rerun không đọc lại cube
+        self._lock = threading.Lock()
+        self._load()
+
+    def _paths(self):
+        return os.path.join(self.cache_dir, 'monthly.parquet'), os.path.join(self.cache_dir, 'monthly.json')
+
+    def _load(self):
+        """Nạp các tháng đã đóng từ cache_dir (bỏ qua nếu khác phiên bản / nguồn dữ liệu / danh sách máy tiện)"""
+        if not self.cache_dir:
+            return
+        data_path, meta_path = self._paths()
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            if (meta.get('version') != TREND_CACHE_VERSION or meta.get('source') != self.source_id
+                    or meta.get('lathe_machines') != self.lathe_machines):
+                return
+            df = pd.read_parquet(data_path)
+        except Exception:
+            return
+        for month, rows in df.groupby('month', sort=False):
+            agg = rows.drop(columns='month').set_index(GROUP_KEYS)
+            self._closed[month] = (meta['fingerprints'][month], agg)
+
+    def _save(self):
+        """Ghi các tháng đã đóng ra cache_dir (ghi đè nguyên tử, lỗi ghi không chặn app)"""
+        if not self.cache_dir:
+            return
+        data_path, meta_path = self._paths()
+        meta = {
+            'version': TREND_CACHE_VERSION,
+            'source': self.source_id,
+            'lathe_machines': self.lathe_machines,
+            'fingerprints': {month: fingerprint for month, (fingerprint, _) in self._closed.items()},
+        }
+        frames = [agg.reset_index().assign(month=month) for month, (_, agg) in self._closed.items()]
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            df = pd.concat(frames, ignore_index=True)
+            for col in ['bộ phận', 'số máy']:
+                df[col] = df[col].astype(str)
+            df.to_parquet(data_path + '.tmp', index=False)
+            os.replace(data_path + '.tmp', data_path)
+            with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(meta_path + '.tmp', meta_path)
+        except Exception:
+            pass
+
+    def _month_fingerprints(self, date_index, cube_index, months):
+        """Dấu vân tay các tháng đã đóng, nhớ theo phiên bản dữ liệu: chỉ tính (một lượt) khi phiên bản đổi"""
+        version, fingerprints = self._fingerprints
+        if version != cube_index.version:
+            fingerprints = {}
+            self._fingerprints = (cube_index.version, fingerprints)
+        missing = [month for month in months if month not in fingerprints]
+        if missing:
+            for month, sums in month_totals(cube_index, missing).items():
+                fingerprints[month] = month_fingerprint(date_index.count(month), sums)
+        return fingerprints
+
+    def aggregates(self, date_index, cube_index, months, today=None):
+        """{tháng: agg} của các tháng yêu cầu; date_index cho số dòng từng tháng, cube_index để tính"""
+        this_month = current_month(today)
+        result = {}
+        closed_changed = False
+        with self._lock:
+            fingerprints = self._month_fingerprints(date_index, cube_index, [m for m in months if m < this_month])
+            for month in months:
+                if month < this_month:
+                    fingerprint = fingerprints[month]
+                    cached = self._closed.get(month)
+                    if cached is None or cached[0] != fingerprint:
+                        cache_miss()
+                        cached = self._closed[month] = (fingerprint, rollup_cube(cube_index.select(month)))
+                        closed_changed = True
+                else:
+                    cached = self._current.get(month)
+                    if cached is None or cached[0] != cube_index.version:
+                        cache_miss()
+                        cached = self._current[month] = (cube_index.version, rollup_cube(cube_index.select(month)))
+                result[month] = cached[1]
+            if closed_changed:
+                self._save()
+        return result
+
+
+def _pct(rows, metric):
+    """Tỷ lệ % của một metric trong TREND_COLS trên từng dòng agg"""
+    if metric == 'pct_total_stop':
+        value = rows['time_dung'] + rows['time_dung_khac']
+    else:
+        value = rows['time_' + metric[len('pct_'):]]
+    return value / rows['total_time'] * 100
+
+
+def trend_table(aggregates, dept=None, machine_type='all'):
+    """Bảng theo tháng (tăng dần) của một phân xưởng / loại máy: TREND_COLS + số máy chạy"""
+    records = []
+    for month in sorted(aggregates):
+        cap = rollup_capacity(aggregates[month], dept, machine_type)
+        if not cap:
+            continue
+        records.append({
+            'month': month,
+            'pct_gia_cong': cap.pct_gia_cong,
+            'pct_dung': cap.pct_dung,
+            'pct_dung_khac': cap.pct_dung_khac,
+            'pct_total_stop': cap.pct_dung + cap.pct_dung_khac,
+            'running_machines': cap.running_machines,
+        })
+    return pd.DataFrame(records, columns=['month'] + TREND_COLS + ['running_machines']).set_index('month')
+
+
+def machine_trend(aggregates, dept, machine_type='all', metric='pct_gia_cong'):
+    """Ma trận số máy × tháng của một metric (%), NaN = máy không có thời gian trong tháng đó"""
+    columns = {}
+    for month in sorted(aggregates):
+        rows = select_rows(aggregates[month], dept, machine_type).droplevel(['bộ phận', 'is_lathe'])
+        rows = rows[rows['total_time'] > 0]
+        pct = _pct(rows, metric)
+        pct.index = pct.index.astype(str)
+        columns[month] = pct
+    df = pd.DataFrame(columns)
+    if df.empty:
+        return df
+    df.index.name = 'số máy'
+    return df.loc[sorted(df.index, key=machine_sort_key)]
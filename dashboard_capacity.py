@@ -6,13 +6,29 @@ Tính toán theo logic Excel CS máy_SX1 và CS máy_SX2
 
 import streamlit as st
 import pandas as pd
-import plotly.graph_objects as go
 from datetime import datetime
 import gspread
 from google.oauth2.service_account import Credentials
 import numpy as np
 import os
 
+from app_config import CONFIG
+from background_refresh import StaleWhileRevalidate
+from capacity_charts import create_machine_day_heatmap, create_stacked_bar_chart, create_trend_chart
+from capacity_core import (
+    DAY_FULL_STOP, DAY_NO_DATA, DAY_RUNNING, HEATMAP_METRICS, CapacityCore, DailyCubeBuilder,
+    dept_short_name
+)
+from capacity_trend import MonthlyTrend, machine_trend, trend_table
+from instrumentation import RECENT, begin_run, cache_miss, configure_logging, run_records, stage
+from phtcv_export import EXPORT_FORMATS
+from machine_registry import MachineRegistry
+from phtcv_data import PhtcvSync
+from phtcv_sources import LocalFileSource, SheetArchives, SheetsSource
+from phtcv_store import PhtcvStore, StoreIndex
+from shared_fetch import SharedFetch
+from sheets_gateway import SCOPES, SheetsGateway
+
 # ============= CẤU HÌNH =============
 st.set_page_config(
     page_title="Công Suất Sản Xuất",
@@ -20,11 +36,7 @@ st.set_page_config(
     layout="wide"
 )
 
-CONFIG = {
-    'google_credentials': 'api-agent-471608-912673253587.json',
-    'google_sheet_url': 'https://docs.google.com/spreadsheets/d/1F2NzTR50kXzGx9Pc5KdBwwqnIRXGvViPv6mgw8YMNW0/edit',
-    'lathe_machines': ['48', '50', '51', '52', '54', '55', '56', '57', '58', '59', '60', '61']
-}
+configure_logging(CONFIG['perf_log'])
 
 # ============= FUNCTIONS =============
 
@@ -32,7 +44,7 @@ CONFIG = {
 def authenticate_google_sheets():
     """Xác thực Google Sheets"""
     try:
-        scopes = ['https://www.googleapis.com/auth/spreadsheets']
+        scopes = SCOPES
         
         # Method 1: Try base64-encoded credentials (most reliable for Cloud)
         if "gcp_service_account_base64" in st.secrets:
@@ -72,385 +84,281 @@ def authenticate_google_sheets():
         st.error(f"❌ Lỗi xác thực: {e}")
         return None
 
-@st.cache_data(ttl=300)
-def read_phtcv_data():
-    """Đọc dữ liệu PHTCV từ Google Sheets"""
-    try:
+@st.cache_resource
+def get_phtcv_sync():
+    """Trạng thái đồng bộ tăng dần PHTCV, dùng chung giữa các phiên"""
+    store = PhtcvStore(CONFIG['phtcv_store_path']) if CONFIG['phtcv_store_path'] else None
+    snapshot_path = CONFIG['phtcv_snapshot_path']
+    if CONFIG['shared_cache_dir']:
+        snapshot_path = os.path.join(CONFIG['shared_cache_dir'], os.path.basename(snapshot_path))
+    return PhtcvSync(
+        probe_rows=CONFIG['phtcv_probe_rows'],
+        full_reload_seconds=CONFIG['phtcv_full_reload_seconds'],
+        snapshot_path=None if store else snapshot_path,
+        lathe_machines=CONFIG['lathe_machines'],
+        store=store,
+        chunk_rows=CONFIG['phtcv_chunk_rows']
+    )
+
+@st.cache_resource
+def get_sheets_gateway():
+    """Handle spreadsheet dùng chung (chỉ mở một lần), None nếu chưa xác thực được"""
+    with stage('authenticate_google_sheets'):
         client = authenticate_google_sheets()
-        if not client:
-            return None
-        
-        spreadsheet = client.open_by_url(CONFIG['google_sheet_url'])
-        worksheet = spreadsheet.worksheet('PHTCV')
-        data = worksheet.get_all_values()
-        
-        if data and len(data) > 1:
-            df = pd.DataFrame(data[1:], columns=data[0])
-            df = df.dropna(axis=0, how='all')
-            
-            # Convert time columns to numeric
-            time_cols = ['tgcb', 'chạy thử', 'gá lắp', 'gia công', 'dừng', 'dừng khác', 'sửa']
-            for col in time_cols:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(
-                        df[col].astype(str).str.replace(',', '.'),
-                        errors='coerce'
-                    ).fillna(0)
-            
-            # Parse date column
-            if 'ngày tháng' in df.columns:
-                df['date_parsed'] = pd.to_datetime(df['ngày tháng'], format='%d/%m/%Y', errors='coerce')
-            
-            return df
-        return pd.DataFrame()
-    except Exception as e:
-        st.error(f"❌ Lỗi đọc PHTCV: {e}")
+    if not client:
         return None
+    return SheetsGateway(
+        client, CONFIG['google_sheet_url'],
+        max_calls_per_minute=CONFIG['sheets_max_calls_per_minute'],
+        max_retries=CONFIG['sheets_max_retries']
+    )
 
-@st.cache_data(ttl=300)
-def read_machine_list():
-    """Đọc danh sách máy từ Google Sheets"""
-    try:
-        client = authenticate_google_sheets()
-        if not client:
-            return []
-        
-        spreadsheet = client.open_by_url(CONFIG['google_sheet_url'])
-        worksheet = spreadsheet.worksheet('machine_list')
-        data = worksheet.get_all_values()
-        
-        if data and len(data) > 1:
-            df = pd.DataFrame(data[1:], columns=data[0])
-            # Assume first column contains machine numbers
-            machine_col = df.columns[0]
-            machines = df[machine_col].dropna().astype(str).tolist()
-            return [m.strip() for m in machines if m.strip()]
-        return []
-    except Exception as e:
-        st.warning(f"⚠️ Không thể đọc machine_list: {e}")
-        return []
+@st.cache_resource
+def get_archive_gateway(url):
+    """Gateway của một spreadsheet lưu trữ, dùng chung xác thực + rate limiter + bộ đếm lần gọi với sheet đang ghi"""
+    gateway = get_sheets_gateway()
+    if not gateway:
+        return None
+    if url == gateway.url:
+        return gateway
+    return SheetsGateway(
+        gateway.client, url,
+        max_retries=CONFIG['sheets_max_retries'],
+        rate_limiter=gateway.rate_limiter,
+        counter=gateway.counter
+    )
+
+def get_sheet_archives():
+    """Các năm PHTCV đã đóng theo CONFIG['phtcv_archives'], None nếu không cấu hình / dùng kho"""
+    if not CONFIG['phtcv_archives'] or CONFIG['phtcv_store_path']:
+        return None
+    cache_dir = CONFIG['archive_cache_dir']
+    if CONFIG['shared_cache_dir']:
+        cache_dir = os.path.join(CONFIG['shared_cache_dir'], os.path.basename(cache_dir))
+    return SheetArchives(
+        CONFIG['phtcv_archives'], get_archive_gateway, cache_dir=cache_dir,
+        lathe_machines=CONFIG['lathe_machines'], max_workers=CONFIG['archive_workers']
+    )
+
+@st.cache_resource
+def get_data_source():
+    """Nguồn dữ liệu theo CONFIG['data_source']: 'sheets' = Google Sheets, còn lại = đường dẫn file cục bộ"""
+    if CONFIG['data_source'] == 'sheets':
+        shared = None
+        if CONFIG['shared_cache_dir']:
+            shared = SharedFetch(CONFIG['shared_cache_dir'], ttl=CONFIG['data_ttl_seconds'])
+        return SheetsSource(get_sheets_gateway, get_phtcv_sync(), CONFIG['batch_sheets'], shared=shared,
+                            archives=get_sheet_archives())
+    return LocalFileSource(
+        CONFIG['data_source'],
+        password=CONFIG['data_source_password'] or None,
+        extra_sheets=CONFIG['batch_sheets'],
+        extra_paths=CONFIG['local_extra_paths'],
+        lathe_machines=CONFIG['lathe_machines'],
+        chunk_rows=CONFIG['phtcv_chunk_rows']
+    )
 
-def calculate_capacity_by_type(df, machine_type='all'):
+@st.cache_resource
+def get_data_cache():
     """
-    Tính công suất theo loại máy (tiện/phay/tất cả)
-    Logic: Nhân với sl thực tế: gia công, gá lắp
-    Các thành phần khác (chuẩn bị, chạy thử, dừng, sửa) SUM trực tiếp
+    Dữ liệu dùng chung giữa các phiên: luôn phục vụ bản tốt gần nhất,
+    hết hạn thì làm mới ở luồng nền rồi thay nguyên tử
     """
-    lathe_machines = CONFIG['lathe_machines']
-    
-    # Filter by machine type
-    if machine_type == 'lathe':
-        df_filtered = df[df['số máy'].isin(lathe_machines)].copy()
-    elif machine_type == 'milling':
-        df_filtered = df[~df['số máy'].isin(lathe_machines)].copy()
-    else:  # all
-        df_filtered = df.copy()
-    
-    # Convert sl thực tế to numeric
-    df_filtered['sl_thuc_te'] = pd.to_numeric(
-        df_filtered['sl thực tế'].astype(str).str.replace(',', '.'),
-        errors='coerce'
-    ).fillna(1)
-    
-    # Calculate totals:
-    # - Nhân với sl thực tế: gia công, gá lắp
-    # - SUM trực tiếp: chuẩn bị, chạy thử, dừng, dừng khác, sửa
-    # - QUAN TRỌNG: Loại bỏ thời gian dừng/dừng khác >= 420, 660, 630 (thời gian ca)
-    
-    time_tgcb = df_filtered['tgcb'].sum()
-    time_chay_thu = df_filtered['chạy thử'].sum()
-    time_ga_lap = (df_filtered['gá lắp'] * df_filtered['sl_thuc_te']).sum()
-    time_gia_cong = (df_filtered['gia công'] * df_filtered['sl_thuc_te']).sum()
-    
-    # Filter out shift times (420, 660, 630) from stop times
-    SHIFT_TIMES = [420, 630, 660]
-    df_filtered_dung = df_filtered[~df_filtered['dừng'].isin(SHIFT_TIMES)].copy()
-    time_dung = df_filtered_dung['dừng'].sum()
-    
-    if 'dừng khác' in df_filtered.columns:
-        df_filtered_dung_khac = df_filtered[~df_filtered['dừng khác'].isin(SHIFT_TIMES)].copy()
-        time_dung_khac = df_filtered_dung_khac['dừng khác'].sum()
-    else:
-        time_dung_khac = 0
-    
-    time_sua = df_filtered['sửa'].sum()
-    
-    # Total time = sum of ALL components
-    total_time = time_tgcb + time_chay_thu + time_ga_lap + time_gia_cong + time_dung + time_dung_khac + time_sua
-    
-    if total_time == 0:
-        return None
-    
-    # Calculate percentages
-    result = {
-        'total_time': total_time,
-        'time_tgcb': time_tgcb,
-        'time_chay_thu': time_chay_thu,
-        'time_ga_lap': time_ga_lap,
-        'time_gia_cong': time_gia_cong,
-        'time_dung': time_dung,
-        'time_dung_khac': time_dung_khac,
-        'time_sua': time_sua,
-        
-        # Percentages: (component / total) * 100
-        'pct_tgcb': (time_tgcb / total_time * 100),
-        'pct_chay_thu': (time_chay_thu / total_time * 100),
-        'pct_ga_lap': (time_ga_lap / total_time * 100),
-        'pct_gia_cong': (time_gia_cong / total_time * 100),
-        'pct_dung': (time_dung / total_time * 100),
-        'pct_dung_khac': (time_dung_khac / total_time * 100),
-        'pct_sua': (time_sua / total_time * 100),
-    }
-    
-    return result
+    source = get_data_source()
+    ttl = CONFIG['data_ttl_seconds'] if isinstance(source, SheetsSource) else CONFIG['local_check_seconds']
+    cache = StaleWhileRevalidate(source.load, ttl=ttl, max_retry_after=CONFIG['max_retry_after_seconds'])
+    
+    # Khởi động nguội: phục vụ ngay từ snapshot trên đĩa, làm mới ở luồng nền
+    snapshot = source.load_snapshot()
+    if snapshot:
+        cache.seed(*snapshot)
+    return cache
 
-def create_stacked_bar_chart(data_dict, title):
+def read_phtcv_data():
     """
-    Tạo biểu đồ xếp chồng theo thứ tự Excel
-    Thứ tự từ dưới lên: Gia công → Gá lắp → Chạy thử → Chuẩn bị → Dừng → Sửa hàng → Dừng khác
+    Đọc dữ liệu PHTCV từ nguồn dữ liệu (Google Sheets: chỉ tải các dòng mới kể từ lần đọc trước;
+    file cục bộ: chỉ đọc lại khi file thay đổi)
+    Trả về DateIndex dùng chung giữa các phiên (chỉ đọc, không sửa tại chỗ)
     """
-    categories = list(data_dict.keys())
-    
-    # Prepare data - matching Excel order
-    gia_cong = [data_dict[cat]['pct_gia_cong'] for cat in categories]
-    ga_lap = [data_dict[cat]['pct_ga_lap'] for cat in categories]
-    chay_thu = [data_dict[cat]['pct_chay_thu'] for cat in categories]
-    tgcb = [data_dict[cat]['pct_tgcb'] for cat in categories]
-    dung = [data_dict[cat]['pct_dung'] for cat in categories]
-    sua = [data_dict[cat]['pct_sua'] for cat in categories]
-    dung_khac = [data_dict[cat]['pct_dung_khac'] for cat in categories]
-    
-    fig = go.Figure()
-    
-    # 1. Gia công (green - bottom)
-    fig.add_trace(go.Bar(
-        name='Tỷ lệ thời gian gia công',
-        x=categories,
-        y=gia_cong,
-        marker_color='#92D050',
-        text=[f'{data_dict[cat]["time_gia_cong"]:.0f}<br>{v:.0f}%' for cat, v in zip(categories, gia_cong)],
-        textposition='inside',
-        textfont=dict(size=16, color='black'),  # Increased font size
-        hovertemplate='<b>Gia công</b><br>%{y:.1f}%<br>%{customdata[0]:.0f} phút<extra></extra>',
-        customdata=[[data_dict[cat]["time_gia_cong"]] for cat in categories]
-    ))
-    
-    # 2. Gá lắp (gray)
-    fig.add_trace(go.Bar(
-        name='Tỷ lệ thời gian gá lắp',
-        x=categories,
-        y=ga_lap,
-        marker_color='#A6A6A6',
-        text=[f'{data_dict[cat]["time_ga_lap"]:.0f}\u003cbr\u003e{v:.0f}%' if v > 3 else '' for cat, v in zip(categories, ga_lap)],
-        textposition='inside',
-        textfont=dict(size=16, color='black'),  # Increased font size
-        hovertemplate='<b>Gá lắp</b><br>%{y:.1f}%<br>%{customdata[0]:.0f} phút<extra></extra>',
-        customdata=[[data_dict[cat]["time_ga_lap"]] for cat in categories]
-    ))
-    
-    # 3. Chạy thử (light blue - matching Excel)
-    fig.add_trace(go.Bar(
-        name='Tỷ lệ thời gian chạy thử',
-        x=categories,
-        y=chay_thu,
-        marker_color='#9DC3E6',  # Light blue like Excel
-        text=[f'{data_dict[cat]["time_chay_thu"]:.0f}\u003cbr\u003e{v:.0f}%' if v > 3 else '' for cat, v in zip(categories, chay_thu)],
-        textposition='inside',
-        textfont=dict(size=14, color='black'),  # Increased font size
-        hovertemplate='\u003cb\u003eChạy thử\u003c/b\u003e\u003cbr\u003e%{y:.1f}%\u003cbr\u003e%{customdata[0]:.0f} phút\u003cextra\u003e\u003c/extra\u003e',
-        customdata=[[data_dict[cat]["time_chay_thu"]] for cat in categories]
-    ))
-    
-    # 4. Chuẩn bị (yellow - matching Excel)
-    fig.add_trace(go.Bar(
-        name='Tỷ lệ thời gian chuẩn bị',
-        x=categories,
-        y=tgcb,
-        marker_color='#FFD966',  # Yellow like Excel
-        text=[f'{data_dict[cat]["time_tgcb"]:.0f}\u003cbr\u003e{v:.0f}%' if v > 3 else '' for cat, v in zip(categories, tgcb)],
-        textposition='inside',
-        textfont=dict(size=14, color='black'),  # Increased font size
-        hovertemplate='\u003cb\u003eChuẩn bị\u003c/b\u003e\u003cbr\u003e%{y:.1f}%\u003cbr\u003e%{customdata[0]:.0f} phút\u003cextra\u003e\u003c/extra\u003e',
-        customdata=[[data_dict[cat]["time_tgcb"]] for cat in categories]
-    ))
-    
-    # 5. Dừng (red - matching Excel)
-    fig.add_trace(go.Bar(
-        name='Tỷ lệ thời gian dừng',
-        x=categories,
-        y=dung,
-        marker_color='#FF0000',  # Red color like Excel
-        text=[f'{data_dict[cat]["time_dung"]:.0f}\u003cbr\u003e{v:.0f}%' if v > 3 else '' for cat, v in zip(categories, dung)],
-        textposition='inside',
-        textfont=dict(size=16, color='white'),  # Increased font size
-        hovertemplate='\u003cb\u003eDừng\u003c/b\u003e\u003cbr\u003e%{y:.1f}%\u003cbr\u003e%{customdata[0]:.0f} phút\u003cextra\u003e\u003c/extra\u003e',
-        customdata=[[data_dict[cat]["time_dung"]] for cat in categories]
-    ))
-    
-    # 6. Sửa hàng (orange - matching Excel)
-    fig.add_trace(go.Bar(
-        name='Tỷ lệ thời gian sửa hàng',
-        x=categories,
-        y=sua,
-        marker_color='#FFC000',  # Orange like Excel
-        text=[f'{data_dict[cat]["time_sua"]:.0f}\u003cbr\u003e{v:.0f}%' if v > 2 else '' for cat, v in zip(categories, sua)],
-        textposition='inside',
-        textfont=dict(size=14, color='black'),  # Increased font size
-        hovertemplate='\u003cb\u003eSửa hàng\u003c/b\u003e\u003cbr\u003e%{y:.1f}%\u003cbr\u003e%{customdata[0]:.0f} phút\u003cextra\u003e\u003c/extra\u003e',
-        customdata=[[data_dict[cat]["time_sua"]] for cat in categories]
-    ))
-    
-    # 7. Dừng khác (dark red - matching Excel)
-    fig.add_trace(go.Bar(
-        name='Tỷ lệ thời gian dừng khác',
-        x=categories,
-        y=dung_khac,
-        marker_color='#C00000',  # Dark red color like Excel
-        text=[f'{data_dict[cat]["time_dung_khac"]:.0f}\u003cbr\u003e{v:.0f}%' if v > 2 else '' for cat, v in zip(categories, dung_khac)],
-        textposition='inside',
-        textfont=dict(size=14, color='white'),  # Increased font size
-        hovertemplate='\u003cb\u003eDừng khác\u003c/b\u003e\u003cbr\u003e%{y:.1f}%\u003cbr\u003e%{customdata[0]:.0f} phút\u003cextra\u003e\u003c/extra\u003e',
-        customdata=[[data_dict[cat]["time_dung_khac"]] for cat in categories]
-    ))
-    
-    fig.update_layout(
-        title=dict(text=title, font=dict(size=20)),
-        barmode='stack',
-        barnorm='percent',
-        yaxis=dict(
-            title=dict(text='Tỷ lệ %', font=dict(size=16)),  # Correct syntax
-            range=[0, 100],
-            tickfont=dict(size=14)
-        ),
-        xaxis=dict(title='', tickfont=dict(size=14)),
-        height=600,
-        showlegend=True,
-        legend=dict(
-            orientation="h",
-            yanchor="bottom",
-            y=-0.2,
-            xanchor="center",
-            x=0.5,
-            font=dict(size=14)
-        ),
-        hovermode='closest'
-    )
-    
-    return fig
+    with stage('read_phtcv_data', cached=True) as span:
+        data = get_data_cache().get()
+        date_index = data['PHTCV'] if data else None
+        span['rows'] = len(date_index) if date_index is not None else 0
+    return date_index
+
+@st.cache_resource
+def get_cube_builder():
+    """Cube theo ngày của phiên bản dữ liệu gần nhất, cộng dồn tăng dần khi sheet chỉ nối thêm dòng"""
+    return DailyCubeBuilder(CONFIG['lathe_machines'])
 
-def calculate_machine_counts(df, machine_type, dept_name):
+@st.cache_resource(max_entries=2)
+def get_daily_cube(data_version, _date_index):
+    """Cube tổng theo (bộ phận, số máy, ngày), cập nhật một lần cho mỗi phiên bản dữ liệu"""
+    cache_miss()
+    if isinstance(_date_index, StoreIndex):
+        return _date_index.cube()  # Dữ liệu trong kho: cộng dồn bằng SQL theo khoảng ngày khi chọn
+    return get_cube_builder().update(_date_index)
+
+@st.cache_resource
+def get_capacity_core():
+    """Kết quả công suất đã tính, dùng chung giữa các phiên và các lần rerun"""
+    return CapacityCore(max_entries=CONFIG['capacity_memo_entries'])
+
+@st.cache_resource(max_entries=32)
+def get_stacked_bar_chart(data_version, registry_version, month, day, title, compact, _data_dict):
     """
-    Tính số máy chạy (có thời gian gia công > 0)
+    Biểu đồ xếp chồng dựng một lần cho mỗi (phiên bản dữ liệu, danh mục máy, lọc, tiêu đề, chế độ gọn)
+    Spec giống hệt giữa các lần rerun -> Streamlit chỉ gửi tham chiếu hash cho trình duyệt đã có biểu đồ
     """
-    lathe_machines = CONFIG['lathe_machines']
-    
-    # Filter by machine type
-    if machine_type == 'lathe':
-        df_filtered = df[df['số máy'].isin(lathe_machines)].copy()
-    elif machine_type == 'milling':
-        df_filtered = df[~df['số máy'].isin(lathe_machines)].copy()
+    cache_miss()
+    return create_stacked_bar_chart(_data_dict, title, compact=compact)
+
+@st.cache_resource
+def get_monthly_trend():
+    """Tổng theo tháng cho biểu đồ xu hướng: tháng đã đóng giữ vĩnh viễn, tháng hiện tại tính lại"""
+    if CONFIG['data_source'] == 'sheets':
+        source_id = repr([CONFIG['google_sheet_url'], CONFIG['phtcv_archives']])
     else:
-        df_filtered = df.copy()
-    
-    # Count unique machines with processing time > 0
-    machines_with_production = set()
-    for machine in df_filtered['số máy'].unique():
-        df_machine = df_filtered[df_filtered['số máy'] == machine].copy()
-        time_gia_cong = (df_machine['gia công'] * pd.to_numeric(
-            df_machine['sl thực tế'].astype(str).str.replace(',', '.'),
-            errors='coerce'
-        ).fillna(1)).sum()
-        
-        if time_gia_cong > 0:
-            machines_with_production.add(machine)
-    
-    return len(machines_with_production)
+        source_id = os.path.abspath(CONFIG['data_source'])
+    return MonthlyTrend(cache_dir=CONFIG['trend_cache_dir'], lathe_machines=CONFIG['lathe_machines'],
+                        source_id=source_id)
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def build_export_file(data_version, month, day, export_format, _date_index):
+    """Nội dung file xuất của một lựa chọn lọc, cache theo phiên bản dữ liệu"""
+    return EXPORT_FORMATS[export_format][2](_date_index.select(month, day))
 
-def create_machine_time_count_chart(data_dict, count_dict):
+def read_machine_registry():
     """
-    Tạo biểu đồ bar với annotations (bong bóng ghi chú) cho số máy
-    data_dict: {'Tiện SX1': time, 'Tiện SX2': time, 'Phay SX1': time, 'Phay SX2': time}
-    count_dict: {'Tiện SX1': count, 'Tiện SX2': count, 'Phay SX1': count, 'Phay SX2': count}
+    Danh mục máy (nhóm máy, bộ phận) từ machine_list (đọc chung lần gọi API / lần mở file với PHTCV)
+    Không đọc được -> danh mục rỗng, nhóm máy / bộ phận theo CONFIG
     """
-    categories = list(data_dict.keys())
-    times = list(data_dict.values())
-    counts = list(count_dict.values())
-    
-    # Calculate percentages
-    total_time = sum(times)
-    percentages = [(t / total_time * 100) if total_time > 0 else 0 for t in times]
-    
-    # Colors matching Excel
-    colors = {
-        'Tiện SX1': '#C5E0B4',
-        'Tiện SX2': '#A9D08E',
-        'Phay SX1': '#00B0F0',
-        'Phay SX2': '#0070C0'
-    }
-    
-    fig = go.Figure()
+    with stage('read_machine_list', cached=True) as span:
+        data = get_data_cache().get()
+        rows = None
+        if not data or 'machine_list' not in data:
+            # Cảnh báo một lần cho mỗi lần tải dữ liệu; nguồn không có machine_list (vd. CSV không kèm file) thì thôi
+            version = getattr(data.get('PHTCV'), 'version', None) if data else None
+            if (get_data_source().provides_sheet('machine_list')
+                    and st.session_state.get('machine_list_warned') != version):
+                st.session_state['machine_list_warned'] = version
+                st.warning("⚠️ Không thể đọc machine_list")
+        else:
+            rows = data['machine_list']
+        registry = MachineRegistry.from_rows(rows, CONFIG['lathe_machines'], CONFIG['departments'])
+        span['rows'] = len(registry)
+    return registry
+
+
+def show_full_stop_days(stop_days):
+    """Bảng máy × ngày dừng toàn bộ ca (bỏ các máy không có dữ liệu cả khoảng - đã liệt kê ở bảng trên)"""
+    matrix = stop_days.values
+    rows = (matrix == DAY_FULL_STOP).any(axis=1) | (
+        (matrix == DAY_NO_DATA).any(axis=1) & (matrix != DAY_NO_DATA).any(axis=1)
+    )
+    n_full_stop = int((matrix == DAY_FULL_STOP).sum())
+    st.markdown("#### 📅 Dừng toàn bộ ca theo ngày")
+    st.caption(f"🛑 {n_full_stop} máy-ngày dừng toàn bộ ca · – không có dữ liệu trong ngày")
+    if not (matrix == DAY_FULL_STOP).any():
+        st.success("✅ Không có máy-ngày nào dừng toàn bộ ca")
+        return
     
-    # Add bars for processing time
-    for i, cat in enumerate(categories):
-        fig.add_trace(go.Bar(
-            name=f'Thời gian gia công máy {cat.lower()}',
-            x=[cat],
-            y=[percentages[i]],
-            marker_color=colors.get(cat, '#999999'),
-            text=f'{times[i]:.0f}<br>{percentages[i]:.0f}%',
-            textposition='inside',
-            textfont=dict(size=14, color='black'),
-            showlegend=True
-        ))
+    symbols = np.empty(3, dtype=object)
+    symbols[DAY_RUNNING], symbols[DAY_FULL_STOP], symbols[DAY_NO_DATA] = '', '🛑', '–'
+    df_days = pd.DataFrame(
+        symbols[matrix[rows]],
+        index=stop_days.index[rows],
+        columns=[d.strftime('%d/%m') for d in stop_days.columns]
+    )
+    df_days.index.name = 'Số máy'
+    st.dataframe(df_days, use_container_width=True, height=400)
+
+
+# Bản đồ nhiệt: nhãn -> (khóa trong HEATMAP_METRICS, thang màu)
+HEATMAP_OPTIONS = {
+    'Tỷ lệ gia công': ('gia_cong', 'Greens'),
+    'Tỷ lệ dừng': ('dung', 'Reds'),
+    'Tỷ lệ gá lắp': ('ga_lap', 'Greys'),
+}
+
+
+def show_utilization_heatmap(dept, matrix, machines, days):
+    """Bản đồ nhiệt máy × ngày của một tỷ lệ chọn bằng radio (một trace cho mọi máy)"""
+    if not len(machines) or not len(days):
+        st.warning("Không có dữ liệu")
+        return
+    label = st.radio("Tỷ lệ:", options=list(HEATMAP_OPTIONS), horizontal=True, key=f'heatmap_metric_{dept}')
+    metric, colorscale = HEATMAP_OPTIONS[label]
+    values = matrix[list(HEATMAP_METRICS).index(metric)]
+    fig = create_machine_day_heatmap(values, machines, days, f"{label.upper()} THEO MÁY VÀ NGÀY - {dept}",
+                                     label, colorscale)
+    st.plotly_chart(fig, use_container_width=True)
+
+
+def show_trend(date_index, daily_cube, departments):
+    """Xu hướng tỷ lệ gia công / dừng theo tháng của từng phân xưởng, nhóm máy và từng máy"""
+    st.markdown("---")
+    st.header("📈 XU HƯỚNG THEO THÁNG")
     
-    # Add annotations (callouts) for machine counts above bars
-    annotations = []
-    for i, cat in enumerate(categories):
-        annotations.append(dict(
-            x=cat,
-            y=percentages[i] + 5,  # Position above bar
-            text=f'Số máy {cat.lower()} chạy {cat.split()[1]}<br>{counts[i]}',
-            showarrow=True,
-            arrowhead=2,
-            arrowsize=1,
-            arrowwidth=1,
-            arrowcolor='#666666',
-            ax=0,
-            ay=-40,
-            font=dict(size=10, color='black'),
-            bgcolor='white',
-            bordercolor='#666666',
-            borderwidth=1,
-            borderpad=4
-        ))
+    col1, col2 = st.columns(2)
+    with col1:
+        n_months = st.radio("Số tháng gần nhất:", options=CONFIG['trend_months'], horizontal=True)
+    with col2:
+        machine_types = {'Tổng': 'all', 'Tiện': 'lathe', 'Phay': 'milling'}
+        type_label = st.radio("Nhóm máy:", options=list(machine_types), horizontal=True)
+    machine_type = machine_types[type_label]
     
-    # Update layout
-    fig.update_layout(
-        title=dict(text='Thời gian + Số máy chạy phay + tiện 2 ca SX', font=dict(size=20)),
-        xaxis=dict(title='', tickfont=dict(size=14)),
-        yaxis=dict(
-            title=dict(text='Tỷ lệ %', font=dict(size=14)),
-            range=[0, 80],  # Adjusted for annotations
-            tickfont=dict(size=12)
-        ),
-        height=500,
-        showlegend=True,
-        legend=dict(
-            orientation="h",
-            yanchor="bottom",
-            y=-0.2,
-            xanchor="center",
-            x=0.5,
-            font=dict(size=11)
-        ),
-        annotations=annotations,
-        hovermode='x unified'
-    )
+    months = date_index.month_options()[:n_months]
+    with stage('monthly_trend', cached=True) as span:
+        aggregates = get_monthly_trend().aggregates(date_index, daily_cube, months)
+        span['months'] = len(aggregates)
     
-    return fig
+    for dept in departments:
+        trend = trend_table(aggregates, dept, machine_type)
+        if trend.empty:
+            st.warning(f"Không có dữ liệu xu hướng cho {dept}")
+            continue
+        fig = create_trend_chart(trend, f"XU HƯỚNG CÔNG SUẤT {type_label.upper()} - {dept}")
+        st.plotly_chart(fig, use_container_width=True)
+        
+        with st.expander(f"📋 Tỷ lệ gia công từng máy theo tháng - {dept}"):
+            df_machines = machine_trend(aggregates, dept, machine_type)
+            st.dataframe(df_machines.round(1), use_container_width=True)
+
+
+def show_diagnostics():
+    """Bảng chẩn đoán hiệu năng ở sidebar: các bước của lần chạy này + các lần làm mới gần nhất"""
+    with st.sidebar.expander("🩺 Chẩn đoán hiệu năng", expanded=True):
+        records = run_records()
+        if records:
+            df_run = pd.DataFrame(records)
+            cols = [c for c in ['stage', 'ms', 'rows', 'cache', 'mode', 'dept', 'error'] if c in df_run.columns]
+            st.caption(f"Lần chạy này: {df_run.loc[df_run['stage'] == 'main', 'ms'].sum():.0f} ms")
+            st.dataframe(df_run[cols], use_container_width=True, hide_index=True)
+        
+        if isinstance(get_data_source(), SheetsSource):
+            gateway = get_sheets_gateway()
+            if gateway:
+                st.caption(f"🔌 Tổng số lần gọi Google Sheets API: {gateway.api_calls}")
+        
+        refreshes = [r for r in RECENT if r['stage'] in ('shared_fetch', 'fetch_sheets_data', 'sheets.values_batch_get', 'read_local_file')]
+        if refreshes:
+            df_refresh = pd.DataFrame(refreshes[-10:])
+            df_refresh['ts'] = df_refresh['ts'].map(lambda t: datetime.fromtimestamp(t).strftime('%H:%M:%S'))
+            cols = [c for c in ['ts', 'stage', 'ms', 'role', 'mode', 'rows', 'api_calls', 'error'] if c in df_refresh.columns]
+            st.caption("Các lần đọc dữ liệu gần nhất")
+            st.dataframe(df_refresh[cols], use_container_width=True, hide_index=True)
 
 
 def main():
+    begin_run()
+    with stage('main'):
+        render_dashboard()
+    if st.session_state.get('show_diagnostics'):
+        show_diagnostics()
+
+
+def render_dashboard():
     st.title("📊 BIỂU ĐỒ TỔNG CÔNG SUẤT MÁY")
     
     # Sidebar
@@ -458,52 +366,64 @@ def main():
         st.header("⚙️ Cài đặt")
         
         if st.button("🔄 Làm mới dữ liệu"):
-            st.cache_data.clear()
+            # Chỉ làm mới dữ liệu nguồn, không xóa các cache khác
+            get_data_source().request_full_reload()  # Làm mới thủ công luôn tải lại toàn bộ
+            with st.spinner("Đang làm mới dữ liệu..."):
+                get_data_cache().refresh()
             st.rerun()
         
         st.markdown("---")
         st.info(f"📅 {datetime.now().strftime('%d/%m/%Y %H:%M')}")
+        st.checkbox("📉 Biểu đồ gọn (không nhãn số liệu)", key='compact_charts')
+        st.checkbox("🩺 Hiện chẩn đoán hiệu năng", key='show_diagnostics')
+
     
     # Load data
     with st.spinner("Đang tải dữ liệu PHTCV..."):
-        df_phtcv = read_phtcv_data()
+        date_index = read_phtcv_data()
+    
+    data_cache = get_data_cache()
+    if data_cache.last_error is not None:
+        if date_index is None:
+            st.error(f"❌ Lỗi đọc {get_data_source().name}: {data_cache.last_error}")
+        else:
+            st.warning(f"⚠️ Không làm mới được dữ liệu, đang hiển thị dữ liệu cũ: {data_cache.last_error}")
     
-    if df_phtcv is None or df_phtcv.empty:
+    if date_index is None or not len(date_index):
         st.error("❌ Không thể tải dữ liệu PHTCV")
         return
     
+    with st.sidebar:
+        loaded_at = datetime.fromtimestamp(data_cache.loaded_at)
+        st.caption(f"🕒 Dữ liệu lúc {loaded_at.strftime('%H:%M:%S %d/%m/%Y')} ({data_cache.age / 60:.0f} phút trước)")
+        if data_cache.refreshing:
+            st.caption("⏳ Đang làm mới dữ liệu ở nền...")
+        source_status = get_data_source().status()
+        if source_status:
+            st.caption(source_status)
+    
     # Filters - Month and Date filter with Excel export
+    # Danh sách tháng/ngày và dữ liệu đã lọc lấy từ chỉ mục ngày (dựng một lần mỗi lần nạp dữ liệu)
     col_filter1, col_filter2, col_export = st.columns([1, 1, 1])
     
     with col_filter1:
         # Get available months
-        if 'date_parsed' in df_phtcv.columns:
-            df_phtcv['year_month'] = df_phtcv['date_parsed'].dt.to_period('M')
-            available_months = df_phtcv['year_month'].dropna().unique()
-            available_months = sorted(available_months, reverse=True)
-            
-            if len(available_months) > 0:
-                month_options = ['Tất cả'] + [str(m) for m in available_months]
-                selected_month = st.selectbox(
-                    "Chọn tháng:",
-                    options=month_options,
-                    index=0
-                )
-            else:
-                selected_month = 'Tất cả'
+        available_months = date_index.month_options()
+        
+        if len(available_months) > 0:
+            month_options = ['Tất cả'] + available_months
+            selected_month = st.selectbox(
+                "Chọn tháng:",
+                options=month_options,
+                index=0
+            )
         else:
             selected_month = 'Tất cả'
     
     with col_filter2:
         # Get available dates (filtered by month if selected)
-        if 'date_parsed' in df_phtcv.columns:
-            if selected_month != 'Tất cả':
-                df_month_filtered = df_phtcv[df_phtcv['year_month'] == pd.Period(selected_month)].copy()
-                available_dates = df_month_filtered['date_parsed'].dropna().dt.date.unique()
-            else:
-                available_dates = df_phtcv['date_parsed'].dropna().dt.date.unique()
-            
-            available_dates = sorted(available_dates, reverse=True)
+        if date_index.has_dates:
+            available_dates = date_index.day_options(None if selected_month == 'Tất cả' else selected_month)
             
             if len(available_dates) > 0:
                 selected_date = st.selectbox(
@@ -518,104 +438,106 @@ def main():
             selected_date = 'Tất cả'
     
     # Filter by month and date
-    df_filtered = df_phtcv.copy()
+    filter_month = None
+    filter_date = None
     
-    if selected_month != 'Tất cả' and 'year_month' in df_filtered.columns:
-        df_filtered = df_filtered[df_filtered['year_month'] == pd.Period(selected_month)].copy()
+    if selected_month != 'Tất cả':
+        filter_month = selected_month
         st.info(f"📅 Hiển thị dữ liệu tháng: {selected_month}")
     
-    if selected_date != 'Tất cả' and 'date_parsed' in df_filtered.columns:
+    if selected_date != 'Tất cả':
         filter_date = pd.to_datetime(selected_date, format='%d/%m/%Y').date()
-        df_filtered = df_filtered[df_filtered['date_parsed'].dt.date == filter_date].copy()
         st.info(f"📅 Hiển thị dữ liệu ngày: {selected_date}")
     
+    n_filtered = date_index.count(filter_month, filter_date)
+    
     # Excel Export Button
+    # File chỉ được tạo khi bấm tải (callable) và cache theo (phiên bản dữ liệu, tháng, ngày, định dạng)
     with col_export:
-        st.write("")  # Spacing
-        st.write("")  # Spacing
-        if not df_filtered.empty:
-            # Prepare export data
-            export_df = df_filtered.copy()
-            
-            # Remove helper columns
-            cols_to_remove = ['date_parsed', 'year_month', 'sl_thuc_te']
-            export_df = export_df.drop(columns=[col for col in cols_to_remove if col in export_df.columns])
-            
-            # Convert to Excel
-            from io import BytesIO
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                export_df.to_excel(writer, index=False, sheet_name='Công suất')
-            
-            excel_data = output.getvalue()
+        if n_filtered:
+            export_format = st.selectbox("Định dạng xuất:", options=list(EXPORT_FORMATS), index=0)
+            extension, mime, _ = EXPORT_FORMATS[export_format]
+            if export_format == 'Excel' and n_filtered > CONFIG['export_csv_suggest_rows']:
+                st.caption("💡 Dữ liệu lớn, chọn CSV để xuất nhanh hơn")
             
             # Determine filename
             if selected_month != 'Tất cả':
-                filename = f"cong_suat_{selected_month}.xlsx"
+                filename = f"cong_suat_{selected_month}.{extension}"
             elif selected_date != 'Tất cả':
-                filename = f"cong_suat_{selected_date.replace('/', '-')}.xlsx"
+                filename = f"cong_suat_{selected_date.replace('/', '-')}.{extension}"
             else:
-                filename = "cong_suat_tat_ca.xlsx"
+                filename = f"cong_suat_tat_ca.{extension}"
             
             st.download_button(
-                label="📥 Xuất Excel",
-                data=excel_data,
+                label=f"📥 Xuất {export_format}",
+                data=lambda: build_export_file(
+                    date_index.version, filter_month, filter_date, export_format, date_index
+                ),
                 file_name=filename,
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                mime=mime
             )
 
     
-    # Calculate capacity for both departments first
-    departments = ['Sản xuất 1', 'Sản xuất 2']
-    dept_capacities = {}
+    # Calculate capacity for all departments first
+    # Cộng dồn các ô cube theo ngày trong khoảng đã chọn, mọi bảng/biểu đồ bên dưới dùng kết quả này
+    # Phân xưởng / nhóm máy theo danh mục máy (machine_list), mặc định theo CONFIG
+    registry = read_machine_registry()
+    departments = registry.departments
+    with stage('daily_cube', cached=True) as span:
+        daily_cube = get_daily_cube(date_index.version, date_index)
+        span['mode'] = get_cube_builder().last_mode
+    core = get_capacity_core()
+    
+    def stacked_bar_chart(data_dict, title):
+        """Biểu đồ xếp chồng đã cache; gọn khi người dùng chọn hoặc khi có nhiều cột"""
+        compact = (st.session_state.get('compact_charts', False)
+                   or len(data_dict) > CONFIG['chart_compact_categories'])
+        return get_stacked_bar_chart(date_index.version, registry.version, filter_month, filter_date,
+                                     title, compact, data_dict)
+    
+    with stage('rollup_capacity', cached=True) as span:
+        # Mọi (phân xưởng, nhóm máy) trong một lần groupby, đã nhớ theo (phiên bản dữ liệu, lọc, danh mục)
+        breakdown = core.breakdown(daily_cube, filter_month, filter_date, registry)
+        span['rows'] = len(breakdown)
+        dept_capacities = {
+            dept: breakdown[(dept, 'all')] for dept in departments if (dept, 'all') in breakdown
+        }
     
-    for dept in departments:
-        df_dept = df_filtered[df_filtered['bộ phận'] == dept].copy()
-        if not df_dept.empty:
-            cap_total = calculate_capacity_by_type(df_dept, 'all')
-            if cap_total:
-                dept_capacities[dept] = cap_total
+    def class_capacities(dept):
+        """{nhóm máy: Capacity} của một phân xưởng, theo thứ tự nhóm của danh mục"""
+        return {c: breakdown[(dept, c)] for c in registry.classes if (dept, c) in breakdown}
     
-    # ========== BIỂU ĐỒ TỔNG SX1 VÀ SX2 ==========
+    # ========== BIỂU ĐỒ TỔNG CÁC PHÂN XƯỞNG ==========
     if len(dept_capacities) >= 2:
+        short_names = ' VÀ '.join(dept_short_name(d) for d in dept_capacities)
         st.markdown("---")
-        st.header("📊 SO SÁNH CÔNG SUẤT TỔNG SX1 VÀ SX2")
+        st.header(f"📊 SO SÁNH CÔNG SUẤT TỔNG {short_names}")
         
         # Display summary metrics
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            sx1_cap = dept_capacities.get('Sản xuất 1', {})
-            if sx1_cap:
-                st.metric("🏭 Sản xuất 1 - Tổng thời gian", f"{sx1_cap['total_time']:.0f} phút")
-                st.metric("Tỷ lệ gia công", f"{sx1_cap['pct_gia_cong']:.1f}%")
-        
-        with col2:
-            sx2_cap = dept_capacities.get('Sản xuất 2', {})
-            if sx2_cap:
-                st.metric("🏭 Sản xuất 2 - Tổng thời gian", f"{sx2_cap['total_time']:.0f} phút")
-                st.metric("Tỷ lệ gia công", f"{sx2_cap['pct_gia_cong']:.1f}%")
+        for col, (dept, cap) in zip(st.columns(len(dept_capacities)), dept_capacities.items()):
+            with col:
+                st.metric(f"🏭 {dept} - Tổng thời gian", f"{cap.total_time:.0f} phút")
+                st.metric("Tỷ lệ gia công", f"{cap.pct_gia_cong:.1f}%")
         
         # Create combined chart
-        combined_data = {
-            'SẢN XUẤT 1': dept_capacities['Sản xuất 1'],
-            'SẢN XUẤT 2': dept_capacities['Sản xuất 2']
-        }
+        combined_data = {dept.upper(): cap for dept, cap in dept_capacities.items()}
         
-        fig_combined = create_stacked_bar_chart(combined_data, "BIỂU ĐỒ SO SÁNH CÔNG SUẤT TỔNG - SX1 VÀ SX2")
+        with stage('create_stacked_bar_chart', cached=True, dept=short_names.replace(' VÀ ', ' + ')):
+            fig_combined = stacked_bar_chart(combined_data, f"BIỂU ĐỒ SO SÁNH CÔNG SUẤT TỔNG - {short_names}")
         st.plotly_chart(fig_combined, use_container_width=True)
         
         # Show comparison table
         with st.expander("📋 Xem bảng so sánh chi tiết"):
+            caps = list(dept_capacities.values())
             comparison_df = pd.DataFrame({
-                'Phân xưởng': ['Sản xuất 1', 'Sản xuất 2'],
-                'Tổng phút': [sx1_cap['total_time'], sx2_cap['total_time']],
-                'Gia công (%)': [f"{sx1_cap['pct_gia_cong']:.0f}%", f"{sx2_cap['pct_gia_cong']:.0f}%"],
-                'Gá lắp (%)': [f"{sx1_cap['pct_ga_lap']:.0f}%", f"{sx2_cap['pct_ga_lap']:.0f}%"],
-                'Chạy thử (%)': [f"{sx1_cap['pct_chay_thu']:.0f}%", f"{sx2_cap['pct_chay_thu']:.0f}%"],
-                'Dừng (%)': [f"{sx1_cap['pct_dung']:.0f}%", f"{sx2_cap['pct_dung']:.0f}%"],
-                'Dừng khác (%)': [f"{sx1_cap['pct_dung_khac']:.0f}%", f"{sx2_cap['pct_dung_khac']:.0f}%"],
-                'Sửa (%)': [f"{sx1_cap['pct_sua']:.0f}%", f"{sx2_cap['pct_sua']:.0f}%"],
+                'Phân xưởng': list(dept_capacities),
+                'Tổng phút': [cap.total_time for cap in caps],
+                'Gia công (%)': [f"{cap.pct_gia_cong:.0f}%" for cap in caps],
+                'Gá lắp (%)': [f"{cap.pct_ga_lap:.0f}%" for cap in caps],
+                'Chạy thử (%)': [f"{cap.pct_chay_thu:.0f}%" for cap in caps],
+                'Dừng (%)': [f"{cap.pct_dung:.0f}%" for cap in caps],
+                'Dừng khác (%)': [f"{cap.pct_dung_khac:.0f}%" for cap in caps],
+                'Sửa (%)': [f"{cap.pct_sua:.0f}%" for cap in caps],
             })
             st.dataframe(comparison_df, use_container_width=True)
         
@@ -623,50 +545,20 @@ def main():
         st.markdown("---")
         st.header("📊 THỜI GIAN + SỐ MÁY CHẠY PHAY + TIỆN 2 CA SX")
         
-        # Calculate data for all 4 categories
-        time_data = {}
+        # Số máy chạy của từng (nhóm máy có dữ liệu, phân xưởng), 0 nếu phân xưởng không có nhóm đó
         count_data = {}
-        
-        for dept in departments:
-            df_dept_chart = df_filtered[df_filtered['bộ phận'] == dept].copy()
-            if not df_dept_chart.empty:
-                # Calculate lathe data
-                lathe_cap = calculate_capacity_by_type(df_dept_chart, 'lathe')
-                if lathe_cap:
-                    dept_short = 'SX1' if dept == 'Sản xuất 1' else 'SX2'
-                    time_data[f'Tiện {dept_short}'] = lathe_cap['time_gia_cong']
-                    count_data[f'Tiện {dept_short}'] = calculate_machine_counts(df_dept_chart, 'lathe', dept)
-                
-                # Calculate milling data
-                milling_cap = calculate_capacity_by_type(df_dept_chart, 'milling')
-                if milling_cap:
-                    dept_short = 'SX1' if dept == 'Sản xuất 1' else 'SX2'
-                    time_data[f'Phay {dept_short}'] = milling_cap['time_gia_cong']
-                    count_data[f'Phay {dept_short}'] = calculate_machine_counts(df_dept_chart, 'milling', dept)
-        
-        # Display as metric boxes - showing separate lathe and milling counts
-        if time_data and count_data:
-            col1, col2, col3, col4 = st.columns(4)
-            
-            with col1:
-                # Box 1: Số máy tiện SX1
-                count_sx1_tien = count_data.get('Tiện SX1', 0)
-                st.metric("Số máy tiện chạy SX1", f"{count_sx1_tien}")
-            
-            with col2:
-                # Box 2: Số máy tiện SX2
-                count_sx2_tien = count_data.get('Tiện SX2', 0)
-                st.metric("Số máy tiện chạy SX2", f"{count_sx2_tien}")
-            
-            with col3:
-                # Box 3: Số máy phay SX1
-                count_sx1_phay = count_data.get('Phay SX1', 0)
-                st.metric("Số máy phay chạy SX1", f"{count_sx1_phay}")
-            
-            with col4:
-                # Box 4: Số máy phay SX2
-                count_sx2_phay = count_data.get('Phay SX2', 0)
-                st.metric("Số máy phay chạy SX2", f"{count_sx2_phay}")
+        for machine_class in registry.classes:
+            if not any((dept, machine_class) in breakdown for dept in departments):
+                continue
+            for dept in departments:
+                cap = breakdown.get((dept, machine_class))
+                count_data[(machine_class, dept_short_name(dept))] = cap.running_machines if cap else 0
+        
+        # Display as metric boxes - one per machine class and department
+        if count_data:
+            for col, ((machine_class, dept_short), count) in zip(st.columns(len(count_data)), count_data.items()):
+                with col:
+                    st.metric(f"Số máy {machine_class.lower()} chạy {dept_short}", f"{count}")
 
             
 
@@ -674,112 +566,59 @@ def main():
             st.warning("Không đủ dữ liệu để hiển thị")
     
     
+    show_trend(date_index, daily_cube, departments)
+    
     # ========== CHI TIẾT CÁC CA ==========
     st.markdown("---")
     st.header("📋 CHI TIẾT CÁC CA")
     
+    # Get full machine list (một lần cho mọi phân xưởng)
+    all_machines_full = registry.machines
+    
     for dept in departments:
         st.markdown("---")
         st.subheader(f"Công Suất {dept}")
         
-        # Filter by department
-        df_dept = df_filtered[df_filtered['bộ phận'] == dept].copy()
-        
-        if df_dept.empty:
+        if dept not in core.departments(daily_cube, filter_month, filter_date):
             st.warning(f"Không có dữ liệu cho {dept}")
             continue
         
-        # Calculate capacity for 3 categories
-        cap_lathe = calculate_capacity_by_type(df_dept, 'lathe')
-        cap_milling = calculate_capacity_by_type(df_dept, 'milling')
-        cap_total = calculate_capacity_by_type(df_dept, 'all')
+        # Công suất từng nhóm máy + tổng phân xưởng
+        caps = class_capacities(dept)
+        cap_total = dept_capacities.get(dept)
         
-        if not cap_lathe or not cap_milling or not cap_total:
+        if not caps or not cap_total:
             st.error(f"Không thể tính toán công suất cho {dept}")
             continue
         
         # Display metrics
-        col1, col2, col3 = st.columns(3)
-        
-        with col1:
-            st.metric("Tổng CS Máy Tiện", f"{cap_lathe['total_time']:.0f} phút")
-            st.metric("Tỷ lệ gia công", f"{cap_lathe['pct_gia_cong']:.0f}%")
+        cols = st.columns(len(caps) + 1)
+        for col, (machine_class, cap) in zip(cols, caps.items()):
+            with col:
+                st.metric(f"Tổng CS Máy {machine_class}", f"{cap.total_time:.0f} phút")
+                st.metric("Tỷ lệ gia công", f"{cap.pct_gia_cong:.0f}%")
         
-        with col2:
-            st.metric("Tổng CS Máy Phay", f"{cap_milling['total_time']:.0f} phút")
-            st.metric("Tỷ lệ gia công", f"{cap_milling['pct_gia_cong']:.0f}%")
-        
-        with col3:
-            st.metric("Tổng Cộng", f"{cap_total['total_time']:.0f} phút")
-            st.metric("Tỷ lệ gia công", f"{cap_total['pct_gia_cong']:.0f}%")
+        with cols[-1]:
+            st.metric("Tổng Cộng", f"{cap_total.total_time:.0f} phút")
+            st.metric("Tỷ lệ gia công", f"{cap_total.pct_gia_cong:.0f}%")
         
         # Create chart
-        data_dict = {
-            'TỔNG CS MÁY TIỆN': cap_lathe,
-            'TỔNG CS MÁY PHAY': cap_milling,
-            'TỔNG CỘNG': cap_total
-        }
+        data_dict = {f'TỔNG CS MÁY {machine_class.upper()}': cap for machine_class, cap in caps.items()}
+        data_dict['TỔNG CỘNG'] = cap_total
         
-        fig = create_stacked_bar_chart(data_dict, f"BIỂU ĐỒ TỔNG CÔNG SUẤT MÁY - {dept}")
+        with stage('create_stacked_bar_chart', cached=True, dept=dept):
+            fig = stacked_bar_chart(data_dict, f"BIỂU ĐỒ TỔNG CÔNG SUẤT MÁY - {dept}")
         st.plotly_chart(fig, use_container_width=True)
         
         # Show detailed analysis in tabs
         st.markdown("### 📋 Phân tích chi tiết")
         
-        tab1, tab2, tab3, tab4 = st.tabs(["⚠️ Máy dừng > 10%", "🔧 Máy gá lắp > 10%", "⏱️ Máy chuẩn bị > 10%", "🛑 Máy dừng 100%"])
+        tab1, tab2, tab3, tab4, tab5 = st.tabs(["⚠️ Máy dừng > 10%", "🔧 Máy gá lắp > 10%", "⏱️ Máy chuẩn bị > 10%", "🛑 Máy dừng 100%", "🌡️ Bản đồ nhiệt theo ngày"])
         
         # Calculate machine-level statistics
-        df_dept['sl_thuc_te'] = pd.to_numeric(
-            df_dept['sl thực tế'].astype(str).str.replace(',', '.'),
-            errors='coerce'
-        ).fillna(1)
-        
-        # Group by machine
-        machine_stats = []
-        for machine in df_dept['số máy'].unique():
-            df_machine = df_dept[df_dept['số máy'] == machine].copy()
-            
-            # Calculate times
-            time_tgcb = df_machine['tgcb'].sum()
-            time_chay_thu = df_machine['chạy thử'].sum()
-            time_ga_lap = (df_machine['gá lắp'] * df_machine['sl_thuc_te']).sum()
-            time_gia_cong = (df_machine['gia công'] * df_machine['sl_thuc_te']).sum()
-            
-            SHIFT_TIMES = [420, 630, 660]
-            df_dung_filtered = df_machine[~df_machine['dừng'].isin(SHIFT_TIMES)].copy()
-            time_dung = df_dung_filtered['dừng'].sum()
-            
-            if 'dừng khác' in df_machine.columns:
-                df_dung_khac_filtered = df_machine[~df_machine['dừng khác'].isin(SHIFT_TIMES)].copy()
-                time_dung_khac = df_dung_khac_filtered['dừng khác'].sum()
-            else:
-                time_dung_khac = 0
-            
-            time_sua = df_machine['sửa'].sum()
-            total_time = time_tgcb + time_chay_thu + time_ga_lap + time_gia_cong + time_dung + time_dung_khac + time_sua
-            
-            if total_time > 0:
-                # Get explanations
-                explanations = df_machine['giải trình'].dropna().tolist() if 'giải trình' in df_machine.columns else []
-                explanation_text = ', '.join([str(e) for e in explanations if str(e).strip() != ''])
-                
-                machine_stats.append({
-                    'số máy': machine,
-                    'machine_num': int(machine) if machine.isdigit() else 9999,  # For sorting
-                    'total_time': total_time,
-                    'time_dung': time_dung,
-                    'time_dung_khac': time_dung_khac,
-                    'time_ga_lap': time_ga_lap,
-                    'time_tgcb': time_tgcb,
-                    'pct_dung': (time_dung / total_time * 100),
-                    'pct_dung_khac': (time_dung_khac / total_time * 100),
-                    'pct_ga_lap': (time_ga_lap / total_time * 100),
-                    'pct_tgcb': (time_tgcb / total_time * 100),
-                    'pct_total_stop': ((time_dung + time_dung_khac) / total_time * 100),
-                    'explanation': explanation_text
-                })
-        
-        df_machine_stats = pd.DataFrame(machine_stats)
+        with stage('machine_stats', cached=True, dept=dept) as span:
+            df_machine_stats = core.machine_stats(daily_cube, filter_month, filter_date, dept)
+            span['rows'] = len(df_machine_stats)
         
         # TAB 1: Máy dừng > 10%
         with tab1:
@@ -826,76 +665,11 @@ def main():
         
         # TAB 4: Máy dừng 100%
         with tab4:
-            # Determine which machine type we're analyzing based on the data
-            # Check if we have lathe or milling machines in this department
-            lathe_machines_config = CONFIG['lathe_machines']
-            machines_in_dept = df_dept['số máy'].unique().tolist()
-            
-            # Determine machine type for this analysis
-            has_lathe = any(m in lathe_machines_config for m in machines_in_dept)
-            has_milling = any(m not in lathe_machines_config for m in machines_in_dept)
-            
-            # Get full machine list from Google Sheets
-            all_machines_full = read_machine_list()
-            
-            # Filter machine list by type based on what's in this department
-            # If department has both types, we need to show separately
-            # For now, we'll filter based on the predominant type
-            if has_lathe and not has_milling:
-                # Only lathe machines in this dept
-                all_machines = [m for m in all_machines_full if m in lathe_machines_config]
-                machine_type_label = "máy tiện"
-            elif has_milling and not has_lathe:
-                # Only milling machines in this dept
-                all_machines = [m for m in all_machines_full if m not in lathe_machines_config]
-                machine_type_label = "máy phay"
-            else:
-                # Mixed - use all machines (shouldn't happen in normal case)
-                all_machines = all_machines_full
-                machine_type_label = "máy"
-            
-            # Get machines in current department data
-            machines_in_data = df_dept['số máy'].unique().tolist()
-            
-            # CONDITION 1: Machines NOT in data (filtered by type)
-            machines_not_in_data = [m for m in all_machines if m not in machines_in_data]
-            
-            # CONDITION 2 AND 3: Machines with stop time >= shift times AND all production columns empty
-            stopped_machines_with_data = []
-            SHIFT_TIMES = [420, 630, 660]
-            
-            for machine in machines_in_data:
-                # Only process machines of the correct type
-                if machine not in all_machines:
-                    continue
-                    
-                df_machine = df_dept[df_dept['số máy'] == machine].copy()
-                
-                # Check if machine has stop time >= any shift time
-                max_dung = df_machine['dừng'].max()
-                max_dung_khac = df_machine['dừng khác'].max() if 'dừng khác' in df_machine.columns else 0
-                
-                has_shift_stop = (max_dung >= 420) or (max_dung_khac >= 420)
-                
-                # Check if all production columns are empty/zero
-                time_tgcb = df_machine['tgcb'].sum()
-                time_chay_thu = df_machine['chạy thử'].sum()
-                time_ga_lap = df_machine['gá lắp'].sum()
-                time_gia_cong = df_machine['gia công'].sum()
-                
-                has_no_production = (time_tgcb == 0 and time_chay_thu == 0 and 
-                                    time_ga_lap == 0 and time_gia_cong == 0)
-                
-                # Condition 2 AND 3
-                if has_shift_stop and has_no_production:
-                    stopped_machines_with_data.append(machine)
-            
-            # FINAL: Condition 1 OR (Condition 2 AND 3)
-            # Sort numerically by converting to int
-            all_stopped_machines = sorted(
-                set(machines_not_in_data + stopped_machines_with_data),
-                key=lambda x: int(x) if x.isdigit() else float('inf')
-            )
+            with stage('full_stop_100', cached=True, dept=dept):
+                all_stopped_machines, machines_not_in_data, machine_type_label = core.full_stop(
+                    daily_cube, filter_month, filter_date, dept, all_machines_full, CONFIG['lathe_machines'],
+                    registry.machines_in(dept)
+                )
             total_stopped = len(all_stopped_machines)
             
             # Display results
@@ -925,6 +699,31 @@ def main():
                 )
             else:
                 st.success("✅ Không có máy nào dừng 100%")
+            
+            # Theo từng ngày: máy dừng toàn bộ ca trong một ngày cũng hiện ra dù cả khoảng vẫn có chạy
+            # Chỉ dựng khi đã chọn một tháng: 'Tất cả' tháng là toàn bộ lịch sử (hàng trăm cột ngày)
+            if filter_month is None:
+                st.info("Chọn một tháng để xem máy dừng toàn bộ ca theo từng ngày")
+            elif filter_date is not None:
+                st.info("Chọn 'Tất cả' ngày để xem máy dừng toàn bộ ca theo từng ngày")
+            else:
+                with stage('full_stop_days', cached=True, dept=dept):
+                    stop_days = core.full_stop_days(
+                        daily_cube, filter_month, filter_date, dept, all_machines_full, CONFIG['lathe_machines'],
+                        registry.machines_in(dept)
+                    )
+                show_full_stop_days(stop_days)
+        
+        # TAB 5: Bản đồ nhiệt máy × ngày
+        with tab5:
+            if filter_month is None:
+                st.info("Chọn một tháng để xem bản đồ nhiệt theo ngày")
+            elif filter_date is not None:
+                st.info("Chọn 'Tất cả' ngày để xem bản đồ nhiệt theo ngày")
+            else:
+                with stage('utilization_days', cached=True, dept=dept):
+                    matrix, machines, days = core.utilization_days(daily_cube, filter_month, filter_date, dept)
+                show_utilization_heatmap(dept, matrix, machines, days)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Đo hiệu năng từng bước: thời gian, số dòng, cache hit/miss, số lần gọi Google Sheets API
+Mỗi bước ghi một dòng log JSON (logger 'baocaosx.perf') để gom lại phân tích
+(không phụ thuộc Streamlit)
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger('baocaosx.perf')
+
+# Các bước gần nhất của mọi luồng (kể cả làm mới nền), dùng cho bảng chẩn đoán
+RECENT = deque(maxlen=200)
+
+_local = threading.local()
+
+
+def configure_logging(target):
+    """
+    Bật ghi log JSON: target = '-' (stderr) hoặc đường dẫn file, rỗng/None = tắt
+    Gọi nhiều lần chỉ cấu hình một lần
+    """
+    if not target or logger.handlers:
+        return
+    handler = logging.StreamHandler() if target == '-' else logging.FileHandler(target, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def begin_run():
+    """Bắt đầu thu các bước của một lần chạy (một lần rerun Streamlit / một lệnh) trên luồng hiện tại"""
+    _local.run = []
+
+
+def run_records():
+    """Các bước đã ghi từ begin_run() trên luồng hiện tại"""
+    return list(getattr(_local, 'run', None) or [])
+
+
+@contextmanager
+def stage(name, cached=False, **fields):
+    """
+    Đo một bước: with stage('read_phtcv_data', cached=True) as span: ... span['rows'] = n
+    cached=True: mặc định tính là cache hit, code tải thật bên trong gọi cache_miss()
+    """
+    record = {'stage': name, **fields}
+    if cached:
+        record['cache'] = 'hit'
+    stack = _stack()
+    stack.append(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record['error'] = type(e).__name__
+        raise
+    finally:
+        record['ms'] = round((time.perf_counter() - start) * 1000, 2)
+        stack.pop()
+        record['thread'] = threading.current_thread().name
+        record['ts'] = round(time.time(), 3)
+        _emit(record)
+
+
+def cache_miss():
+    """Đánh dấu bước có cache gần nhất đang chạy trên luồng này là miss (gọi bên trong hàm được cache)"""
+    for record in reversed(_stack()):
+        if 'cache' in record:
+            record['cache'] = 'miss'
+            return
+
+
+def _emit(record):
+    run = getattr(_local, 'run', None)
+    if run is not None:
+        run.append(record)
+    RECENT.append(record)
+    if logger.handlers:
+        logger.info(json.dumps(record, ensure_ascii=False, default=str))
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Danh mục máy đọc từ sheet machine_list: số máy -> (nhóm máy, bộ phận), tra cứu O(1) bằng dict
+- Cột nhóm máy / bộ phận nhận theo tên header (không có thì dùng CONFIG: lathe_machines, departments)
+- Thêm phân xưởng / nhóm máy mới chỉ cần thêm dòng vào machine_list, không sửa code
+(không phụ thuộc Streamlit)
+"""
+
+import numpy as np
+
+# Nhóm máy mặc định khi machine_list không có cột nhóm máy (theo CONFIG['lathe_machines'])
+LATHE_CLASS = 'Tiện'
+MILLING_CLASS = 'Phay'
+
+# Tên header (chữ thường) của từng cột trong machine_list
+MACHINE_HEADERS = ('số máy', 'máy', 'machine')
+CLASS_HEADERS = ('loại máy', 'nhóm máy', 'loại', 'machine_type', 'type')
+DEPT_HEADERS = ('bộ phận', 'phân xưởng', 'department')
+
+# Giá trị nhóm máy viết khác nhau -> tên chuẩn
+CLASS_ALIASES = {
+    'tiện': LATHE_CLASS, 'lathe': LATHE_CLASS,
+    'phay': MILLING_CLASS, 'milling': MILLING_CLASS,
+}
+
+
+def _find_column(header, names):
+    """Vị trí cột đầu tiên có header thuộc names, None nếu không có"""
+    for i, h in enumerate(header):
+        if str(h).strip().lower() in names:
+            return i
+    return None
+
+
+def _cell(row, col):
+    if col is None or col >= len(row):
+        return ''
+    return str(row[col]).strip()
+
+
+class MachineRegistry:
+    """
+    Danh mục máy: thứ tự máy theo machine_list, nhóm máy và bộ phận của từng máy
+    Máy không có trong danh mục (hoặc không ghi nhóm) -> 'Tiện' nếu thuộc lathe_machines, ngược lại 'Phay'
+    """
+
+    def __init__(self, entries=(), lathe_machines=(), departments=()):
+        """entries: các bộ (số máy, nhóm máy, bộ phận), nhóm / bộ phận rỗng = không ghi"""
+        self._lathe = frozenset(lathe_machines)
+        self._class = {}
+        self._dept = {}
+        self.machines = []
+        for machine, machine_class, dept in entries:
+            if not machine or machine in self._class:
+                continue
+            self.machines.append(machine)
+            machine_class = CLASS_ALIASES.get(machine_class.lower(), machine_class)
+            self._class[machine] = machine_class or self._default_class(machine)
+            if dept:
+                self._dept[machine] = dept
+
+        # Nhóm máy: Tiện, Phay trước (như các biểu đồ cũ) rồi tới các nhóm khác theo thứ tự xuất hiện
+        seen = dict.fromkeys([LATHE_CLASS, MILLING_CLASS] + list(self._class.values()))
+        self.classes = list(seen)
+        # Bộ phận: theo CONFIG trước, rồi các bộ phận chỉ có trong machine_list
+        self.departments = list(dict.fromkeys(list(departments) + list(self._dept.values())))
+        self.version = hash((tuple(self._class.items()), tuple(self._dept.items()), self._lathe))
+
+    @classmethod
+    def from_rows(cls, rows, lathe_machines=(), departments=()):
+        """Danh mục từ các dòng thô của sheet machine_list (dòng đầu là header)"""
+        if not rows or len(rows) < 2:
+            return cls((), lathe_machines, departments)
+        header = rows[0]
+        machine_col = _find_column(header, MACHINE_HEADERS)
+        class_col = _find_column(header, CLASS_HEADERS)
+        dept_col = _find_column(header, DEPT_HEADERS)
+        if machine_col is None:
+            machine_col = 0  # Cột đầu tiên là số máy
+        entries = (
+            (_cell(r, machine_col), _cell(r, class_col), _cell(r, dept_col))
+            for r in rows[1:] if r
+        )
+        return cls(entries, lathe_machines, departments)
+
+    def __len__(self):
+        return len(self.machines)
+
+    def _default_class(self, machine):
+        return LATHE_CLASS if machine in self._lathe else MILLING_CLASS
+
+    def class_of(self, machine):
+        """Nhóm máy của một máy"""
+        machine = str(machine)
+        return self._class.get(machine) or self._default_class(machine)
+
+    def classify(self, machines):
+        """Nhóm máy cho cả mảng số máy (mỗi số máy khác nhau tra dict một lần)"""
+        uniques, codes = np.unique(np.asarray(machines, dtype=str), return_inverse=True)
+        return np.array([self.class_of(m) for m in uniques], dtype=object)[codes]
+
+    def machines_in(self, dept):
+        """Máy thuộc một bộ phận theo machine_list, None nếu machine_list không có cột bộ phận"""
+        if not self._dept:
+            return None
+        return [m for m in self.machines if self._dept.get(m) == dept]
@@ -0,0 +1,515 @@
+# -*- coding: utf-8 -*-
+"""
+Tầng dữ liệu PHTCV: làm sạch dữ liệu thô và đồng bộ tăng dần từ Google Sheets
+(giữ trong bộ nhớ hoặc ghi vào kho SQLite - xem phtcv_store.py)
+(không phụ thuộc Streamlit)
+"""
+
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+from gspread.utils import rowcol_to_a1
+from pandas.api.types import union_categoricals
+
+from instrumentation import stage
+
+TIME_COLS = ['tgcb', 'chạy thử', 'gá lắp', 'gia công', 'dừng', 'dừng khác', 'sửa']
+
+# Cột lặp lại nhiều -> lưu dạng category cho nhẹ bộ nhớ và groupby nhanh
+CATEGORY_COLS = ['bộ phận', 'số máy']
+
+# Số lần nối dòng gần nhất giữ lại trên DateIndex cho các bảng tổng cập nhật tăng dần
+MAX_DELTAS = 8
+
+# Tăng khi thay đổi cách làm sạch dữ liệu -> snapshot cũ sẽ bị bỏ qua và ghi lại
+SNAPSHOT_VERSION = 2
+
+
+def _pad_rows(rows, width):
+    """Cắt/đệm các dòng về đúng số cột của header (API trả về dòng bị cắt ô trống cuối)"""
+    return [list(r[:width]) + [''] * (width - len(r)) for r in rows]
+
+
+def parse_quantity(series):
+    """sl thực tế dạng chuỗi (dấu phẩy thập phân) -> số, ô trống tính là 1"""
+    return pd.to_numeric(
+        series.astype(str).str.replace(',', '.'),
+        errors='coerce'
+    ).fillna(1)
+
+
+def clean_phtcv_rows(header, rows, lathe_machines=()):
+    """
+    Chuyển các dòng thô của sheet PHTCV thành DataFrame đã chuẩn hóa kiểu một lần duy nhất:
+    - Cột thời gian: float32
+    - sl_thuc_te: số (ô trống/lỗi = 1)
+    - bộ phận, số máy: category
+    - is_lathe: máy tiện theo CONFIG['lathe_machines']
+    - date_parsed: ngày tháng dạng datetime
+    """
+    df = pd.DataFrame(_pad_rows(rows, len(header)), columns=header)
+    df = df.dropna(axis=0, how='all')
+
+    # Convert time columns to numeric
+    for col in TIME_COLS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(
+                df[col].astype(str).str.replace(',', '.'),
+                errors='coerce'
+            ).fillna(0).astype('float32')
+
+    if 'sl thực tế' in df.columns:
+        df['sl_thuc_te'] = parse_quantity(df['sl thực tế'])
+
+    if 'số máy' in df.columns:
+        df['is_lathe'] = df['số máy'].isin(lathe_machines)
+
+    for col in CATEGORY_COLS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+
+    # Parse date column
+    if 'ngày tháng' in df.columns:
+        df['date_parsed'] = pd.to_datetime(df['ngày tháng'], format='%d/%m/%Y', errors='coerce')
+
+    return df
+
+
+def iter_row_chunks(rows, chunk_rows):
+    """Chia một iterable dòng thô (vd. csv.reader, openpyxl iter_rows) thành các list tối đa chunk_rows dòng"""
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_rows))
+        if not chunk:
+            return
+        yield chunk
+
+
+def clean_phtcv_chunks(header, chunks, lathe_machines=()):
+    """clean_phtcv_rows cho từng khối dòng thô: chỉ một khối chuỗi thô nằm trong bộ nhớ tại một thời điểm"""
+    for chunk in chunks:
+        yield clean_phtcv_rows(header, chunk, lathe_machines)
+
+
+def concat_frames(frames):
+    """
+    Nối các frame đã làm sạch trong một lần concat (không nối dần từng khối)
+    Danh mục của các cột category được hợp nhất và sắp xếp như khi làm sạch cả khối một lần
+    """
+    frames = [f.copy(deep=False) for f in frames]  # Không sửa các frame đầu vào (có thể đang dùng chung)
+    if not frames:
+        return pd.DataFrame()
+    for col in CATEGORY_COLS:
+        if len(frames) > 1 and all(col in f.columns for f in frames):
+            categories = union_categoricals([f[col] for f in frames], sort_categories=True).categories
+            for f in frames:
+                f[col] = f[col].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+
+def append_rows(df, new_df):
+    """Nối các dòng mới vào DataFrame đã chuẩn hóa, giữ kiểu category (hợp nhất danh mục)"""
+    df = df.copy(deep=False)  # Không sửa frame đang được các phiên khác đọc
+    new_df = new_df.copy(deep=False)  # new_df còn được giữ trong DateIndex.deltas với danh mục gốc
+    for col in CATEGORY_COLS:
+        if col in df.columns and col in new_df.columns:
+            old_cats = df[col].cat.categories
+            extra = new_df[col].cat.categories.difference(old_cats)
+            if len(extra):
+                df[col] = df[col].cat.add_categories(extra)
+            new_df[col] = new_df[col].cat.set_categories(df[col].cat.categories)
+    return pd.concat([df, new_df], ignore_index=True)
+
+
+class DateIndex:
+    """
+    Chỉ mục ngày dựng một lần cho mỗi lần nạp dữ liệu:
+    frame sắp xếp theo date_parsed + vị trí (start, stop) của từng tháng và từng ngày.
+    Lọc tháng/ngày chỉ là cắt lát theo vị trí, không quét boolean và không copy
+    presorted=True: frame đã sắp theo ngày (NaT ở cuối), chỉ dựng vị trí tháng/ngày, không sắp lại
+    """
+
+    def __init__(self, df, date_col='date_parsed', version=None, presorted=False):
+        self.version = version  # Phiên bản dữ liệu, dùng làm khóa cache cho các bảng dựng từ frame này
+        self.months = {}        # 'YYYY-MM' -> (start, stop)
+        self.days = {}          # datetime.date -> (start, stop)
+        self.month_days = {}    # 'YYYY-MM' -> [datetime.date, ...] giảm dần
+        self.has_dates = date_col in df.columns
+        self.n_valid = 0        # Số dòng có ngày (các dòng NaT nằm sau)
+        # [(phiên bản trước, các dòng đã làm sạch được nối vào)] của các lần nối liên tiếp dẫn tới
+        # phiên bản này; rỗng sau khi tải lại toàn bộ (các bảng tổng phải dựng lại từ đầu)
+        self.deltas = []
+
+        if date_col not in df.columns or df.empty:
+            self.df = df
+            return
+
+        if presorted:
+            self.df = df
+        else:
+            order = np.argsort(df[date_col].values, kind='stable')  # NaT xếp cuối
+            self.df = df.take(order).reset_index(drop=True)
+
+        dates = self.df[date_col].values
+        n_valid = self.n_valid = int((~np.isnat(dates)).sum())
+        days = dates[:n_valid].astype('datetime64[D]')
+
+        day_keys, day_starts = np.unique(days, return_index=True)
+        day_stops = np.append(day_starts[1:], n_valid)
+        for day, start, stop in zip(day_keys.astype(object), day_starts, day_stops):
+            self.days[day] = (int(start), int(stop))
+
+        months = days.astype('datetime64[M]')
+        month_keys, month_starts = np.unique(months, return_index=True)
+        month_stops = np.append(month_starts[1:], n_valid)
+        for month, start, stop in zip(np.datetime_as_string(month_keys, unit='M'), month_starts, month_stops):
+            self.months[month] = (int(start), int(stop))
+            self.month_days[month] = []
+
+        for day in reversed(list(self.days)):
+            self.month_days[day.strftime('%Y-%m')].append(day)
+
+    def __len__(self):
+        return len(self.df)
+
+    def month_options(self):
+        """Các tháng có dữ liệu, mới nhất trước"""
+        return sorted(self.months, reverse=True)
+
+    def day_options(self, month=None):
+        """Các ngày có dữ liệu (trong tháng nếu có), mới nhất trước"""
+        if month is not None:
+            return self.month_days.get(month, [])
+        return sorted(self.days, reverse=True)
+
+    def select(self, month=None, day=None):
+        """Cắt lát frame theo tháng ('YYYY-MM') và/hoặc ngày (datetime.date), None = tất cả"""
+        start, stop = 0, len(self.df)
+        if month is not None:
+            start, stop = self.months.get(month, (0, 0))
+        if day is not None:
+            day_start, day_stop = self.days.get(day, (0, 0))
+            if day_start < start or day_stop > stop:
+                return self.df.iloc[0:0]
+            start, stop = day_start, day_stop
+        return self.df.iloc[start:stop]
+
+    def count(self, month=None, day=None):
+        """Số dòng trong khoảng đã chọn (không cắt frame)"""
+        return len(self.select(month, day))
+
+
+class PhtcvSync:
+    """
+    Đồng bộ tăng dần sheet PHTCV (sheet chỉ nối thêm dòng mới)
+    - fetch(ranges) đọc các vùng A1 của sheet PHTCV ('' = toàn bộ sheet), trả về list dãy dòng thô
+    - Lần đầu: tải toàn bộ sheet
+    - Các lần sau: chỉ tải các dòng sau dòng cuối đã nạp, parse và nối vào DataFrame
+    - Tải lại toàn bộ khi header hoặc các dòng cuối đã nạp bị sửa/xóa,
+      hoặc khi quá full_reload_seconds kể từ lần tải toàn bộ gần nhất
+    store (PhtcvStore): ghi dòng vào kho SQLite thay vì giữ DataFrame trong bộ nhớ,
+    index là StoreIndex và trạng thái sync lưu trong kho (thay cho snapshot Parquet)
+    chunk_rows > 0: tải toàn bộ theo từng khối chunk_rows dòng (mỗi khối một lần gọi API), làm sạch
+    từng khối rồi ghi thẳng vào kho / nối một lần ở cuối -> không giữ toàn bộ sheet dạng chuỗi thô
+    """
+
+    def __init__(self, probe_rows=50, full_reload_seconds=3600, snapshot_path=None,
+                 lathe_machines=(), store=None, chunk_rows=0):
+        self.lathe_machines = list(lathe_machines)
+        self.probe_rows = probe_rows
+        self.full_reload_seconds = full_reload_seconds
+        self.snapshot_path = snapshot_path
+        self.store = store
+        self.chunk_rows = chunk_rows
+        self.version = 0        # Đổi (time_ns) mỗi khi DataFrame thay đổi
+        self.extras = {}        # Dữ liệu nhỏ đọc kèm (vd. machine_list), lưu cùng snapshot
+        self.saved_extras = {}  # extras trong snapshot đã ghi/nạp: machine_list đổi thì ghi lại snapshot
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Xóa trạng thái, lần sync sau sẽ tải lại toàn bộ"""
+        self.header = None
+        self.row_count = 0      # Số dòng dữ liệu đã nạp (không tính header)
+        self.tail_rows = []     # Các dòng thô cuối cùng đã nạp, dùng để phát hiện sửa tại chỗ
+        self.df = None          # Luôn None khi dùng kho
+        self.index = None       # DateIndex của df (df chính là frame đã sắp xếp theo ngày) / StoreIndex
+        self.saved_at = None    # Thời điểm ghi snapshot đã nạp (nếu khởi động từ snapshot)
+        self.last_full_load = 0.0
+        self.last_mode = None   # 'full' / 'incremental' / 'snapshot'
+        # True khi lần sync gần nhất chắc chắn đã đọc tới dòng cuối của sheet (tải một lần toàn bộ,
+        # hoặc đọc tăng dần không giới hạn dòng cuối); tải theo khối có thể dừng trước một đoạn dòng trống
+        self.last_complete = False
+
+    def request_full_reload(self):
+        """Buộc lần sync kế tiếp tải lại toàn bộ sheet"""
+        self.last_full_load = 0.0
+
+    @property
+    def refreshing(self):
+        """True khi đang có một lần sync chạy"""
+        return self._lock.locked()
+
+    def _set_frame(self, df):
+        """Thay dữ liệu hiện tại, dựng lại chỉ mục ngày"""
+        if self.store is not None:
+            self.store.replace(df)
+            self._set_store_index()
+            return
+        self.version = time.time_ns()
+        self.index = DateIndex(df, version=self.version)
+        self.df = self.index.df
+
+    def _set_frames(self, frames):
+        """Như _set_frame với các frame đã làm sạch theo khối (iterable, đọc lần lượt)"""
+        if self.store is not None:
+            self.store.replace_chunks(frames)
+            self._set_store_index()
+            return
+        self._set_frame(concat_frames(frames))
+
+    def _append_frame(self, new_df):
+        """
+        Nối các dòng mới đã làm sạch vào dữ liệu hiện tại
+        Kho: ghi kèm trạng thái sync trong cùng transaction; trả về False (không nối) nếu kho đã khác số dòng
+        đang thấy - tiến trình khác đã nối / tải lại
+        """
+        if self.store is not None:
+            state = self._sync_state()
+            if not self.store.append(new_df, {'sync': state}, expected_rows=len(self.index)):
+                return False
+            self.saved_at = state['saved_at']
+            self._set_store_index()
+            return True
+        base = self.index
+        self._set_frame(append_rows(self.df, new_df))
+        self.index.deltas = (base.deltas + [(base.version, new_df)])[-MAX_DELTAS:]
+        return True
+
+    def _set_store_index(self):
+        self.index = self.store.date_index()
+        self.version = self.index.version
+
+    def sync(self, fetch):
+        """Trả về DateIndex của dữ liệu PHTCV mới nhất, chỉ tải phần dòng mới nếu có thể"""
+        with self._lock:
+            version = self.version
+            expired = time.time() - self.last_full_load > self.full_reload_seconds
+            if self.index is None or expired or not self._sync_incremental(fetch):
+                self._sync_full(fetch)
+            if self.version != version or self.extras != self.saved_extras:
+                with stage('save_snapshot', rows=len(self.index)):
+                    self.save_snapshot()
+            return self.index
+
+    def _snapshot_meta_path(self):
+        return os.path.splitext(self.snapshot_path)[0] + '.json'
+
+    def _sync_state(self):
+        return {
+            'version': SNAPSHOT_VERSION,
+            'lathe_machines': self.lathe_machines,
+            'header': self.header,
+            'row_count': self.row_count,
+            'tail_rows': self.tail_rows,
+            'last_full_load': self.last_full_load,
+            'extras': self.extras,
+            'saved_at': time.time(),
+        }
+
+    def _load_sync_state(self, meta):
+        self.header = meta['header']
+        self.row_count = meta['row_count']
+        self.tail_rows = meta['tail_rows']
+        self.last_full_load = meta['last_full_load']
+        self.extras = meta.get('extras', {})
+        self.saved_extras = self.extras
+        self.saved_at = meta['saved_at']
+        self.last_mode = 'snapshot'
+
+    def save_snapshot(self):
+        """Ghi DataFrame đã làm sạch + trạng thái sync ra file Parquet (ghi đè nguyên tử)
+        Khi dùng kho: dữ liệu đã nằm trong kho, chỉ ghi trạng thái sync"""
+        if self.index is None or not len(self.index):
+            return False
+        state = self._sync_state()
+        if self.store is not None:
+            self.store.save_meta({'sync': state})
+            self.saved_at = state['saved_at']
+            self.saved_extras = self.extras
+            return True
+        if not self.snapshot_path:
+            return False
+        meta = {'columns': [str(c) for c in self.df.columns], **state}
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.snapshot_path)), exist_ok=True)
+            tmp_path = self.snapshot_path + '.tmp'
+            self.df.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, self.snapshot_path)
+            meta_path = self._snapshot_meta_path()
+            with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(meta_path + '.tmp', meta_path)
+            self.saved_at = state['saved_at']
+            self.saved_extras = self.extras
+            return True
+        except Exception:
+            # Snapshot chỉ để khởi động nhanh, lỗi ghi (thiếu pyarrow, cột trùng tên...) không chặn app
+            return False
+
+    def load_snapshot(self, force=False):
+        """Nạp snapshot vào trạng thái sync nếu chưa có dữ liệu.
+        force=True: nạp lại cả khi đã có dữ liệu nếu snapshot mới hơn (do tiến trình khác ghi)
+        Trả về False nếu không có snapshot hoặc snapshot khác phiên bản/schema"""
+        if self.store is not None:
+            return self._load_store(force)
+        if not self.snapshot_path:
+            return False
+        with self._lock:
+            if self.index is not None and not force:
+                return True
+            try:
+                with open(self._snapshot_meta_path(), encoding='utf-8') as f:
+                    meta = json.load(f)
+                if (meta.get('version') != SNAPSHOT_VERSION
+                        or meta.get('lathe_machines') != self.lathe_machines):
+                    return False
+                if self.index is not None and meta['saved_at'] == self.saved_at:
+                    return True  # Đang giữ đúng bản này
+                df = pd.read_parquet(self.snapshot_path)
+                if [str(c) for c in df.columns] != meta['columns']:
+                    return False
+            except Exception:
+                return False
+
+            self._load_sync_state(meta)
+            self._set_frame(df)
+            return True
+
+    def _load_store(self, force=False):
+        """Như load_snapshot nhưng từ kho: chỉ đọc trạng thái sync, dữ liệu vẫn nằm trong kho"""
+        with self._lock:
+            if self.index is not None and not force:
+                return True
+            return self._read_store_state()
+
+    def _read_store_state(self):
+        """Nạp trạng thái sync đã lưu trong kho (gọi khi đang giữ _lock), False nếu không dùng được"""
+        try:
+            meta = (self.store.load_meta() or {}).get('sync')
+        except Exception:
+            return False
+        if (not meta or meta.get('version') != SNAPSHOT_VERSION
+                or meta.get('lathe_machines') != self.lathe_machines):
+            return False
+        if self.index is not None and meta['saved_at'] == self.saved_at:
+            return True
+        self._load_sync_state(meta)
+        self._set_store_index()
+        return True
+
+    def _sync_full(self, fetch):
+        if self.chunk_rows:
+            self._sync_full_chunked(fetch)
+            return
+        data = fetch([''])[0]
+        self.reset()
+        self.last_full_load = time.time()
+        self.last_mode = 'full'
+        self.last_complete = True
+
+        if not data or len(data) <= 1:
+            self._set_frame(pd.DataFrame())
+            return
+
+        # Giống get_all_values(): đệm header theo dòng dài nhất
+        self.header = _pad_rows(data[:1], max(len(r) for r in data))[0]
+        rows = data[1:]
+        self.row_count = len(rows)
+        self.tail_rows = _pad_rows(rows[-self.probe_rows:], len(self.header))
+        with stage('clean_phtcv_rows', rows=len(rows), mode='full'):
+            self._set_frame(clean_phtcv_rows(self.header, rows, self.lathe_machines))
+
+    def _sync_full_chunked(self, fetch):
+        """
+        Tải toàn bộ theo khối dòng: lần gọi đầu lấy header + khối đầu tiên, các lần sau mỗi lần một khối,
+        dừng ở khối rỗng hoàn toàn. Sheets cắt các dòng trống ở cuối mỗi vùng nên khối thiếu dòng chưa chắc
+        là hết dữ liệu: đọc trước khối kế tiếp, còn dữ liệu thì đệm khối hiện tại bằng dòng trống cho đủ
+        (như get_all_values). Số cột theo header (cột không tên ở cuối bị bỏ)
+        """
+        header_rows, first = fetch(['1:1', f'2:{self.chunk_rows + 1}'])
+        self.reset()
+        self.last_full_load = time.time()
+        self.last_mode = 'full'
+
+        header = list(header_rows[0]) if header_rows else []
+        if not header or not first:
+            self._set_frame(pd.DataFrame())
+            return
+
+        self.header = header
+        width = len(header)
+        tail = deque(maxlen=self.probe_rows)
+
+        def chunks():
+            chunk, start = first, 2
+            while chunk:
+                start += self.chunk_rows
+                following = fetch([f'{start}:{start + self.chunk_rows - 1}'])[0]
+                if following:
+                    # Các dòng trống cuối khối bị cắt mất: đệm lại để số dòng khớp với lưới
+                    chunk = chunk + [[]] * (self.chunk_rows - len(chunk))
+                chunk = _pad_rows(chunk, width)
+                self.row_count = start - 2 - self.chunk_rows + len(chunk)
+                tail.extend(chunk[-self.probe_rows:])
+                with stage('clean_phtcv_rows', rows=len(chunk), mode='chunk'):
+                    yield clean_phtcv_rows(header, chunk, self.lathe_machines)
+                chunk = following
+
+        self._set_frames(chunks())
+        self.tail_rows = list(tail)
+
+    def _sync_incremental(self, fetch, retry=True):
+        """Tải header + các dòng cuối đã nạp + các dòng mới trong một lần gọi API.
+        Trả về False nếu phát hiện dữ liệu cũ bị sửa (cần tải lại toàn bộ)"""
+        if not self.header:
+            return False
+
+        width = len(self.header)
+        last_col = rowcol_to_a1(1, width).rstrip('0123456789')
+        # Dòng 1 là header, dữ liệu bắt đầu từ dòng 2
+        probe_start = self.row_count - len(self.tail_rows) + 2
+        probe_end = self.row_count + 1
+
+        ranges = ['1:1', f'A{self.row_count + 2}:{last_col}']
+        if self.tail_rows:
+            ranges.append(f'A{probe_start}:{last_col}{probe_end}')
+        results = fetch(ranges)
+
+        header = list(results[0][0]) if results[0] else []
+        if _pad_rows([header], width)[0] != self.header or len(header) > width:
+            return False
+        if self.tail_rows and _pad_rows(results[2], width) != self.tail_rows:
+            return False
+
+        new_rows = _pad_rows(results[1], width)
+        self.last_mode = 'incremental'
+        self.last_complete = True
+        if not new_rows:
+            return True
+
+        with stage('clean_phtcv_rows', rows=len(new_rows), mode='incremental'):
+            new_df = clean_phtcv_rows(self.header, new_rows, self.lathe_machines)
+        self.row_count += len(new_rows)
+        self.tail_rows = (self.tail_rows + new_rows)[-self.probe_rows:]
+        if self._append_frame(new_df):
+            return True
+        # Kho đã được tiến trình khác nối thêm sau lần nạp trạng thái của tiến trình này: nạp trạng thái
+        # sync của kho rồi đồng bộ tăng dần lại một lần (không được thì tải lại toàn bộ)
+        return retry and self._read_store_state() and self._sync_incremental(fetch, retry=False)
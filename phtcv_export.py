@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Xuất dữ liệu PHTCV ra Excel/CSV (không phụ thuộc Streamlit)
+Excel ghi bằng openpyxl write-only theo từng khối dòng -> bộ nhớ không tăng theo số dòng
+"""
+
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+# Cột phụ sinh ra lúc ingest, không xuất ra file
+HELPER_COLS = ['date_parsed', 'sl_thuc_te', 'is_lathe']
+
+CHUNK_ROWS = 10000
+
+# Số chữ số có nghĩa float32 giữ đúng
+FLOAT32_DIGITS = 7
+
+
+def float32_to_float64(values):
+    """
+    float32 -> float64 làm tròn tới FLOAT32_DIGITS chữ số có nghĩa (vector hóa, NaN giữ nguyên),
+    để file ghi 2.3 / 123.4 thay vì 2.299999952316284 / 123.40000152587891
+    """
+    x = values.astype('float64')
+    magnitude = np.floor(np.log10(np.abs(x), out=np.zeros_like(x), where=x != 0))
+    scale = 10.0 ** np.clip(FLOAT32_DIGITS - 1 - magnitude, 0, 15)
+    return np.round(x * scale) / scale
+
+
+def export_frame(df):
+    """Bỏ các cột phụ, giữ nguyên các cột gốc của sheet; cột float32 (cột thời gian) -> float64 đúng giá trị nhập"""
+    df = df.drop(columns=[col for col in HELPER_COLS if col in df.columns])
+    for i, dtype in enumerate(df.dtypes):
+        if dtype == 'float32':
+            df.isetitem(i, pd.Series(float32_to_float64(df.iloc[:, i].to_numpy()), index=df.index))
+    return df
+
+
+def iter_rows(df, chunk_rows=CHUNK_ROWS):
+    """Duyệt các dòng dưới dạng list giá trị Python (NaN -> None), theo từng khối"""
+    for start in range(0, len(df), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows].astype(object)
+        yield from chunk.where(chunk.notna(), None).values.tolist()
+
+
+def write_excel(df, sheet_name='Công suất', output=None):
+    """Ghi DataFrame ra .xlsx ở chế độ write-only (streaming). Trả về output (mặc định BytesIO)"""
+    output = output if output is not None else BytesIO()
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+    ws.append([str(col) for col in df.columns])
+    for row in iter_rows(df):
+        ws.append(row)
+    wb.save(output)
+    return output
+
+
+def to_excel_bytes(df, sheet_name='Công suất'):
+    return write_excel(export_frame(df), sheet_name).getvalue()
+
+
+def to_csv_bytes(df):
+    """CSV UTF-8 có BOM để Excel mở đúng tiếng Việt"""
+    return export_frame(df).to_csv(index=False).encode('utf-8-sig')
+
+
+EXPORT_FORMATS = {
+    'Excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', to_excel_bytes),
+    'CSV': ('csv', 'text/csv', to_csv_bytes),
+}
@@ -0,0 +1,514 @@
+# -*- coding: utf-8 -*-
+"""
+Nguồn dữ liệu PHTCV (+ các sheet phụ như machine_list), dùng chung một giao diện:
+- SheetsSource: Google Sheets (đồng bộ tăng dần, snapshot khởi động nguội), ghép thêm các sheet lưu trữ
+  các năm đã đóng (SheetArchives) thành một bộ dữ liệu
+- LocalFileSource: file xuất cục bộ .csv / .xlsx / .xlsx có mật khẩu (msoffcrypto), cache theo mtime
+load() trả về dict {'PHTCV': DateIndex, <sheet phụ>: dòng thô, 'api_calls': số lần gọi API}
+(không phụ thuộc Streamlit)
+"""
+
+import csv
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from io import BytesIO
+
+import pandas as pd
+
+from instrumentation import cache_miss, stage
+from phtcv_data import (
+    SNAPSHOT_VERSION, TIME_COLS, DateIndex, _pad_rows, clean_phtcv_chunks, clean_phtcv_rows,
+    concat_frames, iter_row_chunks
+)
+
+EXCEL_EXTENSIONS = ('.xlsx', '.xlsm')
+
+
+def _cell_to_str(value):
+    """Giá trị ô Excel -> chuỗi như khi đọc từ Google Sheets"""
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%d/%m/%Y')
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def read_csv_rows(path):
+    """Các dòng thô (list of list chuỗi) của file CSV, dòng đầu là header"""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        return [row for row in csv.reader(f)]
+
+
+def open_workbook_bytes(path, password=None):
+    """
+    Nội dung file Excel để openpyxl đọc: file thường đọc thẳng,
+    file có mật khẩu giải mã bằng msoffcrypto vào bộ nhớ
+    """
+    with open(path, 'rb') as f:
+        content = BytesIO(f.read())
+
+    import msoffcrypto
+    office = msoffcrypto.OfficeFile(content)
+    if not office.is_encrypted():
+        content.seek(0)
+        return content
+    if not password:
+        raise ValueError(f"File {os.path.basename(path)} có mật khẩu, cần cấu hình mật khẩu để đọc")
+    office.load_key(password=password)
+    decrypted = BytesIO()
+    office.decrypt(decrypted)
+    decrypted.seek(0)
+    return decrypted
+
+
+@contextmanager
+def open_workbook_sheets(path, sheet_names, password=None):
+    """
+    Mở file .xlsx một lần: {tên sheet: iterator dòng thô}, đọc dần từng dòng (chỉ dùng trong khối with)
+    Sheet đầu tiên trong sheet_names không có trong file -> đọc sheet đầu tiên của file;
+    các sheet khác không có thì bỏ qua
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(open_workbook_bytes(path, password), read_only=True, data_only=True)
+    try:
+        result = {}
+        for i, name in enumerate(sheet_names):
+            if name in wb.sheetnames:
+                ws = wb[name]
+            elif i == 0:
+                ws = wb.worksheets[0]
+            else:
+                continue
+            result[name] = ([_cell_to_str(v) for v in row] for row in ws.iter_rows(values_only=True))
+        yield result
+    finally:
+        wb.close()
+
+
+def read_workbook_sheets(path, sheet_names, password=None):
+    """Đọc nhiều sheet của một file .xlsx trong một lần mở: {tên sheet: dòng thô}"""
+    with open_workbook_sheets(path, sheet_names, password) as sheets:
+        return {name: list(rows) for name, rows in sheets.items()}
+
+
+def rows_to_date_index(data, lathe_machines=()):
+    """Dòng thô của sheet PHTCV (dòng đầu là header) -> DateIndex đã làm sạch"""
+    if not data or len(data) <= 1:
+        return DateIndex(pd.DataFrame(), version=time.time_ns())
+    width = max(len(r) for r in data)
+    header = _pad_rows(data[:1], width)[0]
+    with stage('clean_phtcv_rows', rows=len(data) - 1, mode='file'):
+        df = clean_phtcv_rows(header, data[1:], lathe_machines)
+    return DateIndex(df, version=time.time_ns())
+
+
+def stream_date_index(rows, chunk_rows, lathe_machines=()):
+    """
+    Như rows_to_date_index nhưng đọc rows (iterator, dòng đầu là header) theo khối chunk_rows dòng:
+    mỗi khối chuỗi thô được làm sạch thành cột có kiểu rồi bỏ, cuối cùng nối các khối một lần
+    Số cột theo header
+    """
+    rows = iter(rows)
+    header = next(rows, None)
+    if not header:
+        return DateIndex(pd.DataFrame(), version=time.time_ns())
+    header = list(header)
+    chunks = (
+        _pad_rows(chunk, len(header))
+        for chunk in iter_row_chunks(rows, chunk_rows)
+    )
+    df = concat_frames(clean_phtcv_chunks(header, chunks, lathe_machines))
+    return DateIndex(df, version=time.time_ns())
+
+
+def _file_signature(paths):
+    """(đường dẫn, mtime, kích thước) của các file, dùng làm khóa cache"""
+    signature = []
+    for path in paths:
+        st = os.stat(path)
+        signature.append((path, st.st_mtime_ns, st.st_size))
+    return tuple(signature)
+
+
+class LocalFileSource:
+    """
+    PHTCV từ file cục bộ (vd. bản xuất trên ổ chung): .csv, .xlsx hoặc .xlsx có mật khẩu
+    - .xlsx: đọc sheet PHTCV (hoặc sheet đầu tiên) + các sheet phụ trong cùng một lần mở file
+    - .csv: các sheet phụ đọc từ file CSV riêng (extra_paths)
+    Kết quả được giữ lại cho tới khi mtime/kích thước file thay đổi
+    chunk_rows > 0: đọc và làm sạch PHTCV theo từng khối dòng (không giữ toàn bộ file dạng chuỗi thô)
+    """
+
+    name = 'File cục bộ'
+
+    def __init__(self, path, password=None, extra_sheets=('machine_list',), extra_paths=None,
+                 lathe_machines=(), chunk_rows=0):
+        self.path = path
+        self.password = password
+        self.extra_sheets = list(extra_sheets)
+        self.extra_paths = dict(extra_paths or {})  # Chỉ dùng với .csv: {tên sheet: file .csv}
+        self.lathe_machines = list(lathe_machines)
+        self.chunk_rows = chunk_rows
+        self._lock = threading.Lock()
+        self._signature = None
+        self._data = None
+
+    @property
+    def is_excel(self):
+        return self.path.lower().endswith(EXCEL_EXTENSIONS)
+
+    def _paths(self):
+        if self.is_excel:
+            return [self.path]
+        return [self.path] + [p for s, p in self.extra_paths.items() if s in self.extra_sheets]
+
+    def provides_sheet(self, sheet):
+        """Sheet phụ có được đọc không (.csv chỉ đọc các sheet có file riêng trong extra_paths)"""
+        return sheet in self.extra_sheets and (self.is_excel or sheet in self.extra_paths)
+
+    def request_full_reload(self):
+        """Lần load() sau đọc lại file dù mtime không đổi"""
+        self._signature = None
+
+    def load_snapshot(self):
+        """File cục bộ đọc đủ nhanh, không dùng snapshot"""
+        return None
+
+    def status(self):
+        """Dòng mô tả nguồn dữ liệu cho sidebar"""
+        if not self._signature:
+            return None
+        modified = datetime.datetime.fromtimestamp(self._signature[0][1] / 1e9)
+        return f"📁 {os.path.basename(self.path)} (sửa lúc {modified.strftime('%H:%M %d/%m/%Y')})"
+
+    def load(self):
+        with self._lock:
+            signature = _file_signature(self._paths())
+            if signature == self._signature:
+                return self._data
+
+            cache_miss()
+            if self.chunk_rows:
+                data = self._load_chunked()
+            else:
+                with stage('read_local_file', file=os.path.basename(self.path)) as span:
+                    if self.is_excel:
+                        sheets = read_workbook_sheets(self.path, ['PHTCV'] + self.extra_sheets, self.password)
+                    else:
+                        sheets = {'PHTCV': read_csv_rows(self.path)}
+                        for sheet, path in self.extra_paths.items():
+                            if sheet in self.extra_sheets:
+                                sheets[sheet] = read_csv_rows(path)
+                    span['rows'] = max(len(sheets.get('PHTCV', [])) - 1, 0)
+
+                data = {s: rows for s, rows in sheets.items() if s != 'PHTCV'}
+                data['PHTCV'] = rows_to_date_index(sheets.get('PHTCV'), self.lathe_machines)
+            data['api_calls'] = 0
+            self._signature = signature
+            self._data = data
+            return data
+
+
+    def _load_chunked(self):
+        """Đọc file và làm sạch PHTCV theo khối trong cùng một lượt (sheet phụ nhỏ đọc toàn bộ)"""
+        with stage('read_local_file', file=os.path.basename(self.path), mode='chunk') as span:
+            if self.is_excel:
+                with open_workbook_sheets(self.path, ['PHTCV'] + self.extra_sheets, self.password) as sheets:
+                    data = {s: list(rows) for s, rows in sheets.items() if s != 'PHTCV'}
+                    date_index = stream_date_index(sheets.get('PHTCV', ()), self.chunk_rows, self.lathe_machines)
+            else:
+                with open(self.path, encoding='utf-8-sig', newline='') as f:
+                    date_index = stream_date_index(csv.reader(f), self.chunk_rows, self.lathe_machines)
+                data = {
+                    sheet: read_csv_rows(path)
+                    for sheet, path in self.extra_paths.items() if sheet in self.extra_sheets
+                }
+            span['rows'] = len(date_index)
+        data['PHTCV'] = date_index
+        return data
+
+
+def combine_date_indexes(archive_index, live_index):
+    """
+    Một DateIndex cho dữ liệu lưu trữ + sheet đang ghi. Lưu trữ là các năm trước: hai frame đã sắp chỉ cần
+    nối (dòng có ngày của lưu trữ, của sheet đang ghi, rồi các dòng NaT), không sắp lại cả frame ghép;
+    chỉ khi khoảng ngày đan xen mới sắp lại. Phiên bản đổi khi một trong hai đổi; các lần nối dòng của
+    sheet đang ghi được giữ (DateIndex.deltas) để cube vẫn cập nhật tăng dần
+    """
+    if archive_index is None or not len(archive_index) or not isinstance(live_index, DateIndex):
+        return live_index
+    archive, live = archive_index.df, live_index.df
+    in_order = archive_index.has_dates and (live_index.has_dates or not len(live)) and (
+        not archive_index.days or not live_index.days or max(archive_index.days) <= min(live_index.days)
+    )
+    if in_order:
+        frames = [archive.iloc[:archive_index.n_valid], live.iloc[:live_index.n_valid],
+                  archive.iloc[archive_index.n_valid:], live.iloc[live_index.n_valid:]]
+    else:
+        frames = [archive, live]
+    frames = [f for f in frames if len(f)]
+    df = concat_frames(frames)
+    # Sheet các năm có thể khác cột: cột thời gian thiếu tính là 0 như khi làm sạch
+    for col in TIME_COLS:
+        if col in df.columns and any(col not in f.columns for f in frames):
+            df[col] = df[col].fillna(0).astype('float32')
+
+    def combined_version(live_version):
+        return hash((archive_index.version, live_version))
+
+    index = DateIndex(df, version=combined_version(live_index.version), presorted=in_order)
+    index.deltas = [(combined_version(base), new_df) for base, new_df in live_index.deltas]
+    return index
+
+
+class SheetArchives:
+    """
+    Các sheet PHTCV lưu trữ của những năm đã đóng (mỗi năm một spreadsheet hoặc một sheet):
+    archives = [{'url': ..., 'sheet': 'PHTCV'}, ...]
+    - Mỗi sheet tải toàn bộ một lần, các sheet tải song song trên thread pool (max_workers)
+    - Đã làm sạch thì giữ vĩnh viễn: trong bộ nhớ (một frame ghép đã sắp theo ngày của mọi năm đã có)
+      + Parquet của từng năm trong cache_dir (khởi động lại không gọi API);
+      muốn tải lại một năm thì xóa file của nó trong cache_dir
+    - Sheet lỗi được bỏ qua ở lần này và tải lại ở lần sau (errors)
+    gateway_factory(url) trả về SheetsGateway của spreadsheet đó, None nếu chưa xác thực được
+    """
+
+    def __init__(self, archives, gateway_factory, cache_dir=None, lathe_machines=(), max_workers=4):
+        self.archives = [dict(a) for a in archives]
+        self.gateway_factory = gateway_factory
+        self.cache_dir = cache_dir
+        self.lathe_machines = list(lathe_machines)
+        self._loaded = set()    # khóa lưu trữ của các năm đã ghép vào _index
+        self._index = None      # DateIndex ghép của các năm đã có
+        self.errors = {}        # khóa lưu trữ -> thông báo lỗi của lần tải gần nhất
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='phtcv-archive')
+
+    @staticmethod
+    def _key(archive):
+        return hashlib.sha1(f"{archive['url']}|{archive.get('sheet', 'PHTCV')}".encode('utf-8')).hexdigest()[:16]
+
+    def _paths(self, key):
+        base = os.path.join(self.cache_dir, f'archive_{key}')
+        return base + '.parquet', base + '.json'
+
+    def _read_cache(self, key):
+        """Frame đã lưu của một sheet lưu trữ, None nếu chưa có / khác phiên bản làm sạch"""
+        if not self.cache_dir:
+            return None
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('version') != SNAPSHOT_VERSION or meta.get('lathe_machines') != self.lathe_machines:
+                return None
+            df = pd.read_parquet(data_path)
+            if [str(c) for c in df.columns] != meta['columns']:
+                return None
+            return df
+        except Exception:
+            return None
+
+    def _write_cache(self, key, archive, df):
+        if not self.cache_dir:
+            return
+        data_path, meta_path = self._paths(key)
+        meta = {
+            'version': SNAPSHOT_VERSION, 'lathe_machines': self.lathe_machines,
+            'columns': [str(c) for c in df.columns], 'rows': len(df), **archive,
+        }
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            df.to_parquet(data_path + f'.{os.getpid()}.tmp', index=False)
+            os.replace(data_path + f'.{os.getpid()}.tmp', data_path)
+            with open(meta_path + f'.{os.getpid()}.tmp', 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(meta_path + f'.{os.getpid()}.tmp', meta_path)
+        except Exception:
+            pass  # Cache chỉ để khởi động nhanh, lỗi ghi không chặn app
+
+    def _fetch(self, key, archive):
+        """Worker: tải toàn bộ một sheet lưu trữ, làm sạch và lưu cache"""
+        sheet = archive.get('sheet', 'PHTCV')
+        with stage('fetch_archive', sheet=sheet) as span:
+            gateway = self.gateway_factory(archive['url'])
+            if not gateway:
+                raise RuntimeError("Không kết nối được Google Sheets")
+            data = gateway.fetcher(sheet)([''])[0]
+            df = rows_to_date_index(data, self.lathe_machines).df
+            span['rows'] = len(df)
+        self._write_cache(key, archive, df)
+        return df
+
+    def _missing(self):
+        return [(self._key(a), a) for a in self.archives if self._key(a) not in self._loaded]
+
+    def _merge(self, loaded):
+        """Ghép các năm vừa có ({khóa: frame}) vào frame chung rồi bỏ các frame riêng (gọi khi giữ _lock)"""
+        if not loaded:
+            return
+        frames = ([self._index.df] if self._index is not None else []) + list(loaded.values())
+        self._loaded.update(loaded)
+        keys = tuple(self._key(a) for a in self.archives if self._key(a) in self._loaded)
+        self._index = DateIndex(concat_frames(frames), version=hash(keys))
+
+    def cached(self):
+        """DateIndex ghép từ bộ nhớ + cache trên đĩa, không gọi API (None nếu chưa có năm nào)"""
+        with self._lock:
+            loaded = {}
+            for key, _ in self._missing():
+                df = self._read_cache(key)
+                if df is not None:
+                    loaded[key] = df
+            self._merge(loaded)
+            return self._index
+
+    def submit(self):
+        """Bắt đầu tải song song các sheet chưa có (sau khi thử cache trên đĩa), trả về các future"""
+        self.cached()
+        return [(key, self._pool.submit(self._fetch, key, archive)) for key, archive in self._missing()]
+
+    def collect(self, futures):
+        """Chờ các future của submit(), trả về DateIndex ghép của mọi năm đã có"""
+        loaded = {}
+        for key, future in futures:
+            try:
+                loaded[key] = future.result()
+            except Exception as e:
+                self.errors[key] = str(e)
+                continue
+            self.errors.pop(key, None)
+        with self._lock:
+            self._merge({k: df for k, df in loaded.items() if k not in self._loaded})
+            return self._index
+
+    def load(self):
+        """Tải (song song) các năm chưa có và trả về DateIndex ghép"""
+        return self.collect(self.submit())
+
+
+class SheetsSource:
+    """
+    PHTCV từ Google Sheets: đồng bộ tăng dần qua PhtcvSync, các sheet trong extra_sheets
+    đọc chung trong một lần gọi values_batch_get
+    gateway_factory() trả về SheetsGateway (tạo/mở khi cần), None nếu chưa xác thực được
+    shared (SharedFetch): nhiều tiến trình dùng chung snapshot/kho của sync, mỗi chu kỳ chỉ một
+    tiến trình gọi API, các tiến trình khác đọc lại kết quả
+    archives (SheetArchives): các năm đã đóng, tải song song cùng lúc với sheet đang ghi và giữ vĩnh viễn;
+    chỉ sheet đang ghi được làm mới theo TTL. 'PHTCV' trả về là DateIndex ghép của tất cả
+    (dữ liệu trong kho SQLite không ghép lưu trữ)
+    """
+
+    name = 'Google Sheets'
+
+    def __init__(self, gateway_factory, sync, extra_sheets=(), shared=None, archives=None):
+        self.gateway_factory = gateway_factory
+        self.sync = sync
+        self.extra_sheets = list(extra_sheets)
+        self.shared = shared
+        self.archives = archives
+        self._force = False
+        self._modified = None   # modifiedTime của spreadsheet ở lần đồng bộ gần nhất
+        self._combined_index = None  # (khóa, DateIndex) ghép lưu trữ + sheet đang ghi gần nhất
+
+    def request_full_reload(self):
+        self.sync.request_full_reload()
+        self._force = True
+
+    def provides_sheet(self, sheet):
+        """Sheet phụ có được đọc cùng PHTCV không"""
+        return sheet in self.extra_sheets
+
+    def _with_archives(self, live_index, archive_index=None):
+        """Ghép lưu trữ (mặc định: các năm đã có, không gọi API) với sheet đang ghi, nhớ kết quả gần nhất"""
+        if self.archives is None:
+            return live_index
+        if archive_index is None:
+            archive_index = self.archives.cached()
+        combined = self._combined_index
+        key = (None if archive_index is None else archive_index.version, getattr(live_index, 'version', None))
+        if combined is None or combined[0] != key:
+            with stage('combine_archives', rows=len(live_index) if live_index is not None else 0):
+                combined = self._combined_index = (key, combine_date_indexes(archive_index, live_index))
+        return combined[1]
+
+    def _current_data(self, api_calls=0):
+        data = dict(self.sync.extras)
+        data['PHTCV'] = self._with_archives(self.sync.index)
+        data['api_calls'] = api_calls
+        return data
+
+    def _snapshot_data(self, force=False):
+        if not self.sync.load_snapshot(force=force):
+            return None
+        return self._current_data()
+
+    def load_snapshot(self):
+        """(data, saved_at) từ snapshot trên đĩa để phục vụ ngay khi khởi động nguội, None nếu không có"""
+        data = self._snapshot_data()
+        return (data, self.sync.saved_at) if data else None
+
+    def status(self):
+        gateway = self.gateway_factory()
+        if gateway and gateway.last_refresh_calls is not None:
+            return f"🔌 Lần làm mới gần nhất: {gateway.last_refresh_calls} lần gọi Google Sheets API"
+        return None
+
+    def load(self):
+        """Raise nếu lỗi (có thể chạy ở luồng nền)"""
+        cache_miss()
+        force, self._force = self._force, False
+        if self.shared is not None:
+            return self.shared.run(lambda: self._fetch_shared(force), lambda: self._snapshot_data(force=True),
+                                   force=force)
+        return self._fetch(force)
+
+    def _fetch_shared(self, force=False):
+        """Tải mới khi giữ khóa SharedFetch: nạp lại trạng thái chung trước (tiến trình khác có thể vừa
+        đồng bộ) để đồng bộ tăng dần tiếp từ đó, không đọc lại/nối lại các dòng đã có"""
+        self.sync.load_snapshot(force=True)
+        return self._fetch(force)
+
+    def _fetch(self, force=False):
+        """
+        Hỏi modifiedTime trước (một lần gọi nhẹ): spreadsheet không đổi kể từ lần đồng bộ trước
+        thì giữ nguyên dữ liệu, không tải header/dòng mới và không tải lại toàn bộ định kỳ
+        """
+        gateway = self.gateway_factory()
+        if not gateway:
+            raise RuntimeError("Không kết nối được Google Sheets")
+
+        with stage('fetch_sheets_data') as span:
+            gateway.begin_refresh()
+            # Các năm lưu trữ chưa có tải song song trong lúc đồng bộ sheet đang ghi
+            # (gateway lưu trữ dùng chung counter nên số lần gọi API của lần làm mới gồm cả các lần này)
+            archive_futures = self.archives.submit() if self.archives is not None else []
+            modified = gateway.modified_time()
+            if not force and modified is not None and modified == self._modified and self.sync.index is not None:
+                live_index = self.sync.index
+                mode = 'unchanged'
+            else:
+                extras = {}
+                fetch = gateway.fetcher('PHTCV', extra_sheets=self.extra_sheets, extra_results=extras)
+                self.sync.extras = extras  # Lưu kèm snapshot cho lần khởi động nguội sau
+                live_index = self.sync.sync(fetch)
+                # Chỉ bỏ qua các lần sau khi chắc đã đọc hết sheet; sau lần tải theo khối, lần kế tiếp vẫn
+                # đồng bộ tăng dần (đọc tới cuối sheet) rồi mới ghi nhớ modifiedTime
+                self._modified = modified if self.sync.last_complete else None
+                mode = self.sync.last_mode
+
+            archive_index = self.archives.collect(archive_futures) if self.archives is not None else None
+            data = dict(self.sync.extras)
+            data['PHTCV'] = self._with_archives(live_index, archive_index)
+            data['api_calls'] = gateway.end_refresh()
+            span.update(mode=mode, rows=len(data['PHTCV']), api_calls=data['api_calls'])
+        return data
@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""
+Kho SQLite cho lịch sử PHTCV nhiều năm: PhtcvSync ghi/nối dòng đã làm sạch vào bảng phtcv
+(chỉ mục theo ngày, bộ phận, số máy); các phép lọc và cộng dồn chạy bằng SQL trên đúng
+khoảng ngày đã chọn nên bộ nhớ của app không tăng theo số năm dữ liệu
+(không phụ thuộc Streamlit)
+"""
+
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+from capacity_core import COMPONENTS, SHIFT_TIMES
+from phtcv_data import TIME_COLS
+
+TABLE = 'phtcv'
+DATE_COL = 'date_parsed'
+
+# Cột được đánh chỉ mục
+INDEX_COLS = [DATE_COL, 'bộ phận', 'số máy']
+
+# Tăng khi đổi schema -> kho cũ bị bỏ qua và nạp lại toàn bộ
+STORE_VERSION = 1
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _sql_type(col):
+    if col in TIME_COLS or col == 'sl_thuc_te':
+        return 'REAL'
+    if col == 'is_lathe':
+        return 'INTEGER'
+    return 'TEXT'
+
+
+def _next_month(month):
+    """'2025-12' -> '2026-01'"""
+    year, mon = int(month[:4]), int(month[5:7])
+    return f'{year + mon // 12:04d}-{mon % 12 + 1:02d}'
+
+
+def range_filter(month=None, day=None):
+    """Điều kiện WHERE (sql, tham số) cho tháng 'YYYY-MM' và/hoặc ngày (datetime.date); None = tất cả"""
+    clauses, params = [], []
+    if month is not None:
+        clauses.append(f'{_quote(DATE_COL)} >= ? AND {_quote(DATE_COL)} < ?')
+        params += [f'{month}-01', f'{_next_month(month)}-01']
+    if day is not None:
+        clauses.append(f'{_quote(DATE_COL)} = ?')
+        params.append(day.isoformat())
+    return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+
+class PhtcvStore:
+    """
+    Bảng phtcv (một dòng cho mỗi dòng sheet, row_id theo thứ tự sheet) + bảng meta (trạng thái sync)
+    Mỗi thao tác mở một kết nối riêng -> dùng được từ nhiều luồng; ghi được tuần tự hóa bằng lock
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._write_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with closing(self.connect()) as conn, conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def load_meta(self):
+        """Trạng thái đã lưu (dict), None nếu chưa có hoặc khác STORE_VERSION"""
+        with closing(self.connect()) as conn:
+            rows = dict(conn.execute('SELECT key, value FROM meta').fetchall())
+        meta = {k: json.loads(v) for k, v in rows.items()}
+        if meta.get('store_version') != STORE_VERSION or 'columns' not in meta:
+            return None
+        return meta
+
+    def _save_meta(self, conn, meta):
+        conn.executemany(
+            'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+            [(k, json.dumps(v, ensure_ascii=False)) for k, v in meta.items()]
+        )
+
+    def save_meta(self, meta):
+        with self._write_lock, closing(self.connect()) as conn, conn:
+            self._save_meta(conn, meta)
+
+    @staticmethod
+    def _store_columns(df):
+        """Các cột lưu được: bỏ cột không tên và cột trùng tên (giữ cột đầu)"""
+        columns = []
+        for col in df.columns:
+            if str(col) and col not in columns:
+                columns.append(col)
+        return columns
+
+    @staticmethod
+    def _records(df, columns, start_id):
+        """Các bộ giá trị Python để executemany (ngày -> 'YYYY-MM-DD', NaN -> None)"""
+        values = [np.arange(start_id, start_id + len(df)).tolist()]
+        for col in columns:
+            series = df.loc[:, col]
+            if isinstance(series, pd.DataFrame):
+                series = series.iloc[:, 0]
+            if col == DATE_COL:
+                values.append(series.dt.strftime('%Y-%m-%d').astype(object).where(series.notna(), None).tolist())
+            elif col == 'is_lathe':
+                values.append(series.astype(int).tolist())
+            else:
+                obj = series.astype(object)
+                values.append(obj.where(series.notna(), None).tolist())
+        return zip(*values)
+
+    def _insert(self, conn, df, columns, start_id):
+        names = ', '.join(['row_id'] + [_quote(c) for c in columns])
+        marks = ', '.join(['?'] * (len(columns) + 1))
+        conn.executemany(f'INSERT INTO {TABLE} ({names}) VALUES ({marks})', self._records(df, columns, start_id))
+
+    def replace(self, df, meta=None):
+        """Thay toàn bộ dữ liệu (tải lại toàn bộ sheet) trong một transaction"""
+        self.replace_chunks([df], meta)
+
+    def replace_chunks(self, frames, meta=None):
+        """
+        Như replace với dữ liệu theo khối (iterable các frame đã làm sạch, đọc lần lượt):
+        mỗi khối ghi xong là bỏ, vẫn trong một transaction nên phiên khác chỉ thấy dữ liệu cũ hoặc mới
+        Các cột theo khối đầu tiên; không có khối nào -> kho trống
+        """
+        columns = None
+        row_count = 0
+        with self._write_lock, closing(self.connect()) as conn, conn:
+            conn.execute(f'DROP TABLE IF EXISTS {TABLE}')
+            conn.execute('DELETE FROM meta')  # Trạng thái sync cũ không còn đúng với dữ liệu mới
+            for df in frames:
+                if columns is None:
+                    columns = self._store_columns(df)
+                    definitions = ', '.join(
+                        ['row_id INTEGER PRIMARY KEY'] + [f'{_quote(c)} {_sql_type(c)}' for c in columns]
+                    )
+                    conn.execute(f'CREATE TABLE {TABLE} ({definitions})')
+                self._insert(conn, df, [c for c in columns if c in df.columns], row_count)
+                row_count += len(df)
+            if columns is None:
+                columns = []
+                conn.execute(f'CREATE TABLE {TABLE} (row_id INTEGER PRIMARY KEY)')
+            # Tạo chỉ mục sau khi ghi xong: nhanh hơn cập nhật chỉ mục từng dòng
+            for col in INDEX_COLS:
+                if col in columns:
+                    conn.execute(f'CREATE INDEX {_quote("idx_" + col)} ON {TABLE} ({_quote(col)})')
+            self._save_meta(conn, {
+                'store_version': STORE_VERSION, 'columns': columns,
+                'row_count': row_count, 'version': time.time_ns(), **(meta or {})
+            })
+
+    def append(self, df, meta=None, expected_rows=None):
+        """
+        Nối thêm các dòng mới (đồng bộ tăng dần)
+        expected_rows: số dòng người gọi đang thấy trong kho; kho đã khác (tiến trình khác vừa nối / tải lại)
+        thì không nối và trả về False - người gọi đồng bộ lại từ trạng thái của kho
+        """
+        with self._write_lock, closing(self.connect()) as conn, conn:
+            conn.execute('BEGIN IMMEDIATE')  # Giữ khóa ghi từ lúc đọc row_count tới lúc commit
+            stored = {
+                k: json.loads(v)
+                for k, v in conn.execute("SELECT key, value FROM meta WHERE key IN ('columns', 'row_count')")
+            }
+            if expected_rows is not None and stored.get('row_count') != expected_rows:
+                return False
+            columns = [c for c in stored['columns'] if c in df.columns]
+            self._insert(conn, df, columns, stored['row_count'])
+            self._save_meta(conn, {
+                'row_count': stored['row_count'] + len(df), 'version': time.time_ns(), **(meta or {})
+            })
+        return True
+
+    def date_index(self):
+        """StoreIndex của dữ liệu hiện tại, None nếu kho trống"""
+        meta = self.load_meta()
+        return StoreIndex(self, meta) if meta else None
+
+
+class StoreIndex:
+    """
+    Tương đương DateIndex nhưng dữ liệu nằm trong kho SQLite:
+    danh sách tháng/ngày lấy từ một truy vấn GROUP BY ngày, select() chỉ đọc khoảng đã chọn
+    """
+
+    has_dates = True
+
+    def __init__(self, store, meta):
+        self.store = store
+        self.version = meta['version']
+        self.columns = meta['columns']
+        self.row_count = meta['row_count']
+        self.days = {}          # datetime.date -> số dòng
+        self.months = {}        # 'YYYY-MM' -> số dòng
+        self.month_days = {}    # 'YYYY-MM' -> [datetime.date, ...] giảm dần
+
+        if DATE_COL not in self.columns:
+            self.has_dates = False
+            return
+        with closing(store.connect()) as conn:
+            rows = conn.execute(
+                f'SELECT {_quote(DATE_COL)}, COUNT(*) FROM {TABLE} '
+                f'WHERE {_quote(DATE_COL)} IS NOT NULL GROUP BY 1 ORDER BY 1 DESC'
+            ).fetchall()
+        for text, count in rows:
+            day = datetime.date.fromisoformat(text)
+            month = text[:7]
+            self.days[day] = count
+            self.months[month] = self.months.get(month, 0) + count
+            self.month_days.setdefault(month, []).append(day)
+
+    def __len__(self):
+        return self.row_count
+
+    def month_options(self):
+        return sorted(self.months, reverse=True)
+
+    def day_options(self, month=None):
+        if month is not None:
+            return self.month_days.get(month, [])
+        return sorted(self.days, reverse=True)
+
+    def _in_range(self, month, day):
+        return day is None or month is None or day.strftime('%Y-%m') == month
+
+    def count(self, month=None, day=None):
+        """Số dòng trong khoảng đã chọn"""
+        if not self._in_range(month, day):
+            return 0
+        if day is not None:
+            return self.days.get(day, 0)
+        if month is not None:
+            return self.months.get(month, 0)
+        return self.row_count
+
+    def select(self, month=None, day=None):
+        """DataFrame các dòng trong khoảng đã chọn (sắp theo ngày, ngày trống cuối), giống DateIndex.select"""
+        where, params = range_filter(month, day)
+        if not self._in_range(month, day):
+            where, params = ' WHERE 0', []
+        names = ', '.join(_quote(c) for c in self.columns)
+        with closing(self.store.connect()) as conn:
+            df = pd.read_sql_query(
+                f'SELECT {names} FROM {TABLE}{where} '
+                f'ORDER BY {_quote(DATE_COL)} IS NULL, {_quote(DATE_COL)}, row_id',
+                conn, params=params
+            )
+        for col in TIME_COLS:
+            if col in df.columns:
+                df[col] = df[col].astype('float32')
+        if 'is_lathe' in df.columns:
+            df['is_lathe'] = df['is_lathe'].astype(bool)
+        if DATE_COL in df.columns:
+            df[DATE_COL] = pd.to_datetime(df[DATE_COL])
+        return df
+
+    def cube(self):
+        """Cube theo ngày tính bằng SQL trên khoảng đã chọn"""
+        return StoreCube(self)
+
+
+class StoreCube:
+    """
+    Thay cho DateIndex của cube theo ngày (build_daily_cube) khi dữ liệu nằm trong kho:
+    select(month, day) chạy một truy vấn GROUP BY (bộ phận, is_lathe, số máy, ngày)
+    chỉ trên khoảng ngày đã chọn, trả về đúng các cột của build_daily_cube
+    """
+
+    def __init__(self, store_index):
+        self.store = store_index.store
+        self.version = store_index.version
+        self.columns = store_index.columns
+        self._in_range = store_index._in_range
+
+    def _column(self, name, default='0'):
+        return _quote(name) if name in self.columns else default
+
+    def _component_sums(self):
+        """Biểu thức SQL tổng 7 thành phần (như aggregate_components: nhân sl thực tế, loại SHIFT_TIMES)"""
+        shifts = ', '.join(str(t) for t in SHIFT_TIMES)
+        sl = self._column('sl_thuc_te', '1')
+        dung = self._column('dừng')
+        dung_khac = self._column('dừng khác')
+        return f"""
+                SUM({self._column('tgcb')}) AS time_tgcb,
+                SUM({self._column('chạy thử')}) AS time_chay_thu,
+                SUM({self._column('gá lắp')} * {sl}) AS time_ga_lap,
+                SUM({self._column('gia công')} * {sl}) AS time_gia_cong,
+                SUM(CASE WHEN {dung} IN ({shifts}) THEN 0 ELSE {dung} END) AS time_dung,
+                SUM(CASE WHEN {dung_khac} IN ({shifts}) THEN 0 ELSE {dung_khac} END) AS time_dung_khac,
+                SUM({self._column('sửa')}) AS time_sua"""
+
+    def _query(self):
+        dung = self._column('dừng')
+        dung_khac = self._column('dừng khác')
+        explanation = self._column('giải trình', 'NULL')
+        return f"""
+            SELECT {_quote('bộ phận')}, is_lathe, {_quote('số máy')}, {_quote(DATE_COL)} AS day,{self._component_sums()},
+                SUM({self._column('gá lắp')}) AS raw_ga_lap,
+                SUM({self._column('gia công')}) AS raw_gia_cong,
+                MAX(MAX({dung}), MAX({dung_khac})) AS max_stop,
+                GROUP_CONCAT(CASE WHEN TRIM({explanation}, char(32, 9, 10, 13)) != ''
+                                  THEN {explanation} END, ', ') AS explanation
+            FROM (SELECT * FROM {TABLE}{{where}} ORDER BY row_id)
+            GROUP BY 1, 2, 3, 4
+            ORDER BY day IS NULL, day, MIN(row_id)
+        """
+
+    def month_totals(self, months):
+        """{tháng: Series tổng 7 thành phần} của các tháng yêu cầu trong một truy vấn GROUP BY tháng"""
+        if not months:
+            return {}
+        where = f' WHERE {_quote(DATE_COL)} >= ? AND {_quote(DATE_COL)} < ?'
+        params = [f'{min(months)}-01', f'{_next_month(max(months))}-01']
+        with closing(self.store.connect()) as conn:
+            totals = pd.read_sql_query(
+                f'SELECT substr({_quote(DATE_COL)}, 1, 7) AS month,{self._component_sums()} '
+                f'FROM {TABLE}{where} GROUP BY 1',
+                conn, params=params
+            ).set_index('month')
+        return {m: totals.loc[m] if m in totals.index else pd.Series(0.0, index=COMPONENTS) for m in months}
+
+    def select(self, month=None, day=None):
+        where, params = range_filter(month, day)
+        if not self._in_range(month, day):
+            where, params = ' WHERE 0', []
+        with closing(self.store.connect()) as conn:
+            cube = pd.read_sql_query(self._query().format(where=where), conn, params=params)
+        cube['is_lathe'] = cube['is_lathe'].astype(bool)
+        cube['day'] = pd.to_datetime(cube['day'])
+        cube.insert(cube.columns.get_loc('explanation'), 'total_time', cube[COMPONENTS].sum(axis=1))
+        cube['explanation'] = cube['explanation'].fillna('')
+        return cube
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Xuất báo cáo công suất cho tất cả các tháng (không cần Streamlit)
+Mỗi tháng: biểu đồ HTML (tổng SX1/SX2, từng phân xưởng, thời gian + số máy chạy)
+Toàn bộ: một file Excel tổng hợp công suất và thống kê từng máy
+
+Cách dùng:
+    python report_capacity.py                          # đọc từ Google Sheets (CONFIG)
+    python report_capacity.py --source PHTCV.xlsx      # đọc từ file cục bộ (.xlsx / .csv)
+    python report_capacity.py --months 2025-01 2025-02 --jobs 4 --out reports
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from app_config import CONFIG
+from capacity_charts import create_machine_time_count_chart, create_stacked_bar_chart
+from capacity_core import (
+    build_daily_cube, dept_short_name, machine_stats_table, rollup_capacity,
+    rollup_cube, rollup_explanations
+)
+from phtcv_data import DateIndex, PhtcvSync
+from phtcv_sources import LocalFileSource, SheetArchives, combine_date_indexes
+
+MACHINE_TYPES = {'lathe': 'Tiện', 'milling': 'Phay', 'all': 'Tổng'}
+
+# Ngưỡng % của phần phân tích chi tiết (giống các tab trên dashboard)
+STOP_PCT = 10
+GA_LAP_PCT = 10
+TGCB_PCT = 10
+
+
+def load_source(source, credentials=None, password=None):
+    """DateIndex của PHTCV từ 'sheet' (Google Sheets theo CONFIG) hoặc đường dẫn file cục bộ"""
+    if source != 'sheet':
+        local = LocalFileSource(source, password=password, extra_sheets=(),
+                                lathe_machines=CONFIG['lathe_machines'], chunk_rows=CONFIG['phtcv_chunk_rows'])
+        return local.load()['PHTCV']
+
+    from sheets_gateway import SheetsGateway, authorize_service_account_file
+
+    client = authorize_service_account_file(credentials or CONFIG['google_credentials'])
+    gateway = SheetsGateway(client, CONFIG['google_sheet_url'])
+    sync = PhtcvSync(lathe_machines=CONFIG['lathe_machines'], chunk_rows=CONFIG['phtcv_chunk_rows'])
+    if not CONFIG['phtcv_archives']:
+        return sync.sync(gateway.fetcher('PHTCV'))
+
+    # Các năm lưu trữ tải song song trong lúc tải sheet đang ghi
+    archives = SheetArchives(
+        CONFIG['phtcv_archives'],
+        lambda url: gateway if url == gateway.url else SheetsGateway(
+            client, url, rate_limiter=gateway.rate_limiter, counter=gateway.counter),
+        cache_dir=CONFIG['archive_cache_dir'], lathe_machines=CONFIG['lathe_machines'],
+        max_workers=CONFIG['archive_workers']
+    )
+    futures = archives.submit()
+    live_index = sync.sync(gateway.fetcher('PHTCV'))
+    return combine_date_indexes(archives.collect(futures), live_index)
+
+
+def render_month(month, cube, out_dir, departments):
+    """
+    Worker: vẽ biểu đồ HTML của một tháng từ các ô cube của tháng đó
+    Trả về (dòng tổng hợp, bảng thống kê từng máy)
+    """
+    agg = rollup_cube(cube)
+    explanations = rollup_explanations(cube)
+    month_dir = os.path.join(out_dir, month)
+    os.makedirs(month_dir, exist_ok=True)
+
+    summary = []
+    machine_tables = []
+    dept_capacities = {}
+    time_data = {}
+    count_data = {}
+
+    for dept in departments:
+        caps = {}
+        for machine_type, label in MACHINE_TYPES.items():
+            cap = rollup_capacity(agg, dept, machine_type)
+            if not cap:
+                continue
+            caps[machine_type] = cap
+            row = cap.as_dict()
+            summary.append({'Tháng': month, 'Phân xưởng': dept, 'Loại máy': label,
+                            'Số máy chạy': row.pop('running_machines'), **row})
+            if machine_type != 'all':
+                time_data[f'{label} {dept_short_name(dept)}'] = cap.time_gia_cong
+                count_data[f'{label} {dept_short_name(dept)}'] = cap.running_machines
+
+        if 'all' in caps:
+            dept_capacities[dept] = caps['all']
+        if len(caps) == 3:
+            data_dict = {
+                'TỔNG CS MÁY TIỆN': caps['lathe'],
+                'TỔNG CS MÁY PHAY': caps['milling'],
+                'TỔNG CỘNG': caps['all']
+            }
+            fig = create_stacked_bar_chart(data_dict, f"BIỂU ĐỒ TỔNG CÔNG SUẤT MÁY - {dept} - {month}")
+            fig.write_html(os.path.join(month_dir, f'cong_suat_{dept_short_name(dept)}.html'),
+                           include_plotlyjs='cdn')
+
+        stats = machine_stats_table(agg, dept, explanations)
+        if not stats.empty:
+            stats = stats.sort_values('machine_num').drop(columns='machine_num')
+            stats.insert(0, 'Phân xưởng', dept)
+            stats.insert(0, 'Tháng', month)
+            stats['dừng > 10%'] = stats['pct_total_stop'] > STOP_PCT
+            stats['gá lắp > 10%'] = stats['pct_ga_lap'] > GA_LAP_PCT
+            stats['chuẩn bị > 10%'] = stats['pct_tgcb'] > TGCB_PCT
+            machine_tables.append(stats)
+
+    if len(dept_capacities) >= 2:
+        combined_data = {dept.upper(): cap for dept, cap in dept_capacities.items()}
+        fig = create_stacked_bar_chart(combined_data, f"BIỂU ĐỒ SO SÁNH CÔNG SUẤT TỔNG - {month}")
+        fig.write_html(os.path.join(month_dir, 'so_sanh_tong.html'), include_plotlyjs='cdn')
+
+    if time_data:
+        fig = create_machine_time_count_chart(time_data, count_data)
+        fig.write_html(os.path.join(month_dir, 'thoi_gian_so_may.html'), include_plotlyjs='cdn')
+
+    machines = pd.concat(machine_tables, ignore_index=True) if machine_tables else pd.DataFrame()
+    return summary, machines
+
+
+def write_summary(path, summary, machines):
+    """File Excel tổng hợp: sheet công suất theo tháng và sheet thống kê từng máy"""
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        pd.DataFrame(summary).to_excel(writer, sheet_name='Tổng hợp', index=False)
+        machines.to_excel(writer, sheet_name='Theo máy', index=False)
+
+
+def generate(date_index, out_dir, months=None, jobs=None):
+    """Dựng cube một lần, chia theo tháng cho process pool vẽ song song; trả về đường dẫn file Excel"""
+    months = months or date_index.month_options()
+    cube = DateIndex(build_daily_cube(date_index.df, CONFIG['lathe_machines']), date_col='day')
+    os.makedirs(out_dir, exist_ok=True)
+
+    summary = []
+    machine_tables = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [
+            pool.submit(render_month, month, cube.select(month), out_dir, CONFIG['departments'])
+            for month in months
+        ]
+        for month, future in zip(months, futures):
+            month_summary, machines = future.result()
+            summary.extend(month_summary)
+            if not machines.empty:
+                machine_tables.append(machines)
+            print(f"✓ {month}", flush=True)
+
+    machines = pd.concat(machine_tables, ignore_index=True) if machine_tables else pd.DataFrame()
+    path = os.path.join(out_dir, 'tong_hop.xlsx')
+    write_summary(path, summary, machines)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Xuất báo cáo công suất cho tất cả các tháng')
+    parser.add_argument('--source', default='sheet',
+                        help="'sheet' (Google Sheets theo CONFIG) hoặc đường dẫn file .xlsx/.csv")
+    parser.add_argument('--password', default=CONFIG['data_source_password'] or None,
+                        help='Mật khẩu file .xlsx (mặc định: PHTCV_PASSWORD)')
+    parser.add_argument('--out', default='reports', help='Thư mục xuất báo cáo')
+    parser.add_argument('--months', nargs='*', help='Các tháng YYYY-MM (mặc định: tất cả)')
+    parser.add_argument('--jobs', type=int, default=None, help='Số tiến trình (mặc định: số CPU)')
+    parser.add_argument('--credentials', help='File JSON service account (mặc định: CONFIG)')
+    args = parser.parse_args(argv)
+
+    date_index = load_source(args.source, args.credentials, args.password)
+    if not len(date_index):
+        print("Không có dữ liệu PHTCV", file=sys.stderr)
+        return 1
+
+    unknown = [m for m in args.months or [] if m not in date_index.months]
+    if unknown:
+        print(f"Không có dữ liệu cho tháng: {', '.join(unknown)}", file=sys.stderr)
+        return 1
+
+    path = generate(date_index, args.out, args.months, args.jobs)
+    print(f"Đã xuất: {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
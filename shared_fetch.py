@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Điều phối làm mới dữ liệu giữa nhiều tiến trình (nhiều replica dashboard trên cùng ổ đĩa/volume):
+khóa file + thư mục cache dùng chung -> mỗi chu kỳ chỉ một tiến trình gọi Google Sheets,
+các tiến trình khác đọc lại kết quả nó đã ghi (snapshot / kho SQLite)
+(không phụ thuộc Streamlit)
+"""
+
+import json
+import os
+import time
+
+from instrumentation import stage
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """
+    Khóa độc quyền giữa các tiến trình trên một file (fcntl.flock / msvcrt.locking)
+    Khóa tự nhả khi tiến trình chết nên không để lại khóa treo
+    """
+
+    def __init__(self, path, timeout=None, poll=0.1):
+        self.path = path
+        self.timeout = timeout  # None = chờ mãi
+        self.poll = poll
+        self._file = None
+
+    def _try_lock(self):
+        try:
+            if fcntl:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def acquire(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._file = open(self.path, 'a+')
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while not self._try_lock():
+            if deadline is not None and time.monotonic() > deadline:
+                self._file.close()
+                self._file = None
+                raise TimeoutError(f"Không giành được khóa {self.path} sau {self.timeout} giây")
+            time.sleep(self.poll)
+
+    def release(self):
+        if self._file is None:
+            return
+        try:
+            if fcntl:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class SharedFetch:
+    """
+    Single-flight giữa các tiến trình dùng chung cache_dir
+    - Lần làm mới gần nhất (của bất kỳ tiến trình nào) còn trong ttl: đọc lại kết quả chung (read_shared),
+      không gọi API
+    - Hết hạn: tiến trình giành được khóa tải mới (fetch, ghi kết quả chung) rồi ghi mốc thời gian;
+      các tiến trình khác chờ khóa, thấy mốc mới và đọc kết quả đó
+    """
+
+    def __init__(self, cache_dir, ttl, lock_timeout=300):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.lock_path = os.path.join(cache_dir, 'refresh.lock')
+        self.stamp_path = os.path.join(cache_dir, 'refresh.json')
+
+    def last_refresh(self):
+        """{'refreshed_at': epoch, 'pid': ...} của lần làm mới gần nhất, None nếu chưa có"""
+        try:
+            with open(self.stamp_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_stamp(self):
+        tmp_path = self.stamp_path + f'.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'refreshed_at': time.time(), 'pid': os.getpid()}, f)
+        os.replace(tmp_path, self.stamp_path)
+
+    def run(self, fetch, read_shared, force=False):
+        """
+        fetch(): tải mới và ghi kết quả vào cache_dir, trả về dữ liệu (raise nếu lỗi)
+        read_shared(): dữ liệu từ kết quả chung trên đĩa, None nếu không đọc được
+        force=True: luôn tải mới (nút làm mới thủ công)
+        """
+        with stage('shared_fetch') as span:
+            with FileLock(self.lock_path, timeout=self.lock_timeout):
+                stamp = self.last_refresh()
+                if not force and stamp and time.time() - stamp['refreshed_at'] < self.ttl:
+                    data = read_shared()
+                    if data is not None:
+                        span['role'] = 'follower'
+                        return data
+                span['role'] = 'leader'
+                data = fetch()
+                self._write_stamp()
+                return data
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+Tầng truy cập Google Sheets: mở spreadsheet một lần, đọc nhiều sheet/vùng
+trong một lần gọi values_batch_get và đếm số lần gọi API (không phụ thuộc Streamlit)
+Mọi lần gọi API đi qua rate limiter; lỗi quota (429) / lỗi tạm thời (5xx, mất kết nối)
+được thử lại với backoff lũy thừa
+"""
+
+import random
+import re
+import threading
+import time
+from collections import deque
+
+from instrumentation import stage
+
+# drive.metadata.readonly: đọc modifiedTime của file để biết sheet có thay đổi không
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets',
+          'https://www.googleapis.com/auth/drive.metadata.readonly']
+
+# Mã lỗi HTTP đáng thử lại: quota + lỗi tạm thời phía server
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def _status(error):
+    """Mã HTTP của lỗi gspread (APIError.code) / requests, None nếu không có"""
+    code = getattr(error, 'code', None)
+    if code is None:
+        code = getattr(getattr(error, 'response', None), 'status_code', None)
+    return code
+
+
+def is_retryable(error):
+    """Lỗi quota / tạm thời: mã trong RETRY_STATUS hoặc lỗi kết nối/timeout"""
+    return _status(error) in RETRY_STATUS or isinstance(error, OSError)
+
+
+def is_grid_limit_error(error):
+    """400 'exceeds grid limits': vùng đọc bắt đầu sau dòng cuối của lưới (dữ liệu vừa khít sheet)"""
+    return _status(error) == 400 and 'exceeds grid limits' in str(error)
+
+
+def _start_row(a1_range):
+    """Dòng bắt đầu của vùng A1 ('A5:L' -> 5, '2:1001' -> 2), None nếu là toàn bộ sheet"""
+    match = re.match(r'[A-Za-z]*(\d+)', a1_range)
+    return int(match.group(1)) if match else None
+
+
+class RateLimiter:
+    """Tối đa max_calls lần gọi trong mỗi period giây (cửa sổ trượt), vượt thì chờ"""
+
+    def __init__(self, max_calls, period=60.0):
+        self.max_calls = max_calls
+        self.period = period
+        self._calls = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Chờ (nếu cần) tới khi được gọi, trả về số giây đã chờ"""
+        waited = 0.0
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._calls and now - self._calls[0] >= self.period:
+                    self._calls.popleft()
+                if len(self._calls) < self.max_calls:
+                    self._calls.append(now)
+                    return waited
+                delay = self._calls[0] + self.period - now
+                time.sleep(delay)
+                waited += delay
+
+
+class CallCounter:
+    """
+    Số lần gọi API: tổng và của lần làm mới đang chạy / gần nhất
+    Dùng chung giữa các gateway (sheet đang ghi + các sheet lưu trữ) để một lần làm mới đếm đủ mọi lần gọi
+    """
+
+    def __init__(self):
+        self.total = 0              # Tổng số lần gọi API kể từ khi khởi tạo
+        self.refresh = 0            # Số lần gọi API của lần làm mới đang chạy
+        self.last_refresh = None    # Số lần gọi API của lần làm mới gần nhất đã xong
+        self._lock = threading.Lock()
+
+    def add(self):
+        with self._lock:
+            self.total += 1
+            self.refresh += 1
+
+    def begin_refresh(self):
+        with self._lock:
+            self.refresh = 0
+
+    def end_refresh(self):
+        with self._lock:
+            self.last_refresh = self.refresh
+            return self.last_refresh
+
+
+def qualify_range(sheet, a1_range=''):
+    """'PHTCV', '1:1' -> "'PHTCV'!1:1" ; vùng rỗng = toàn bộ sheet"""
+    quoted = "'" + sheet.replace("'", "''") + "'"
+    return f"{quoted}!{a1_range}" if a1_range else quoted
+
+
+def authorize_service_account_file(path):
+    """gspread client từ file JSON service account (dùng cho các công cụ chạy ngoài Streamlit)"""
+    import gspread
+    from google.oauth2.service_account import Credentials
+
+    creds = Credentials.from_service_account_file(path, scopes=SCOPES)
+    return gspread.authorize(creds)
+
+
+class SheetsGateway:
+    """
+    Giữ handle spreadsheet và gom các lần đọc thành một lần gọi values_batch_get
+    rate_limiter: dùng chung giữa các gateway của cùng tài khoản (quota tính theo người dùng),
+    None = giới hạn riêng max_calls_per_minute
+    counter (CallCounter): dùng chung để đếm số lần gọi API của cả lần làm mới, None = đếm riêng
+    """
+
+    def __init__(self, client, url, max_calls_per_minute=50, max_retries=5, backoff_base=1.0, backoff_max=32.0,
+                 rate_limiter=None, counter=None):
+        self.client = client
+        self.url = url
+        self._spreadsheet = None
+        self._lock = threading.Lock()
+        self.rate_limiter = rate_limiter or RateLimiter(max_calls_per_minute)
+        self.counter = counter or CallCounter()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base    # Chờ backoff_base * 2^lần thử (có jitter), tối đa backoff_max giây
+        self.backoff_max = backoff_max
+        self.supports_modified_time = True  # False khi Drive API không dùng được (chưa bật / thiếu quyền)
+        self.retries = 0                # Tổng số lần thử lại do lỗi quota / tạm thời
+
+    @property
+    def spreadsheet(self):
+        """Handle spreadsheet, chỉ open_by_url một lần"""
+        with self._lock:
+            if self._spreadsheet is None:
+                self._spreadsheet = self._call('sheets.open_by_url', lambda: self.client.open_by_url(self.url))
+            return self._spreadsheet
+
+    @property
+    def api_calls(self):
+        """Tổng số lần gọi API (của mọi gateway dùng chung counter)"""
+        return self.counter.total
+
+    @property
+    def last_refresh_calls(self):
+        """Số lần gọi API của lần làm mới gần nhất đã xong, None nếu chưa có"""
+        return self.counter.last_refresh
+
+    def _call(self, name, fn, **fields):
+        """Gọi API qua rate limiter; lỗi quota / tạm thời được thử lại với backoff lũy thừa + jitter"""
+        for attempt in range(self.max_retries + 1):
+            waited = self.rate_limiter.acquire()
+            self.counter.add()
+            try:
+                with stage(name, attempt=attempt, throttled_ms=round(waited * 1000), **fields):
+                    return fn()
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                self.retries += 1
+                time.sleep(min(self.backoff_base * 2 ** attempt, self.backoff_max) * random.uniform(0.5, 1.0))
+
+    def modified_time(self):
+        """
+        modifiedTime (Drive) của spreadsheet - một lần gọi nhẹ để biết sheet có thay đổi không
+        None nếu không dùng được Drive API (chưa bật / thiếu quyền) -> các lần sau không thử nữa
+        """
+        if not self.supports_modified_time:
+            return None
+        spreadsheet = self.spreadsheet
+        try:
+            return self._call('drive.modified_time', spreadsheet.get_lastUpdateTime)
+        except Exception as e:
+            if is_retryable(e):
+                raise
+            self.supports_modified_time = False
+            return None
+
+    def begin_refresh(self):
+        """Bắt đầu đếm số lần gọi API cho một lần làm mới (gồm các gateway dùng chung counter)"""
+        self.counter.begin_refresh()
+
+    def end_refresh(self):
+        """Kết thúc một lần làm mới, trả về số lần gọi API của nó"""
+        return self.counter.end_refresh()
+
+    def grid_rows(self):
+        """{tên sheet: số dòng của lưới} từ metadata spreadsheet (một lần gọi API)"""
+        spreadsheet = self.spreadsheet
+        metadata = self._call('sheets.fetch_sheet_metadata', spreadsheet.fetch_sheet_metadata)
+        return {
+            s['properties']['title']: s['properties']['gridProperties']['rowCount']
+            for s in metadata.get('sheets', [])
+        }
+
+    def _values_batch_get(self, ranges):
+        spreadsheet = self.spreadsheet
+        qualified = [qualify_range(s, r) for s, r in ranges]
+        try:
+            response = self._call('sheets.values_batch_get', lambda: spreadsheet.values_batch_get(qualified),
+                                  ranges=len(ranges))
+        except Exception as e:
+            if not is_grid_limit_error(e):
+                # Handle có thể đã hỏng (sheet bị đổi quyền/xóa...), lần sau mở lại
+                self._spreadsheet = None
+            raise
+        value_ranges = response.get('valueRanges', [])
+        return [vr.get('values', []) for vr in value_ranges]
+
+    def batch_get(self, ranges):
+        """
+        Đọc nhiều vùng (sheet, a1_range) trong một lần gọi API
+        Trả về list các dãy dòng thô (list of list) theo đúng thứ tự ranges
+        Vùng bắt đầu sau dòng cuối của lưới (vd. đọc dòng mới khi dữ liệu vừa khít sheet) trả về [] -
+        chưa có dòng nào ở đó - thay vì làm lỗi cả lần đọc
+        """
+        if not ranges:
+            return []
+        try:
+            return self._values_batch_get(ranges)
+        except Exception as e:
+            if not is_grid_limit_error(e):
+                raise
+
+        # Hiếm: hỏi số dòng lưới rồi chỉ đọc lại các vùng nằm trong lưới
+        grid = self.grid_rows()
+        inside = [
+            i for i, (sheet, a1_range) in enumerate(ranges)
+            if (_start_row(a1_range) or 1) <= grid.get(sheet, float('inf'))
+        ]
+        results = [[] for _ in ranges]
+        if inside:
+            for i, rows in zip(inside, self._values_batch_get([ranges[i] for i in inside])):
+                results[i] = rows
+        return results
+
+    def fetcher(self, sheet, extra_sheets=(), extra_results=None):
+        """
+        Hàm fetch(ranges) cho PhtcvSync đọc vùng của một sheet.
+        Các sheet trong extra_sheets được đọc toàn bộ, ghép vào lần gọi đầu tiên;
+        kết quả ghi vào extra_results[tên sheet]
+        """
+        pending = [(s, '') for s in extra_sheets]
+
+        def fetch(ranges):
+            extra = pending[:]
+            pending.clear()
+            results = self.batch_get([(sheet, r) for r in ranges] + extra)
+            if extra and extra_results is not None:
+                for (extra_sheet, _), rows in zip(extra, results[len(ranges):]):
+                    extra_results[extra_sheet] = rows
+            return results[:len(ranges)]
+
+        return fetch
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Google Sheets giả lập cho test (không gọi mạng), hành xử như API thật ở các điểm tầng dữ liệu dựa vào:
+- values_batch_get cắt ô trống cuối dòng và các dòng trống cuối mỗi vùng
+- vùng bắt đầu sau dòng cuối của lưới -> lỗi 400 "exceeds grid limits"
+- errors: các lỗi ném ra lần lượt ở các lần gọi tới (mô phỏng 429 / 5xx)
+"""
+
+import random
+import re
+
+
+class FakeAPIError(Exception):
+    """Như gspread.exceptions.APIError: mã HTTP ở thuộc tính code"""
+
+    def __init__(self, code, message=''):
+        super().__init__(f'APIError: [{code}]: {message}')
+        self.code = code
+
+
+def _trim(row):
+    row = [str(v) for v in row]
+    while row and row[-1] == '':
+        row.pop()
+    return row
+
+
+class FakeWorksheet:
+    """rows: các dòng (dòng đầu là header); grid_rows: số dòng của lưới (mặc định dư 1000 dòng)"""
+
+    def __init__(self, rows, grid_rows=None):
+        self.rows = [list(r) for r in rows]
+        self.grid_rows = grid_rows
+
+    @property
+    def row_count(self):
+        return self.grid_rows if self.grid_rows is not None else len(self.rows) + 1000
+
+    def values(self, a1):
+        if a1 == '':
+            rows = self.rows
+        else:
+            match = re.fullmatch(r'[A-Z]*(\d+):[A-Z]*(\d*)', a1)
+            start = int(match.group(1))
+            stop = int(match.group(2)) if match.group(2) else self.row_count
+            if start > self.row_count:
+                raise FakeAPIError(400, f"Range ({a1}) exceeds grid limits. Max rows: {self.row_count}")
+            rows = self.rows[start - 1:stop]
+        rows = [_trim(r) for r in rows]
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+
+class FakeSpreadsheet:
+    def __init__(self, sheets, modified='2026-01-01T00:00:00.000Z'):
+        self.sheets = sheets        # {tên sheet: FakeWorksheet}
+        self.modified = modified    # None = Drive API không dùng được (403)
+        self.errors = []
+        self.calls = []
+
+    def _call(self, name):
+        self.calls.append(name)
+        if self.errors:
+            error = self.errors.pop(0)
+            if error is not None:
+                raise error
+
+    def values_batch_get(self, ranges):
+        self._call('values_batch_get')
+        value_ranges = []
+        for qualified in ranges:
+            sheet, _, a1 = qualified.partition('!')
+            rows = self.sheets[sheet[1:-1].replace("''", "'")].values(a1)
+            value_ranges.append({'range': qualified, 'values': rows} if rows else {'range': qualified})
+        return {'valueRanges': value_ranges}
+
+    def get_lastUpdateTime(self):
+        self._call('get_lastUpdateTime')
+        if self.modified is None:
+            raise FakeAPIError(403, 'Drive API has not been used in project')
+        return self.modified
+
+    def fetch_sheet_metadata(self, params=None):
+        self._call('fetch_sheet_metadata')
+        return {'sheets': [
+            {'properties': {'title': name, 'gridProperties': {'rowCount': ws.row_count}}}
+            for name, ws in self.sheets.items()
+        ]}
+
+
+class FakeClient:
+    """open_by_url theo {url: FakeSpreadsheet}"""
+
+    def __init__(self, spreadsheets):
+        self.spreadsheets = spreadsheets
+        self.opens = 0
+
+    def open_by_url(self, url):
+        self.opens += 1
+        return self.spreadsheets[url]
+
+
+HEADER = ['ngày tháng', 'bộ phận', 'số máy', 'sl thực tế', 'tgcb', 'chạy thử', 'gá lắp',
+          'gia công', 'dừng', 'dừng khác', 'sửa', 'giải trình']
+
+
+def make_rows(n, start=0):
+    """n dòng PHTCV giả lập (không kèm header)"""
+    rows = []
+    for i in range(start, start + n):
+        rows.append([
+            f'{i % 28 + 1:02d}/01/2026', f'Sản xuất {i % 2 + 1}', str(i % 20 + 40), '2',
+            '10', '5', '3,5', '12,7', '0', '0', '0', 'Chờ vật tư' if i % 7 == 0 else '',
+        ])
+    return rows
+
+
+def make_varied_rows(n, seed=0):
+    """
+    n dòng PHTCV đa dạng để so với cách tính cũ: 3 tháng, SX1 có cả máy tiện và phay, SX2 chỉ máy tiện,
+    sl thực tế trống / thập phân / lỗi, dừng bằng thời gian ca, ca dừng toàn bộ (máy 53 luôn dừng), ngày trống
+    """
+    rng = random.Random(seed)
+    machines = {'Sản xuất 1': [str(m) for m in range(40, 54)], 'Sản xuất 2': [str(m) for m in range(54, 62)]}
+    rows = []
+    for _ in range(n):
+        dept = rng.choice(list(machines))
+        machine = rng.choice(machines[dept])
+        day = f'{rng.randint(1, 28):02d}/{rng.randint(1, 3):02d}/2026' if rng.random() > 0.02 else ''
+        if machine == '53' or rng.random() < 0.15:
+            rows.append([day, dept, machine, '', '0', '0', '0', '0', rng.choice(['420', '630', '660']), '0', '0',
+                         'Hỏng máy'])
+            continue
+        rows.append([
+            day, dept, machine, rng.choice(['', '1', '2', '1,5', 'x']),
+            str(rng.randint(0, 30)), str(rng.randint(0, 10)), rng.choice(['0', '3,5', '12']),
+            rng.choice(['0', '45', '120,5']), rng.choice(['0', '15', '420']), rng.choice(['0', '30', '630']),
+            rng.choice(['0', '0', '20']), rng.choice(['', '', 'Chờ vật tư']),
+        ])
+    return rows
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+import pandas as pd
+import pytest
+
+from app_config import CONFIG
+from capacity_core import (
+    DAY_FULL_STOP, DAY_NO_DATA, DAY_RUNNING, CapacityCore, DailyCubeBuilder, aggregate_components,
+    aggregate_explanations, find_full_stop_machines, full_stop_days, machine_sort_key, rollup_capacity,
+    rollup_cube, rollup_explanations, rollup_machine_counts,
+)
+from fake_sheets import HEADER, make_varied_rows
+from phtcv_data import DateIndex, clean_phtcv_rows
+
+LATHE = CONFIG['lathe_machines']
+DEPTS = ['Sản xuất 1', 'Sản xuất 2']
+SHIFT_TIMES = [420, 630, 660]
+# machine_list: có cả máy không xuất hiện trong dữ liệu
+ALL_MACHINES = [str(m) for m in range(38, 64)]
+
+
+@pytest.fixture(scope='module')
+def df():
+    return clean_phtcv_rows(HEADER, make_varied_rows(600), LATHE)
+
+
+def quantity(df):
+    return pd.to_numeric(df['sl thực tế'].astype(str).str.replace(',', '.'), errors='coerce').fillna(1)
+
+
+def of_type(df, machine_type):
+    if machine_type == 'lathe':
+        return df[df['số máy'].isin(LATHE)]
+    if machine_type == 'milling':
+        return df[~df['số máy'].isin(LATHE)]
+    return df
+
+
+def baseline_capacity(df, machine_type):
+    """calculate_capacity_by_type trước khi gộp một lần groupby"""
+    df = of_type(df, machine_type)
+    sl = quantity(df)
+    times = {
+        'time_tgcb': df['tgcb'].sum(),
+        'time_chay_thu': df['chạy thử'].sum(),
+        'time_ga_lap': (df['gá lắp'] * sl).sum(),
+        'time_gia_cong': (df['gia công'] * sl).sum(),
+        'time_dung': df.loc[~df['dừng'].isin(SHIFT_TIMES), 'dừng'].sum(),
+        'time_dung_khac': df.loc[~df['dừng khác'].isin(SHIFT_TIMES), 'dừng khác'].sum(),
+        'time_sua': df['sửa'].sum(),
+    }
+    return times, sum(times.values())
+
+
+def baseline_machine_count(df, machine_type):
+    """calculate_machine_counts trước khi gộp: lặp từng máy"""
+    df = of_type(df, machine_type)
+    return sum(
+        1 for m in df['số máy'].unique()
+        if (df.loc[df['số máy'] == m, 'gia công'] * quantity(df[df['số máy'] == m])).sum() > 0
+    )
+
+
+@pytest.mark.parametrize('machine_type', ['all', 'lathe', 'milling'])
+@pytest.mark.parametrize('dept', DEPTS)
+def test_single_groupby_matches_per_machine_loops(df, dept, machine_type):
+    agg = aggregate_components(df, LATHE)
+    df_dept = df[df['bộ phận'] == dept]
+    times, total = baseline_capacity(df_dept, machine_type)
+    cap = rollup_capacity(agg, dept, machine_type)
+    if total == 0:
+        assert cap is None
+        return
+    assert cap.total_time == pytest.approx(total)
+    for name, value in times.items():
+        assert getattr(cap, name) == pytest.approx(value)
+    assert cap.running_machines == rollup_machine_counts(agg, dept, machine_type)
+    assert cap.running_machines == baseline_machine_count(df_dept, machine_type)
+
+
+def sorted_agg(agg):
+    keys = list(agg.index.names)
+    return agg.reset_index().astype({'bộ phận': str, 'số máy': str}).set_index(keys).sort_index()
+
+
+def test_daily_cube_rolls_up_to_raw_row_sums(df):
+    date_index = DateIndex(df)
+    cube = DailyCubeBuilder(LATHE).update(date_index)
+    month = date_index.month_options()[0]
+    day = date_index.day_options(month)[0]
+    for selection in [(None, None), (month, None), (month, day)]:
+        rows = date_index.select(*selection)
+        cells = cube.select(*selection)
+        assert len(cells) < len(rows)
+        pd.testing.assert_frame_equal(
+            sorted_agg(rollup_cube(cells)), sorted_agg(aggregate_components(rows, LATHE))
+        )
+        expected = aggregate_explanations(rows)
+        explanations = rollup_explanations(cells)
+        assert explanations.sort_index().to_dict() == expected.sort_index().to_dict()
+
+
+def baseline_machines_of_type(machines_in_data, all_machines_full):
+    has_lathe = any(m in LATHE for m in machines_in_data)
+    has_milling = any(m not in LATHE for m in machines_in_data)
+    if has_lathe and not has_milling:
+        return [m for m in all_machines_full if m in LATHE], "máy tiện"
+    if has_milling and not has_lathe:
+        return [m for m in all_machines_full if m not in LATHE], "máy phay"
+    return all_machines_full, "máy"
+
+
+def baseline_is_stopped(df_machine):
+    has_shift_stop = df_machine['dừng'].max() >= 420 or df_machine['dừng khác'].max() >= 420
+    has_no_production = all(df_machine[c].sum() == 0 for c in ['tgcb', 'chạy thử', 'gá lắp', 'gia công'])
+    return has_shift_stop and has_no_production
+
+
+def baseline_full_stop(df_dept, all_machines_full):
+    """Tab "Máy dừng 100%" trước khi vector hóa: lặp từng máy, mask frame của phân xưởng"""
+    machines_in_data = df_dept['số máy'].unique().tolist()
+    all_machines, label = baseline_machines_of_type(machines_in_data, all_machines_full)
+
+    machines_not_in_data = [m for m in all_machines if m not in machines_in_data]
+    stopped = []
+    for machine in machines_in_data:
+        if machine not in all_machines:
+            continue
+        if baseline_is_stopped(df_dept[df_dept['số máy'] == machine]):
+            stopped.append(machine)
+    all_stopped = sorted(set(machines_not_in_data + stopped), key=lambda x: int(x) if x.isdigit() else float('inf'))
+    return all_stopped, set(machines_not_in_data), label
+
+
+def test_core_memoizes_compact_results(df):
+    date_index = DateIndex(df, version=1)
+    cube = DailyCubeBuilder(LATHE).update(date_index)
+    month = date_index.month_options()[0]
+    core = CapacityCore(max_entries=8)
+
+    cap = core.capacity(cube, month, None, 'Sản xuất 1', 'lathe')
+    assert cap == rollup_capacity(aggregate_components(date_index.select(month), LATHE), 'Sản xuất 1', 'lathe')
+    assert not hasattr(cap, '__dict__')  # Bản ghi slotted, không phải dict time_* / pct_*
+    assert cap.pct_gia_cong == pytest.approx(cap.time_gia_cong / cap.total_time * 100)
+
+    hits = core.hits
+    assert core.capacity(cube, month, None, 'Sản xuất 1', 'lathe') is cap
+    assert core.hits == hits + 1
+
+    # Dữ liệu đổi phiên bản -> tính lại; bộ nhớ giới hạn max_entries
+    reloaded = DailyCubeBuilder(LATHE).update(DateIndex(df, version=2))
+    assert core.capacity(reloaded, month, None, 'Sản xuất 1', 'lathe') is not cap
+    for day in date_index.day_options(month):
+        core.capacity(cube, month, day, 'Sản xuất 1')
+    assert len(core._memo) <= 8
+
+
+@pytest.mark.parametrize('dept', DEPTS)
+def test_core_full_stop_matches_baseline(df, dept):
+    date_index = DateIndex(df)
+    cube = DailyCubeBuilder(LATHE).update(date_index)
+    core = CapacityCore()
+    for month in [None] + date_index.month_options():
+        rows = date_index.select(month)
+        expected = baseline_full_stop(rows[rows['bộ phận'] == dept], ALL_MACHINES)
+        assert core.full_stop(cube, month, None, dept, ALL_MACHINES, LATHE) == expected
+
+
+@pytest.mark.parametrize('dept', DEPTS)
+def test_full_stop_machines_match_baseline(df, dept):
+    date_index = DateIndex(df)
+    cube = DailyCubeBuilder(LATHE).update(date_index)
+    for month in [None] + date_index.month_options():
+        rows = date_index.select(month)
+        expected = baseline_full_stop(rows[rows['bộ phận'] == dept], ALL_MACHINES)
+        assert find_full_stop_machines(cube.select(month), dept, ALL_MACHINES, LATHE) == expected
+
+
+@pytest.mark.parametrize('dept', DEPTS)
+def test_full_stop_days_match_baseline_per_day(df, dept):
+    date_index = DateIndex(df)
+    cube = DailyCubeBuilder(LATHE).update(date_index)
+    month = date_index.month_options()[0]
+    rows = date_index.select(month)
+    df_dept = rows[(rows['bộ phận'] == dept) & rows['date_parsed'].notna()]
+    machines, _ = baseline_machines_of_type(df_dept['số máy'].unique().tolist(), ALL_MACHINES)
+
+    matrix = full_stop_days(cube.select(month), dept, ALL_MACHINES, LATHE)
+    assert list(matrix.index) == sorted(set(machines), key=machine_sort_key)
+    assert list(matrix.columns) == sorted(df_dept['date_parsed'].dt.date.unique())
+    for day in matrix.columns:
+        df_day = df_dept[df_dept['date_parsed'].dt.date == day]
+        for machine in matrix.index:
+            df_machine = df_day[df_day['số máy'] == machine]
+            if df_machine.empty:
+                expected = DAY_NO_DATA
+            else:
+                expected = DAY_FULL_STOP if baseline_is_stopped(df_machine) else DAY_RUNNING
+            assert matrix.loc[machine, day] == expected, (machine, day)
+    # Máy dừng toàn bộ ca một ngày nhưng cả tháng vẫn chạy: chỉ ma trận theo ngày mới thấy
+    stopped_in_month, _, _ = find_full_stop_machines(cube.select(month), dept, ALL_MACHINES, LATHE)
+    stopped_some_day = matrix.index[(matrix == DAY_FULL_STOP).any(axis=1)]
+    assert set(stopped_some_day) - set(stopped_in_month)
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from capacity_core import DailyCubeBuilder
+from capacity_trend import MonthlyTrend
+from fake_sheets import HEADER, make_rows
+from phtcv_data import DateIndex, clean_phtcv_rows
+
+TODAY = datetime.date(2026, 3, 15)
+
+
+def make_indexes(rows, version=1):
+    date_index = DateIndex(clean_phtcv_rows(HEADER, rows), version=version)
+    return date_index, DailyCubeBuilder().update(date_index)
+
+
+def gia_cong(agg):
+    return float(agg['time_gia_cong'].sum())
+
+
+def test_closed_month_recomputed_when_values_change_but_row_count_does_not(tmp_path):
+    rows = make_rows(30)
+    trend = MonthlyTrend(cache_dir=str(tmp_path), source_id='sheet-a')
+    before = trend.aggregates(*make_indexes(rows), ['2026-01'], today=TODAY)['2026-01']
+
+    rows[0][7] = '100'  # Sửa thời gian gia công một dòng của tháng đã đóng
+    after = trend.aggregates(*make_indexes(rows, version=2), ['2026-01'], today=TODAY)['2026-01']
+    assert gia_cong(after) > gia_cong(before)
+
+    # Khởi động lại cùng nguồn: dùng tháng đã lưu; nguồn khác: bỏ file cache
+    restarted = MonthlyTrend(cache_dir=str(tmp_path), source_id='sheet-a')
+    assert gia_cong(restarted._closed['2026-01'][1]) == gia_cong(after)
+    assert MonthlyTrend(cache_dir=str(tmp_path), source_id='sheet-b')._closed == {}
+
+
+class CountingCube:
+    """Bọc cube_index, đếm số lần dựng cube một tháng"""
+
+    def __init__(self, cube_index):
+        self.cube_index = cube_index
+        self.version = cube_index.version
+        self.selects = []
+
+    def select(self, month=None, day=None):
+        self.selects.append(month)
+        return self.cube_index.select(month, day)
+
+
+def test_rerun_does_not_rebuild_closed_month_cubes():
+    date_index, cube_index = make_indexes(make_rows(30))
+    trend = MonthlyTrend()
+    trend.aggregates(date_index, CountingCube(cube_index), ['2026-01'], today=TODAY)
+
+    rerun = CountingCube(cube_index)
+    trend.aggregates(date_index, rerun, ['2026-01'], today=TODAY)
+    assert rerun.selects == []
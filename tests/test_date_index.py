@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from fake_sheets import HEADER, make_rows, make_varied_rows
+from phtcv_data import DateIndex, append_rows, clean_phtcv_rows
+
+
+@pytest.fixture(scope='module')
+def df():
+    return clean_phtcv_rows(HEADER, make_varied_rows(400))
+
+
+def masked(df, month=None, day=None):
+    """Lọc như main() trước khi có chỉ mục ngày: quét boolean toàn frame"""
+    mask = df['date_parsed'].notna()
+    if month is not None:
+        mask &= df['date_parsed'].dt.to_period('M').astype(str) == month
+    if day is not None:
+        mask &= df['date_parsed'].dt.date == day
+    return df[mask].sort_values('date_parsed', kind='stable').reset_index(drop=True)
+
+
+def test_options_match_full_scans(df):
+    index = DateIndex(df)
+    dates = df['date_parsed'].dropna()
+    assert index.month_options() == sorted(dates.dt.to_period('M').astype(str).unique(), reverse=True)
+    assert index.day_options() == sorted(dates.dt.date.unique(), reverse=True)
+    for month in index.month_options():
+        days = dates[dates.dt.to_period('M').astype(str) == month].dt.date.unique()
+        assert index.day_options(month) == sorted(days, reverse=True)
+
+
+def test_slices_match_boolean_masks(df):
+    index = DateIndex(df)
+    assert len(index) == len(df)  # Dòng không có ngày vẫn giữ (ở cuối frame)
+    for month in index.month_options():
+        assert index.select(month).reset_index(drop=True).equals(masked(df, month))
+        assert index.count(month) == len(masked(df, month))
+        for day in index.day_options(month)[:3]:
+            assert index.select(month, day).reset_index(drop=True).equals(masked(df, month, day))
+            assert index.select(None, day).reset_index(drop=True).equals(masked(df, day=day))
+
+
+def test_day_outside_month_is_empty(df):
+    index = DateIndex(df)
+    first, second = index.month_options()[:2]
+    assert index.count(first, index.day_options(second)[0]) == 0
+    assert index.count('1999-01') == 0
+
+
+def test_append_rows_leaves_new_rows_untouched():
+    old = clean_phtcv_rows(HEADER, make_rows(20))
+    new_df = clean_phtcv_rows(HEADER, make_varied_rows(50))
+    categories = new_df['số máy'].cat.categories.copy()
+
+    combined = append_rows(old, new_df)
+    assert len(combined) == 70
+    assert set(combined['số máy'].cat.categories) == set(categories) | set(old['số máy'].cat.categories)
+    # new_df được giữ trong DateIndex.deltas: danh mục gốc không đổi
+    assert new_df['số máy'].cat.categories.equals(categories)
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+from phtcv_export import export_frame, to_csv_bytes, to_excel_bytes
+
+
+def make_frame():
+    return pd.DataFrame({
+        'số máy': ['40', '41', '42', '43', '44'],
+        'thời gian chạy': np.array([2.3, 0.1, np.nan, 123.4, 1234.7], dtype='float32'),
+        'sl_thuc_te': [1.0, 2.0, 3.0, 4.0, 5.0],
+    })
+
+
+def test_float32_columns_export_at_source_precision():
+    df = make_frame()
+    out = export_frame(df)
+    assert 'sl_thuc_te' not in out.columns
+    assert out['thời gian chạy'].dtype == 'float64'
+    assert out['thời gian chạy'].tolist()[:2] == [2.3, 0.1]
+    assert out['thời gian chạy'].tolist()[3:] == [123.4, 1234.7]
+    assert np.isnan(out['thời gian chạy'].iloc[2])
+    # Frame gốc (đang dùng chung trong cache) không bị sửa
+    assert df['thời gian chạy'].dtype == 'float32'
+
+    csv = to_csv_bytes(df).decode('utf-8-sig')
+    assert '2.299999' not in csv
+
+    ws = load_workbook(BytesIO(to_excel_bytes(df))).active
+    assert [c.value for c in ws['B']][1:] == [2.3, 0.1, None, 123.4, 1234.7]
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from capacity_core import COMPONENTS, DailyCubeBuilder
+from fake_sheets import HEADER, FakeClient, FakeSpreadsheet, FakeWorksheet, make_rows, make_varied_rows
+from phtcv_data import DateIndex, PhtcvSync, clean_phtcv_rows
+from phtcv_store import PhtcvStore
+from sheets_gateway import SheetsGateway
+
+URL = 'https://sheets.test/live'
+
+
+def test_append_refuses_rows_the_store_already_holds(tmp_path):
+    store = PhtcvStore(str(tmp_path / 'phtcv.sqlite'))
+    store.replace(clean_phtcv_rows(HEADER, make_rows(10)))
+    new_df = clean_phtcv_rows(HEADER, make_rows(5, start=10))
+
+    assert store.append(new_df, expected_rows=10)
+    # Người gọi vẫn thấy 10 dòng (chưa biết lần nối trên) -> không nối trùng
+    assert not store.append(new_df, expected_rows=10)
+    assert store.load_meta()['row_count'] == 15
+
+
+def test_stale_replica_resyncs_from_the_store(tmp_path):
+    worksheet = FakeWorksheet([HEADER] + make_rows(40))
+    gateway = SheetsGateway(FakeClient({URL: FakeSpreadsheet({'PHTCV': worksheet})}), URL)
+    path = str(tmp_path / 'phtcv.sqlite')
+    first = PhtcvSync(store=PhtcvStore(path))
+    second = PhtcvSync(store=PhtcvStore(path))
+    first.sync(gateway.fetcher('PHTCV'))
+    assert second.load_snapshot()
+
+    worksheet.rows += make_rows(5, start=40)
+    first.sync(gateway.fetcher('PHTCV'))
+    # second vẫn giữ trạng thái 40 dòng: đồng bộ lại từ kho thay vì nối lại 5 dòng đã có
+    worksheet.rows += make_rows(3, start=45)
+    index = second.sync(gateway.fetcher('PHTCV'))
+    assert second.last_mode == 'incremental'
+    assert len(index) == 48
+    assert second.row_count == 48
+    assert first.store.load_meta()['row_count'] == 48
+
+
+def test_month_totals_match_the_memory_cube(tmp_path):
+    rows = make_varied_rows(300)
+    df = clean_phtcv_rows(HEADER, rows)
+    store = PhtcvStore(str(tmp_path / 'phtcv.sqlite'))
+    store.replace(df)
+    memory_cube = DailyCubeBuilder().update(DateIndex(df, version=1))
+
+    totals = store.date_index().cube().month_totals(['2025-12', '2026-01'])
+    assert totals['2025-12'].sum() == 0
+    expected = memory_cube.select('2026-01')[COMPONENTS].sum()
+    assert np.allclose(totals['2026-01'][COMPONENTS], expected)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from fake_sheets import HEADER, FakeClient, FakeSpreadsheet, FakeWorksheet, make_rows
+from phtcv_data import PhtcvSync
+from sheets_gateway import SheetsGateway
+
+URL = 'https://sheets.test/live'
+
+
+def make_gateway(worksheet):
+    spreadsheet = FakeSpreadsheet({'PHTCV': worksheet})
+    return SheetsGateway(FakeClient({URL: spreadsheet}), URL), spreadsheet
+
+
+def test_incremental_sync_when_data_fills_the_grid():
+    rows = make_rows(20)
+    worksheet = FakeWorksheet([HEADER] + rows, grid_rows=len(rows) + 1)
+    gateway, spreadsheet = make_gateway(worksheet)
+    sync = PhtcvSync()
+    sync.sync(gateway.fetcher('PHTCV'))
+
+    # Dòng mới bắt đầu sau dòng cuối của lưới -> 400 'exceeds grid limits' = chưa có dòng mới
+    index = sync.sync(gateway.fetcher('PHTCV'))
+    assert sync.last_mode == 'incremental'
+    assert len(index) == 20
+    assert 'fetch_sheet_metadata' in spreadsheet.calls
+
+    # Sheet mở rộng lưới khi nối thêm dòng
+    worksheet.rows += make_rows(3, start=20)
+    worksheet.grid_rows += 3
+    index = sync.sync(gateway.fetcher('PHTCV'))
+    assert sync.last_mode == 'incremental'
+    assert len(index) == 23
+
+
+def test_grid_limit_only_empties_the_ranges_past_the_grid():
+    worksheet = FakeWorksheet([HEADER] + make_rows(5), grid_rows=6)
+    gateway, spreadsheet = make_gateway(worksheet)
+
+    header, past_grid, tail = gateway.batch_get([('PHTCV', '1:1'), ('PHTCV', 'A7:L'), ('PHTCV', 'A5:L6')])
+    assert header == [HEADER]
+    assert past_grid == []
+    assert len(tail) == 2
+
+
+def test_chunked_load_reads_past_blank_rows_at_a_block_boundary():
+    # Khối 1 (dòng 2-11) kết thúc bằng 3 dòng trống, dữ liệu tiếp tục ở khối 2, khối 3
+    rows = make_rows(7) + [[''] * len(HEADER)] * 3 + make_rows(15, start=7)
+    gateway, _ = make_gateway(FakeWorksheet([HEADER] + rows))
+
+    full = PhtcvSync()
+    expected = full.sync(gateway.fetcher('PHTCV')).df
+    chunked = PhtcvSync(chunk_rows=10)
+    index = chunked.sync(gateway.fetcher('PHTCV'))
+
+    assert len(index) == len(expected) == len(rows)
+    assert index.df.reset_index(drop=True).equals(expected.reset_index(drop=True))
+    assert chunked.row_count == full.row_count == len(rows)
+
+    # Đồng bộ tăng dần sau đó khớp các dòng cuối, không tải lại
+    chunked.sync(gateway.fetcher('PHTCV'))
+    assert chunked.last_mode == 'incremental'
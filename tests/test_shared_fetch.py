@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import os
+import time
+
+from shared_fetch import SharedFetch
+
+PROCESSES = 6
+
+
+def worker(cache_dir, barrier, results):
+    calls_path = os.path.join(cache_dir, 'calls.log')
+    result_path = os.path.join(cache_dir, 'result.txt')
+
+    def fetch():
+        with open(calls_path, 'a', encoding='utf-8') as f:
+            f.write(f'{os.getpid()}\n')
+        time.sleep(0.3)  # API chậm: các tiến trình khác đang chờ khóa
+        with open(result_path, 'w', encoding='utf-8') as f:
+            f.write('data')
+        return 'data'
+
+    def read_shared():
+        try:
+            with open(result_path, encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    barrier.wait()
+    results.put(SharedFetch(cache_dir, ttl=60).run(fetch, read_shared))
+
+
+def test_concurrent_processes_fetch_once(tmp_path):
+    cache_dir = str(tmp_path)
+    barrier = multiprocessing.Barrier(PROCESSES)
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=worker, args=(cache_dir, barrier, results))
+                 for _ in range(PROCESSES)]
+    for p in processes:
+        p.start()
+    data = [results.get(timeout=30) for _ in processes]
+    for p in processes:
+        p.join(timeout=30)
+
+    assert data == ['data'] * PROCESSES
+    with open(os.path.join(cache_dir, 'calls.log'), encoding='utf-8') as f:
+        assert len(f.read().splitlines()) == 1
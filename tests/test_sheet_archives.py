@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import pandas as pd
+
+from fake_sheets import HEADER, FakeClient, FakeSpreadsheet, FakeWorksheet, make_rows
+from phtcv_data import DateIndex, clean_phtcv_rows
+from phtcv_sources import SheetArchives, combine_date_indexes
+from sheets_gateway import SheetsGateway
+
+
+def year_rows(n, year, start=0):
+    rows = make_rows(n, start=start)
+    for row in rows:
+        row[0] = row[0].replace('2026', str(year))
+    return rows
+
+
+def norm(df):
+    return df.astype({'bộ phận': str, 'số máy': str}).reset_index(drop=True)
+
+
+def assert_same_index(combined, rows):
+    expected = DateIndex(clean_phtcv_rows(HEADER, rows))
+    pd.testing.assert_frame_equal(norm(combined.df), norm(expected.df))
+    assert combined.months == expected.months
+    assert combined.days == expected.days
+    assert combined.month_days == expected.month_days
+
+
+def test_combine_appends_live_rows_without_resorting():
+    # Dòng không đọc được ngày (NaT) ở cả hai phần vẫn nằm cuối frame ghép
+    archive_rows = year_rows(20, 2025) + [['??'] + make_rows(1)[0][1:]]
+    live_rows = year_rows(10, 2026) + [[''] + make_rows(1)[0][1:]]
+    archive = DateIndex(clean_phtcv_rows(HEADER, archive_rows))
+    live = DateIndex(clean_phtcv_rows(HEADER, live_rows))
+    assert_same_index(combine_date_indexes(archive, live), archive_rows + live_rows)
+
+
+def test_combine_resorts_when_dates_overlap():
+    archive_rows = year_rows(20, 2026)
+    live_rows = year_rows(10, 2026, start=3)
+    archive = DateIndex(clean_phtcv_rows(HEADER, archive_rows))
+    live = DateIndex(clean_phtcv_rows(HEADER, live_rows))
+    assert_same_index(combine_date_indexes(archive, live), archive_rows + live_rows)
+
+
+def test_archives_merge_years_into_one_index(tmp_path):
+    years = {f'https://sheets.test/{y}': year_rows(15, y) for y in (2024, 2025)}
+    client = FakeClient({url: FakeSpreadsheet({'PHTCV': FakeWorksheet([HEADER] + rows)})
+                         for url, rows in years.items()})
+    archives = SheetArchives([{'url': url} for url in years], lambda url: SheetsGateway(client, url),
+                             cache_dir=str(tmp_path))
+    index = archives.load()
+    assert_same_index(index, [r for rows in years.values() for r in rows])
+    assert archives.load() is index
+
+    # Khởi động lại: đọc từ cache trên đĩa, cùng phiên bản
+    restarted = SheetArchives([{'url': url} for url in years], lambda url: None, cache_dir=str(tmp_path))
+    assert restarted.cached().version == index.version
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import sheets_gateway
+from fake_sheets import HEADER, FakeAPIError, FakeClient, FakeSpreadsheet, FakeWorksheet, make_rows
+from sheets_gateway import RateLimiter, SheetsGateway
+
+URL = 'https://sheets.test/live'
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Không chờ thật; ghi lại các khoảng chờ backoff (jitter cố định = 1)"""
+    delays = []
+    monkeypatch.setattr(sheets_gateway.time, 'sleep', delays.append)
+    monkeypatch.setattr(sheets_gateway.random, 'uniform', lambda a, b: b)
+    return delays
+
+
+def make_gateway(rows=None, **kwargs):
+    spreadsheet = FakeSpreadsheet({'PHTCV': FakeWorksheet([HEADER] + (rows or make_rows(5)))})
+    return SheetsGateway(FakeClient({URL: spreadsheet}), URL, **kwargs), spreadsheet
+
+
+def test_retries_quota_errors_with_exponential_backoff(sleeps):
+    gateway, spreadsheet = make_gateway(backoff_base=1.0, backoff_max=3.0)
+    spreadsheet.errors = [FakeAPIError(429), FakeAPIError(503), FakeAPIError(429)]
+
+    rows = gateway.batch_get([('PHTCV', '1:1')])[0]
+
+    assert rows == [HEADER]
+    assert gateway.retries == 3
+    assert spreadsheet.calls.count('values_batch_get') == 4
+    assert sleeps == [1.0, 2.0, 3.0]  # 1, 2, 4 -> tối đa backoff_max
+
+
+def test_gives_up_after_max_retries(sleeps):
+    gateway, spreadsheet = make_gateway(max_retries=2)
+    spreadsheet.errors = [FakeAPIError(429)] * 3
+
+    with pytest.raises(FakeAPIError):
+        gateway.batch_get([('PHTCV', '1:1')])
+    assert gateway.retries == 2
+
+
+def test_non_retryable_error_is_raised_immediately(sleeps):
+    gateway, spreadsheet = make_gateway()
+    spreadsheet.errors = [FakeAPIError(403)]
+
+    with pytest.raises(FakeAPIError):
+        gateway.batch_get([('PHTCV', '1:1')])
+    assert gateway.retries == 0
+    assert sleeps == []
+
+
+def test_modified_time_disabled_without_drive_api(sleeps):
+    gateway, spreadsheet = make_gateway()
+    spreadsheet.modified = None
+
+    assert gateway.modified_time() is None
+    assert not gateway.supports_modified_time
+    assert gateway.modified_time() is None
+    assert spreadsheet.calls.count('get_lastUpdateTime') == 1
+
+
+def test_rate_limiter_waits_when_window_is_full(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(sheets_gateway.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(sheets_gateway.time, 'sleep', lambda s: now.__setitem__(0, now[0] + s))
+    limiter = RateLimiter(2, period=60)
+
+    assert limiter.acquire() == 0
+    assert limiter.acquire() == 0
+    assert limiter.acquire() == pytest.approx(60)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+from background_refresh import StaleWhileRevalidate
+from fake_sheets import HEADER, FakeClient, FakeSpreadsheet, FakeWorksheet, make_rows
+from phtcv_data import PhtcvSync
+from phtcv_sources import SheetArchives, SheetsSource
+from phtcv_store import PhtcvStore
+from shared_fetch import SharedFetch
+from sheets_gateway import SheetsGateway
+
+URL = 'https://sheets.test/live'
+
+
+def make_source(rows, chunk_rows=0):
+    worksheet = FakeWorksheet([HEADER] + rows)
+    spreadsheet = FakeSpreadsheet({'PHTCV': worksheet, 'machine_list': FakeWorksheet([['Số máy'], ['40']])})
+    gateway = SheetsGateway(FakeClient({URL: spreadsheet}), URL)
+    source = SheetsSource(lambda: gateway, PhtcvSync(chunk_rows=chunk_rows), ['machine_list'])
+    return source, spreadsheet, worksheet
+
+
+def test_unchanged_spreadsheet_costs_one_call():
+    source, spreadsheet, worksheet = make_source(make_rows(30))
+    first = source.load()
+    assert len(first['PHTCV']) == 30
+    assert first['machine_list'] == [['Số máy'], ['40']]
+
+    spreadsheet.calls.clear()
+    second = source.load()
+    assert spreadsheet.calls == ['get_lastUpdateTime']
+    assert second['api_calls'] == 1
+    assert second['PHTCV'] is first['PHTCV']
+    assert second['machine_list'] == first['machine_list']
+
+
+def test_modified_spreadsheet_syncs_incrementally():
+    source, spreadsheet, worksheet = make_source(make_rows(30))
+    source.load()
+
+    worksheet.rows += make_rows(5, start=30)
+    spreadsheet.modified = '2026-01-02T00:00:00.000Z'
+    data = source.load()
+    assert source.sync.last_mode == 'incremental'
+    assert len(data['PHTCV']) == 35
+
+
+def test_forced_reload_ignores_modified_time():
+    source, spreadsheet, worksheet = make_source(make_rows(30))
+    source.load()
+
+    source.request_full_reload()
+    spreadsheet.calls.clear()
+    source.load()
+    assert source.sync.last_mode == 'full'
+    assert 'values_batch_get' in spreadsheet.calls
+
+
+def test_chunked_load_is_confirmed_before_skipping():
+    # Sau lần tải theo khối, lần làm mới kế tiếp vẫn đồng bộ tăng dần dù modifiedTime không đổi
+    source, spreadsheet, worksheet = make_source(make_rows(30), chunk_rows=10)
+    source.load()
+    assert source.sync.last_mode == 'full'
+
+    spreadsheet.calls.clear()
+    source.load()
+    assert source.sync.last_mode == 'incremental'
+    assert 'values_batch_get' in spreadsheet.calls
+
+    spreadsheet.calls.clear()
+    source.load()
+    assert spreadsheet.calls == ['get_lastUpdateTime']
+
+
+def test_failed_refresh_keeps_value_and_backs_off():
+    calls = []
+
+    def loader():
+        calls.append(1)
+        if len(calls) > 1:
+            raise RuntimeError('quota')
+        return 'v1'
+
+    cache = StaleWhileRevalidate(loader, ttl=0, retry_after=30, max_retry_after=100)
+    assert cache.get() == 'v1'
+    for expected in [30, 60, 100, 100]:
+        cache.refresh()
+        assert cache.value == 'v1'
+        assert cache.next_retry_after == expected
+
+    cache._start_background_refresh()  # Trong khoảng chờ: không thử lại
+    assert len(calls) == 5
+
+
+def test_machine_list_change_saves_snapshot(tmp_path):
+    # machine_list đổi nhưng PHTCV không thêm dòng: snapshot vẫn phải ghi machine_list mới
+    worksheet = FakeWorksheet([HEADER] + make_rows(30))
+    machine_list = FakeWorksheet([['Số máy'], ['40']])
+    spreadsheet = FakeSpreadsheet({'PHTCV': worksheet, 'machine_list': machine_list})
+    gateway = SheetsGateway(FakeClient({URL: spreadsheet}), URL)
+    snapshot_path = str(tmp_path / 'phtcv.parquet')
+    source = SheetsSource(lambda: gateway, PhtcvSync(snapshot_path=snapshot_path), ['machine_list'])
+    source.load()
+
+    machine_list.rows.append(['41'])
+    spreadsheet.modified = '2026-01-02T00:00:00.000Z'
+    source.load()
+    assert source.sync.last_mode == 'incremental'
+
+    restarted = PhtcvSync(snapshot_path=snapshot_path)
+    assert restarted.load_snapshot()
+    assert restarted.extras['machine_list'] == [['Số máy'], ['40'], ['41']]
+
+
+def test_refresh_counts_archive_calls():
+    archive_url = 'https://sheets.test/2025'
+    spreadsheet = FakeSpreadsheet({'PHTCV': FakeWorksheet([HEADER] + make_rows(30)),
+                                   'machine_list': FakeWorksheet([['Số máy'], ['40']])})
+    archive = FakeSpreadsheet({'PHTCV': FakeWorksheet([HEADER] + make_rows(20))})
+    client = FakeClient({URL: spreadsheet, archive_url: archive})
+    gateway = SheetsGateway(client, URL)
+    archives = SheetArchives(
+        [{'url': archive_url}],
+        lambda url: SheetsGateway(client, url, rate_limiter=gateway.rate_limiter, counter=gateway.counter),
+    )
+    source = SheetsSource(lambda: gateway, PhtcvSync(), ['machine_list'], archives=archives)
+
+    data = source.load()
+    assert len(data['PHTCV']) == 50
+    # Sheet đang ghi: modifiedTime + tải toàn bộ; lưu trữ: mở spreadsheet + tải toàn bộ
+    assert data['api_calls'] == len(spreadsheet.calls) + len(archive.calls) + client.opens
+    assert gateway.last_refresh_calls == data['api_calls']
+
+
+def test_shared_store_replicas_take_turns_as_leader(tmp_path):
+    worksheet = FakeWorksheet([HEADER] + make_rows(40))
+    spreadsheet = FakeSpreadsheet({'PHTCV': worksheet})
+    gateway = SheetsGateway(FakeClient({URL: spreadsheet}), URL)
+    path = str(tmp_path / 'phtcv.sqlite')
+    shared = SharedFetch(str(tmp_path), ttl=0)  # ttl=0: mỗi lần tải đều làm leader
+    first, second = [SheetsSource(lambda: gateway, PhtcvSync(store=PhtcvStore(path)), shared=shared)
+                     for _ in range(2)]
+    first.load()
+
+    worksheet.rows += make_rows(5, start=40)
+    spreadsheet.modified = '2026-01-02T00:00:00.000Z'
+    assert len(second.load()['PHTCV']) == 45
+
+    # first còn giữ trạng thái 40 dòng: nạp lại trạng thái chung rồi chỉ đọc phần mới (một lần tải)
+    worksheet.rows += make_rows(3, start=45)
+    spreadsheet.modified = '2026-01-03T00:00:00.000Z'
+    spreadsheet.calls.clear()
+    data = first.load()
+    assert first.sync.last_mode == 'incremental'
+    assert spreadsheet.calls.count('values_batch_get') == 1
+    assert len(data['PHTCV']) == 48
+    assert first.sync.store.load_meta()['row_count'] == 48